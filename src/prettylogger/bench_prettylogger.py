@@ -0,0 +1,44 @@
+# Microbenchmark of PrettyLogger: what a disabled debug() costs with the
+# message built eagerly, lazily through %-style arguments and through a
+# callable, and what enabled output costs with and without buffering. Run it
+# directly:
+#
+#   python bench_prettylogger.py
+import os
+import sys
+sys.path.insert(0,os.path.abspath(os.path.dirname(__file__)))
+import timeit
+from prettylogger.core import PrettyLogger, StreamHandler, BufferedHandler, BackgroundHandler
+
+# Stands in for something that is expensive to turn into a string, like the
+# configuration sections core.getListOfBinaries logs.
+class Section:
+  def __str__(self):
+    return ", ".join(["option%d = value%d" % (i, i) for i in range(50)])
+
+def timePerCall(aFunction, aRuns):
+  return timeit.Timer(aFunction).timeit(aRuns) / aRuns * 1e6
+
+def main():
+  section = Section()
+  runs = 100000
+  disabled = PrettyLogger(aDebugEnabled=False)
+  print("disabled debug(), per call:")
+  print("  no message:      %8.3f us" % timePerCall(lambda: None, runs))
+  print("  eager str():     %8.3f us" % timePerCall(lambda: disabled.debug("section: " + str(section)), runs))
+  print("  lazy %%s:         %8.3f us" % timePerCall(lambda: disabled.debug("section: %s", section), runs))
+  print("  lazy callable:   %8.3f us" % timePerCall(lambda: disabled.debug(lambda: "section: " + str(section)), runs))
+
+  runs = 20000
+  devnull = open(os.devnull, 'w')
+  print("enabled debug() to %s, per call:" % os.devnull)
+  for (name, handler) in (("stream", StreamHandler(devnull)),
+                          ("buffered", BufferedHandler(StreamHandler(devnull))),
+                          ("background", BackgroundHandler(StreamHandler(devnull)))):
+    logger = PrettyLogger(aDebugEnabled=True, aHandler=handler)
+    print("  %-16s %8.3f us" % (name + ":", timePerCall(lambda: logger.debug("build %d of %d", 1, 2), runs)))
+    logger.close()
+  devnull.close()
+
+if __name__ == '__main__':
+  main()
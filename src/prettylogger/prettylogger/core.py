@@ -1,6 +1,131 @@
 #TEST
+import json
+import sys
+import threading
+import time
+import Queue
 from colors import *
 
+# The prefix each type of message is printed with, and the color function (from
+# the colors module) that prefix is shown in when color is enabled.
+PREFIXES = {
+  'debug' : ("DEBUG: ", blue),
+  'info' : ("INFO: ", green),
+  'warn' : ("WARNING: ", yellow),
+  'error' : ("ERROR: ", red),
+}
+
+# Turn a message as given to one of the PrettyLogger's output methods into the
+# string to print. The message is only formatted here, once it's known to be
+# printed, so disabled output doesn't pay for it.
+#
+# @param aMessage The message: a string, a %-style format string for aArgs,
+#        or a callable returning the message.
+# @param aArgs The arguments of a %-style format string, if any.
+def formatMessage(aMessage, aArgs=()):
+  if callable(aMessage):
+    aMessage = aMessage()
+  if aArgs:
+    return str(aMessage) % aArgs
+  return str(aMessage)
+
+# Writes each line to a stream as it's logged: sys.stdout as it is when the line
+# is written, unless another stream is given.
+class StreamHandler:
+  def __init__(self, aStream=None):
+    self.mStream = aStream
+
+  def getStream(self):
+    return self.mStream or sys.stdout
+
+  # @param aType The type of message - one of debug, info, warn, or error, or
+  #        None for a message printed verbatim.
+  # @param aMessage The formatted message, without a prefix.
+  # @param aLine The line to print: the message with its prefix, in color if
+  #        the PrettyLogger has color enabled.
+  def emit(self, aType, aMessage, aLine):
+    self.getStream().write(aLine + "\n")
+
+  def flush(self):
+    self.getStream().flush()
+
+  def close(self):
+    self.flush()
+
+# Writes one JSON object per line to a stream, for other programs to read:
+# the time, the type and the message, without prefix or color.
+class JsonLinesHandler(StreamHandler):
+  def emit(self, aType, aMessage, aLine):
+    record = {'time' : time.time(), 'type' : aType, 'message' : aMessage}
+    self.getStream().write(json.dumps(record) + "\n")
+
+# Holds the lines logged until aCapacity of them have been, then hands them all
+# to aHandler at once. Errors are passed on right away, along with everything
+# before them.
+class BufferedHandler:
+  def __init__(self, aHandler=None, aCapacity=256):
+    self.mHandler = aHandler or StreamHandler()
+    self.mCapacity = aCapacity
+    self.mBuffer = []
+    self.mLock = threading.Lock()
+
+  def emit(self, aType, aMessage, aLine):
+    with self.mLock:
+      self.mBuffer.append((aType, aMessage, aLine))
+      full = len(self.mBuffer) >= self.mCapacity
+    if full or aType == 'error':
+      self.flush()
+
+  def flush(self):
+    with self.mLock:
+      records = self.mBuffer
+      self.mBuffer = []
+      for record in records:
+        self.mHandler.emit(*record)
+      self.mHandler.flush()
+
+  def close(self):
+    self.flush()
+    self.mHandler.close()
+
+# Hands the lines logged to aHandler on a thread of its own, so logging never
+# waits for the output to be written.
+class BackgroundHandler:
+  def __init__(self, aHandler=None):
+    self.mHandler = aHandler or StreamHandler()
+    self.mQueue = Queue.Queue()
+    self.mThread = threading.Thread(target=self.__run)
+    self.mThread.daemon = True
+    self.mThread.start()
+
+  def __run(self):
+    while True:
+      record = self.mQueue.get()
+      try:
+        if record is None:
+          return
+        if record == 'flush':
+          self.mHandler.flush()
+        else:
+          self.mHandler.emit(*record)
+      finally:
+        self.mQueue.task_done()
+
+  def emit(self, aType, aMessage, aLine):
+    self.mQueue.put((aType, aMessage, aLine))
+
+  # Wait until everything logged so far has been written.
+  def flush(self):
+    self.mQueue.put('flush')
+    self.mQueue.join()
+
+  def close(self):
+    if self.mThread.is_alive():
+      self.flush()
+      self.mQueue.put(None)
+      self.mThread.join()
+    self.mHandler.close()
+
 # This is a class that allows us to print prettier output to the command line.
 # It's designed so that you can create a single object of type PrettyLogger,
 # then use that printer throughout your script.
@@ -14,30 +139,51 @@ class PrettyLogger:
   ERROR = '\033[91m'
   ENDCOLOR = '\033[0m'
 
-  def __init__(self, aEnableColor=False, aDebugEnabled=False, aVerboseEnabled=False):
+  # @param aHandler Where the lines go: a StreamHandler writing to stdout, unless
+  #        another handler (e.g. a BufferedHandler, BackgroundHandler or
+  #        JsonLinesHandler) is given.
+  def __init__(self, aEnableColor=False, aDebugEnabled=False, aVerboseEnabled=False,
+               aHandler=None):
     self.mColorEnabled = aEnableColor
     self.mDebugEnabled = aDebugEnabled
     self.mVerboseEnabled = aVerboseEnabled
+    self.mHandler = aHandler or StreamHandler()
 
   # Print debug output to the console, if debug output is enabled, or do
-  # nothing. Most verbose.
-  def debug(self, aMessage):
-    self.printLogColor('debug', aMessage)
+  # nothing. Most verbose. Like the other output methods, it takes a message,
+  # a %-style format string and its arguments, or a callable returning the
+  # message; none of them is formatted unless the message is printed.
+  def debug(self, aMessage, *aArgs):
+    if self.mDebugEnabled:
+      self.log('debug', aMessage, aArgs)
 
   # Print informative output to the console, if info output is enabled, or do
   # nothing. More verbose than warning output, but less than debug output.
-  def info(self, aMessage):
-    self.printLogColor('info', aMessage)
+  def info(self, aMessage, *aArgs):
+    if self.mVerboseEnabled:
+      self.log('info', aMessage, aArgs)
 
   # Print warning output to the console, if warning output is enabled, or do
   # nothing. More verbose than error output, but less than info output.
-  def warn(self, aMessage):
-    self.printLogColor('warn', aMessage)
+  def warn(self, aMessage, *aArgs):
+    self.log('warn', aMessage, aArgs)
 
   # Print error output to the console. Error output is always enabled, so this
   # will always print to the console. Least verbose output mechanism.
-  def error(self, aMessage):
-    self.printLogColor('error', aMessage)
+  def error(self, aMessage, *aArgs):
+    self.log('error', aMessage, aArgs)
+
+  # Determine if output of a given type is printed.
+  #
+  # @param aType The type of message - one of debug, info, warn, or error.
+  #
+  # @returns True, if messages of type aType are printed; False, otherwise.
+  def isEnabled(self, aType):
+    if aType == 'debug':
+      return self.mDebugEnabled
+    if aType == 'info':
+      return self.mVerboseEnabled
+    return True
 
   # Determine if color printing is enabled or disabled.
   #
@@ -46,6 +192,25 @@ class PrettyLogger:
   def isColorDisabled(self):
     return not self.mColorEnabled
 
+  # Print a message of a given type, if that type is enabled, in color if color
+  # is enabled.
+  #
+  # @param aType The type of message to print - one of debug, info, warn, or
+  #        error. Messages of any other type are printed verbatim.
+  # @param aMessage The message to print, as for debug().
+  # @param aArgs The arguments of aMessage, if it's a %-style format string.
+  def log(self, aType, aMessage, aArgs=()):
+    self.__emit(aType, aMessage, aArgs, self.mColorEnabled)
+
+  # Write out whatever the handler holds back.
+  def flush(self):
+    self.mHandler.flush()
+
+  # Write out whatever the handler holds back and stop its thread, if it has
+  # one. Nothing should be logged afterwards.
+  def close(self):
+    self.mHandler.close()
+
   # Print log output without color to the console using this PrettyLogger object.
   #
   # @param aType The type of message to print - one of debug, info, warn, or
@@ -53,19 +218,7 @@ class PrettyLogger:
   # @param aMessage The string message to print. Each message is printed on a
   #        separate line.
   def printLogNoColor(self, aType, aMessage):
-    if aType == 'warn':
-        print ("WARNING: " + str(aMessage))
-    elif aType == 'error':
-        print ("ERROR: " + str(aMessage))
-    elif aType == 'info':
-        if self.mVerboseEnabled:
-          print ("INFO: " + str(aMessage))
-    elif aType == 'debug':
-      if self.mDebugEnabled:
-        print ("DEBUG: " + str(aMessage))
-    else:
-      # just print the message verbatim then, with no additions
-      print(aMessage)
+    self.__emit(aType, aMessage, (), False)
 
   # Print log output with color to the console using this PrettyLogger object.
   #
@@ -74,18 +227,17 @@ class PrettyLogger:
   # @param aMessage The string message to print. Each message is printed on a
   #        separate line.
   def printLogColor(self, aType, aMessage):
-    if self.isColorDisabled():
-      self.printLogNoColor(aType, aMessage)
-      return
+    self.log(aType, aMessage)
 
-    if aType == 'warn':
-      print (yellow("WARNING: ") + str(aMessage))
-    elif aType == 'error':
-      print (red("ERROR: ") + str(aMessage))
-    elif aType == 'info':
-      if (self.mVerboseEnabled):
-        print (green("INFO: ") + str(aMessage))
-    else:
-      # we assume that the type was 'debug' then
-      if self.mDebugEnabled:
-        print (blue("DEBUG: ") + str(aMessage))
+  def __emit(self, aType, aMessage, aArgs, aColor):
+    if not self.isEnabled(aType):
+      return
+    message = formatMessage(aMessage, aArgs)
+    if aType not in PREFIXES:
+      # just print the message verbatim then, with no additions
+      self.mHandler.emit(None, message, message)
+      return
+    (prefix, color) = PREFIXES[aType]
+    if aColor:
+      prefix = color(prefix)
+    self.mHandler.emit(aType, message, prefix + message)
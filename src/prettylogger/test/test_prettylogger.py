@@ -0,0 +1,149 @@
+import os
+import sys
+sys.path.insert(0,os.path.abspath(__file__+"/../.."))
+import json
+import threading
+import time
+import unittest
+from StringIO import StringIO
+from prettylogger.core import PrettyLogger, StreamHandler, BufferedHandler, BackgroundHandler, JsonLinesHandler
+
+# Records what it's asked to do, in order.
+class RecordingHandler:
+  def __init__(self, aDelay=0):
+    self.mDelay = aDelay
+    self.mCalls = []
+
+  def emit(self, aType, aMessage, aLine):
+    time.sleep(self.mDelay)
+    self.mCalls.append(('emit', aLine))
+
+  def flush(self):
+    self.mCalls.append(('flush',))
+
+  def close(self):
+    self.mCalls.append(('close',))
+
+# Counts how often it's turned into a string.
+class Expensive:
+  def __init__(self):
+    self.mFormatted = 0
+
+  def __str__(self):
+    self.mFormatted += 1
+    return "expensive"
+
+class PrettyLoggerTest(unittest.TestCase):
+  def test_disabled_messages_are_not_formatted(self):
+    handler = RecordingHandler()
+    logger = PrettyLogger(aHandler=handler)
+    expensive = Expensive()
+    calls = []
+    logger.debug("value: %s", expensive)
+    logger.debug(lambda: calls.append('debug'))
+    logger.info("value: %s", expensive)
+    logger.info(lambda: calls.append('info'))
+    self.assertEquals(0, expensive.mFormatted)
+    self.assertEquals([], calls)
+    self.assertEquals([], handler.mCalls)
+
+    logger.warn("value: %s", expensive)
+    logger.error(lambda: "value: %s" % expensive)
+    self.assertEquals(2, expensive.mFormatted)
+    self.assertEquals([('emit', 'WARNING: value: expensive'), ('emit', 'ERROR: value: expensive')],
+                      handler.mCalls)
+
+  def test_stream_handler(self):
+    stream = StringIO()
+    logger = PrettyLogger(aDebugEnabled=True, aHandler=StreamHandler(stream))
+    logger.debug("build %d of %d", 1, 2)
+    logger.printLogNoColor('verbatim', "as is")
+    self.assertEquals("DEBUG: build 1 of 2\nas is\n", stream.getvalue())
+
+class BufferedHandlerTest(unittest.TestCase):
+  def test_lines_are_held_until_full(self):
+    recording = RecordingHandler()
+    logger = PrettyLogger(aVerboseEnabled=True, aHandler=BufferedHandler(recording, aCapacity=3))
+    logger.info("one")
+    logger.warn("two")
+    self.assertEquals([], recording.mCalls)
+    logger.info("three")
+    self.assertEquals([('emit', 'INFO: one'), ('emit', 'WARNING: two'), ('emit', 'INFO: three'),
+                       ('flush',)], recording.mCalls)
+
+  def test_error_flushes(self):
+    recording = RecordingHandler()
+    logger = PrettyLogger(aVerboseEnabled=True, aHandler=BufferedHandler(recording, aCapacity=100))
+    logger.info("one")
+    logger.warn("two")
+    self.assertEquals([], recording.mCalls)
+    logger.error("three")
+    self.assertEquals([('emit', 'INFO: one'), ('emit', 'WARNING: two'), ('emit', 'ERROR: three'),
+                       ('flush',)], recording.mCalls)
+    logger.info("four")
+    logger.close()
+    self.assertEquals([('emit', 'INFO: four'), ('flush',), ('close',)], recording.mCalls[4:])
+
+class BackgroundHandlerTest(unittest.TestCase):
+  def test_flush_waits_for_the_lines_logged(self):
+    recording = RecordingHandler(aDelay=0.01)
+    handler = BackgroundHandler(recording)
+    logger = PrettyLogger(aHandler=handler)
+    for i in range(5):
+      logger.warn("line %d", i)
+    logger.flush()
+    self.assertEquals([('emit', 'WARNING: line %d' % i) for i in range(5)] + [('flush',)],
+                      recording.mCalls)
+    logger.close()
+
+  def test_close_writes_everything_first(self):
+    recording = RecordingHandler(aDelay=0.01)
+    handler = BackgroundHandler(recording)
+    logger = PrettyLogger(aHandler=handler)
+    for i in range(5):
+      logger.warn("line %d", i)
+    logger.close()
+    self.assertFalse(handler.mThread.is_alive())
+    self.assertEquals([('emit', 'WARNING: line %d' % i) for i in range(5)] + [('flush',), ('close',)],
+                      recording.mCalls)
+    # closing again only closes the handler it writes to
+    handler.close()
+    self.assertEquals(('close',), recording.mCalls[-1])
+
+  def test_logging_from_threads(self):
+    recording = RecordingHandler()
+    logger = PrettyLogger(aHandler=BackgroundHandler(recording))
+    def log(aThread):
+      for i in range(100):
+        logger.warn("%d: %d", aThread, i)
+    threads = [threading.Thread(target=log, args=(thread,)) for thread in range(4)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    logger.close()
+    lines = [call[1] for call in recording.mCalls if call[0] == 'emit']
+    self.assertEquals(400, len(lines))
+    for thread in range(4):
+      self.assertEquals(['WARNING: %d: %d' % (thread, i) for i in range(100)],
+                        [line for line in lines if line.startswith('WARNING: %d:' % thread)])
+
+class JsonLinesHandlerTest(unittest.TestCase):
+  def test_one_object_per_line(self):
+    stream = StringIO()
+    logger = PrettyLogger(aEnableColor=True, aDebugEnabled=True, aHandler=JsonLinesHandler(stream))
+    start = time.time()
+    logger.debug("build %d of %d", 1, 2)
+    logger.error('two\nlines, "quoted"')
+    logger.printLogNoColor('verbatim', "50% done")
+    lines = stream.getvalue().splitlines()
+    self.assertEquals(3, len(lines))
+    records = [json.loads(line) for line in lines]
+    self.assertEquals([('debug', 'build 1 of 2'), ('error', 'two\nlines, "quoted"'),
+                       (None, "50% done")],
+                      [(record['type'], record['message']) for record in records])
+    for record in records:
+      self.assertTrue(start <= record['time'] <= time.time())
+
+if __name__ == '__main__':
+  unittest.main()
@@ -10,7 +10,7 @@ setup(name='transgression',
       packages=['transgression'],
       entry_points={ 'console_scripts': [
         'transgression = transgression.core:main'] },
-      install_requires=['argparse', 'ansicolors', 'httplib2', 'mozfile',
-                        'mozprofile', 'mozrunner', 'BeautifulSoup', 'paramiko',
+      install_requires=['argparse', 'ansicolors', 'mozfile',
+                        'mozprofile', 'mozrunner', 'paramiko',
                         'configurator', 'prettylogger']
 )
@@ -0,0 +1,78 @@
+# Benchmark of archive extraction: the in-process extractor of mozInstall,
+# with bzip2 blocks decompressed on every core or on one, against the shell
+# tar it replaced and tarfile's own extractall. Like tar -j, the extractor
+# decompresses on a thread beside the one parsing and writing, so on a single
+# core it stays behind shell tar by the time tarfile takes to parse the
+# headers in Python; with more cores the bzip2 blocks are decompressed on all
+# of them. Run it directly, optionally on a real nightly:
+#
+#   python test/bench_extract.py [firefox-nightly.tar.bz2]
+import os
+import sys
+sys.path.insert(0,os.path.abspath(__file__+"/../.."))
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import time
+from transgression import mozInstall
+
+def makeArchive(aPath, aFiles=3000):
+  # lots of small files and a few big ones, like a nightly
+  source = tempfile.mkdtemp()
+  try:
+    for i in range(aFiles):
+      directory = os.path.join(source, 'firefox', 'dir%d' % (i % 50))
+      if not os.path.isdir(directory):
+        os.makedirs(directory)
+      size = 40 * 1024 * 1024 if i % 1000 == 0 else 4096
+      fp = open(os.path.join(directory, 'file%d' % i), 'wb')
+      fp.write(os.urandom(1024) * (size / 1024))
+      fp.close()
+    tar = tarfile.open(aPath, 'w:bz2')
+    tar.add(os.path.join(source, 'firefox'), 'firefox')
+    tar.close()
+  finally:
+    shutil.rmtree(source)
+
+def shellTar(aArchive, aDest):
+  subprocess.check_call(['tar', '-jxf', aArchive, '-C', aDest])
+
+def tarfileExtractall(aArchive, aDest):
+  tarfile.open(aArchive, 'r|bz2').extractall(aDest)
+
+def inProcess(aArchive, aDest):
+  mozInstall.MozInstaller(src=aArchive, dest=aDest, dest_app=None)
+
+def inProcessSerial(aArchive, aDest):
+  mozInstall.BZ2_PROCESSES = 1
+  try:
+    inProcess(aArchive, aDest)
+  finally:
+    mozInstall.BZ2_PROCESSES = None
+
+def main():
+  tempDir = tempfile.mkdtemp()
+  try:
+    if len(sys.argv) > 1:
+      archive = sys.argv[1]
+    else:
+      archive = os.path.join(tempDir, 'firefox.tar.bz2')
+      makeArchive(archive)
+    print("archive: %d KB" % (os.path.getsize(archive) / 1024))
+
+    for (name, extract) in [('shell tar', shellTar),
+                            ('tarfile.extractall', tarfileExtractall),
+                            ('mozInstall serial bz2', inProcessSerial),
+                            ('mozInstall', inProcess)]:
+      dest = os.path.join(tempDir, 'dest')
+      os.makedirs(dest)
+      start = time.time()
+      extract(archive, dest)
+      print("%-24s %8.2f s" % (name + ":", time.time() - start))
+      shutil.rmtree(dest)
+  finally:
+    shutil.rmtree(tempDir)
+
+if __name__ == '__main__':
+  main()
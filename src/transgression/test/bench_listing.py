@@ -0,0 +1,47 @@
+# Microbenchmark of the directory listing parser against the BeautifulSoup
+# scraping it replaced. Run it directly:
+#
+#   python test/bench_listing.py
+import os
+import sys
+sys.path.insert(0,os.path.abspath(__file__+"/../.."))
+import datetime
+import timeit
+from transgression import listing
+
+def makeMonthListing(aDays=31, aBuildsPerDay=40):
+  # An Apache style listing the size of a busy month on the nightly server
+  rows = ['<html><head><title>Index of /pub/firefox/nightly/2012/01</title></head><body>',
+          '<h1>Index of /pub/firefox/nightly/2012/01</h1><pre>',
+          '<img src="/icons/back.gif" alt="[DIR]"> <a href="/pub/firefox/nightly/2012/">Parent Directory</a>']
+  for day in range(1, aDays + 1):
+    for build in range(aBuildsPerDay):
+      name = '2012-01-%02d-%02d-%02d-%02d-mozilla-central-%d/' % (day, build % 24, build, build, build)
+      rows.append('<img src="/icons/folder.gif" alt="[DIR]"> <a href="%s">%s</a> %s 03:05    -   '
+                  % (name, name[:23] + '..&gt;', datetime.date(2012, 1, day).strftime('%d-%b-%Y')))
+  rows.append('</pre><hr></body></html>')
+  return '\n'.join(rows)
+
+def beautifulSoupLinks(aContent):
+  from BeautifulSoup import BeautifulSoup
+  return [link.get('href') for link in BeautifulSoup(aContent).findAll('a')]
+
+def main():
+  content = makeMonthListing()
+  expected = listing.parseLinks(content)
+  print("listing: %d KB, %d links" % (len(content) / 1024, len(expected)))
+
+  runs = 20
+  seconds = timeit.Timer(lambda: listing.parseLinks(content)).timeit(runs) / runs
+  print("parseLinks:    %8.2f ms per listing" % (seconds * 1000))
+
+  try:
+    assert tuple(beautifulSoupLinks(content)) == expected
+  except ImportError:
+    print("BeautifulSoup is not installed, nothing to compare against")
+    return
+  seconds = timeit.Timer(lambda: beautifulSoupLinks(content)).timeit(runs) / runs
+  print("BeautifulSoup: %8.2f ms per listing" % (seconds * 1000))
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,138 @@
+import os
+import sys
+sys.path.insert(0,os.path.abspath(__file__+"/../.."))
+import shutil
+import tarfile
+import tempfile
+import threading
+import unittest
+import zipfile
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from transgression import appinfo
+from transgression import httpsession
+
+APPLICATION_INI = """[App]
+Vendor=Mozilla
+Name=Firefox
+Version=12.0a1
+BuildID=20120101030526
+SourceRepository=http://hg.mozilla.org/mozilla-central
+SourceStamp=4ac40cd2ab9f
+"""
+
+# Serves the files of self.server.mFiles with Range support, recording the
+# bytes asked for.
+class RangeRequestHandler(BaseHTTPRequestHandler):
+  def do_GET(self):
+    if self.path not in self.server.mFiles:
+      self.send_error(404)
+      return
+    payload = self.server.mFiles[self.path]
+    start = 0
+    end = len(payload) - 1
+    rangeHeader = self.headers.getheader('Range')
+    if rangeHeader:
+      (start, end) = [int(value) for value in rangeHeader[len('bytes='):].split('-')]
+      self.send_response(206)
+      self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end, len(payload)))
+    else:
+      self.send_response(200)
+    self.server.mRequested += end + 1 - start
+    self.send_header('Content-Length', str(end + 1 - start))
+    self.end_headers()
+    try:
+      self.wfile.write(payload[start:end + 1])
+    except IOError:
+      # the client stopped reading
+      pass
+
+  def log_message(self, *aArgs):
+    pass
+
+class RangeServer(ThreadingMixIn, HTTPServer):
+  daemon_threads = True
+
+class AppInfoTest(unittest.TestCase):
+  def setUp(self):
+    self.mTempDir = tempfile.mkdtemp()
+    source = os.path.join(self.mTempDir, 'firefox')
+    os.makedirs(source)
+    fp = open(os.path.join(source, 'application.ini'), 'w')
+    fp.write(APPLICATION_INI)
+    fp.close()
+    fp = open(os.path.join(source, 'libxul.so'), 'wb')
+    fp.write(os.urandom(1024 * 1024))
+    fp.close()
+
+    self.mTar = os.path.join(self.mTempDir, 'firefox.tar.bz2')
+    # small bzip2 blocks, so application.ini is in one of its own
+    tar = tarfile.open(self.mTar, 'w:bz2', compresslevel=1)
+    tar.add(os.path.join(source, 'application.ini'), 'firefox/application.ini')
+    tar.add(os.path.join(source, 'libxul.so'), 'firefox/libxul.so')
+    tar.close()
+
+    self.mZip = os.path.join(self.mTempDir, 'firefox.win32.zip')
+    archive = zipfile.ZipFile(self.mZip, 'w')
+    archive.write(os.path.join(source, 'libxul.so'), 'firefox/xul.dll')
+    archive.write(os.path.join(source, 'application.ini'), 'firefox/application.ini')
+    archive.close()
+
+    self.mServer = RangeServer(('127.0.0.1', 0), RangeRequestHandler)
+    self.mServer.mFiles = {'/firefox.tar.bz2': open(self.mTar, 'rb').read(),
+                           '/firefox.win32.zip': open(self.mZip, 'rb').read()}
+    self.mServer.mRequested = 0
+    self.mThread = threading.Thread(target=self.mServer.serve_forever)
+    self.mThread.daemon = True
+    self.mThread.start()
+    self.mBaseUrl = 'http://127.0.0.1:%d/' % self.mServer.server_address[1]
+    self.mSession = httpsession.HttpSession()
+
+  def tearDown(self):
+    self.mSession.close()
+    self.mServer.shutdown()
+    self.mServer.server_close()
+    shutil.rmtree(self.mTempDir)
+
+  def test_read_app_info(self):
+    expected = ('http://hg.mozilla.org/mozilla-central', '4ac40cd2ab9f')
+    self.assertEquals(expected, appinfo.read_app_info(self.mTar))
+    self.assertEquals(expected, appinfo.read_app_info(self.mZip))
+    self.assertEquals(None, appinfo.read_app_info(os.path.join(self.mTempDir, 'firefox.dmg')))
+
+  def test_tar_is_read_up_to_application_ini(self):
+    # the rest of the archive isn't needed, so it may as well be missing
+    fp = open(self.mTar, 'r+b')
+    fp.truncate(os.path.getsize(self.mTar) / 2)
+    fp.close()
+    self.assertEquals(('http://hg.mozilla.org/mozilla-central', '4ac40cd2ab9f'),
+                      appinfo.read_app_info(self.mTar))
+
+  def test_fetch_tar(self):
+    self.assertEquals(('http://hg.mozilla.org/mozilla-central', '4ac40cd2ab9f'),
+                      appinfo.fetch_app_info(self.mBaseUrl + 'firefox.tar.bz2', self.mSession))
+
+  def test_fetch_zip_with_ranges(self):
+    self.assertEquals(('http://hg.mozilla.org/mozilla-central', '4ac40cd2ab9f'),
+                      appinfo.fetch_app_info(self.mBaseUrl + 'firefox.win32.zip', self.mSession))
+    # the directory and the member, not the megabyte in front of them
+    self.assertTrue(self.mServer.mRequested < 200 * 1024)
+
+  def test_fetch_build_metadata(self):
+    self.mServer.mFiles['/firefox.en-US.linux-x86_64.txt'] = \
+      "20120101030526\nhttp://hg.mozilla.org/mozilla-central/rev/4ac40cd2ab9f\n"
+    self.mServer.mFiles['/firefox.en-US.win32.json'] = \
+      '{"buildid": "20120101030526", "moz_source_repo": "http://hg.mozilla.org/mozilla-central", ' \
+      '"moz_source_stamp": "4ac40cd2ab9f"}'
+    for archive in ('firefox.en-US.linux-x86_64.tar.bz2', 'firefox.en-US.win32.zip'):
+      self.assertEquals(('http://hg.mozilla.org/mozilla-central', '4ac40cd2ab9f'),
+                        appinfo.fetch_build_metadata(self.mBaseUrl + archive, self.mSession))
+    self.assertEquals(None, appinfo.fetch_build_metadata(self.mBaseUrl + 'firefox.mac.dmg', self.mSession))
+    # only the changeset, no repository to look it up in
+    self.assertEquals(None, appinfo.parse_build_txt("20100101030000 4ac40cd2ab9f"))
+
+  def test_missing_source_stamp(self):
+    self.assertEquals(None, appinfo.parse_app_info("[App]\nName=Firefox\n"))
+
+if __name__ == '__main__':
+  unittest.main()
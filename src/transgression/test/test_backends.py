@@ -0,0 +1,259 @@
+import os
+import sys
+sys.path.insert(0,os.path.abspath(__file__+"/../.."))
+import datetime
+import posixpath
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+import unittest
+import urllib
+from BaseHTTPServer import HTTPServer
+from SimpleHTTPServer import SimpleHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from transgression import backends
+from transgression import buildstore
+from transgression import cache
+from transgression import config
+from transgression import listing
+from transgression import location
+from transgression import regression
+from transgression import runnightly
+
+# Serves the directory tree under self.server.mRoot, with listings.
+class TreeRequestHandler(SimpleHTTPRequestHandler):
+  def translate_path(self, aPath):
+    path = posixpath.normpath(urllib.unquote(aPath.split('?', 1)[0]))
+    return os.path.join(self.server.mRoot, *[part for part in path.split('/') if part])
+
+  def log_message(self, *aArgs):
+    pass
+
+class TreeServer(ThreadingMixIn, HTTPServer):
+  daemon_threads = True
+
+# Installs without starting anything, so the test command judges the build
+# by its files.
+class OfflineRunner(runnightly.NightlyRunner):
+  def start(self, aDate=None):
+    return self.install(aDate)
+
+  def stop(self):
+    pass
+
+# The regression is in the build of the 15th.
+BUILDS = [(day, '%012x' % (0xabc000 + day)) for day in (1, 4, 8, 11, 15, 19, 22, 27)]
+
+# Counts its downloads, and takes its time over them.
+class SlowFileBackend(backends.FileBackend):
+  def __init__(self, aRoot):
+    backends.FileBackend.__init__(self, aRoot)
+    self.mFetches = 0
+
+  def fetch(self, path, dest, progress=None, segments=1):
+    self.mFetches += 1
+    def slowProgress(aReceived, aLength):
+      time.sleep(0.05)
+    return backends.FileBackend.fetch(self, path, dest, slowProgress, segments)
+
+class BackendTest(unittest.TestCase):
+  def setUp(self):
+    self.mTempDir = tempfile.mkdtemp()
+    self.mRoot = os.path.join(self.mTempDir, 'builds')
+    self.mSource = os.path.join(self.mTempDir, 'source')
+    os.makedirs(os.path.join(self.mSource, 'fakeapp'))
+    for (day, commitid) in BUILDS:
+      self.createBuild(datetime.date(2012, 1, day), commitid)
+
+  def tearDown(self):
+    shutil.rmtree(self.mTempDir)
+
+  def createBuild(self, aDate, aCommitId):
+    directory = os.path.join(self.mRoot, str(aDate), aCommitId)
+    os.makedirs(directory)
+    fp = open(os.path.join(self.mSource, 'fakeapp', 'fakeapp'), 'w')
+    fp.write(aDate.day >= 15 and 'bad' or 'good')
+    fp.close()
+    tar = tarfile.open(os.path.join(directory, 'fakeapp-1.tar.bz2'), 'w:bz2')
+    tar.add(os.path.join(self.mSource, 'fakeapp'), 'fakeapp')
+    tar.close()
+
+  def createTemplate(self):
+    return location.LocationTemplate('localhost' + self.mRoot +
+                                     '/%year%-%month%-%day%/%commitid%/%appname%-%buildnumber%.tar.bz2')
+
+  def test_file_backend(self):
+    backend = backends.FileBackend(self.mRoot)
+    self.assertEquals(['2012-01-04'], [name for name in backend.listdir('.') if name.endswith('04')])
+    listings = backend.listdirs(['2012-01-01', '2012-01-02'])
+    self.assertEquals({'2012-01-01': ['%012x' % 0xabc001]}, listings)
+    path = '2012-01-01/%012x/fakeapp-1.tar.bz2' % 0xabc001
+    self.assertEquals(os.path.getsize(os.path.join(self.mRoot, path)), backend.stat(path))
+    dest = os.path.join(self.mTempDir, 'fetched.tar.bz2')
+    progress = []
+    backend.fetch(path, dest, lambda aReceived, aLength: progress.append((aReceived, aLength)))
+    self.assertEquals(open(os.path.join(self.mRoot, path), 'rb').read(), open(dest, 'rb').read())
+    self.assertEquals(progress[-1][0], progress[-1][1])
+    self.assertRaises(IOError, backend.listdir, 'missing')
+    self.assertRaises(IOError, backend.stat, 'missing.tar.bz2')
+    self.assertRaises(IOError, backend.fetch, 'missing.tar.bz2', dest + '2')
+    self.assertFalse(os.path.exists(dest + '2'))
+
+  def test_http_backend(self):
+    server = TreeServer(('127.0.0.1', 0), TreeRequestHandler)
+    server.mRoot = self.mRoot
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+      backend = backends.get_backend('http', '127.0.0.1:%d' % server.server_address[1])
+      self.assertEquals(['%012x' % 0xabc004], backend.listdir('2012-01-04'))
+      path = '2012-01-04/%012x/fakeapp-1.tar.bz2' % 0xabc004
+      self.assertEquals(os.path.getsize(os.path.join(self.mRoot, path)), backend.stat(path))
+      dest = os.path.join(self.mTempDir, 'fetched.tar.bz2')
+      backend.fetch(path, dest)
+      self.assertEquals(open(os.path.join(self.mRoot, path), 'rb').read(), open(dest, 'rb').read())
+      self.assertRaises(IOError, backend.listdir, 'missing')
+      self.assertRaises(IOError, backend.stat, 'missing.tar.bz2')
+      backend.close()
+    finally:
+      server.shutdown()
+      server.server_close()
+
+  def test_get_backend(self):
+    self.assertTrue(isinstance(backends.get_backend('file'), backends.FileBackend))
+    self.assertTrue(isinstance(backends.get_backend('https', 'example.com'), backends.HttpBackend))
+    self.assertRaises(ValueError, backends.get_backend, 'gopher')
+
+  def test_template_nightly(self):
+    archives = cache.ArchiveCache(os.path.join(self.mTempDir, 'cache'))
+    nightly = runnightly.TemplateNightly('fakeapp', self.createTemplate(), backends.FileBackend(),
+                                         cache=archives,
+                                         installDir=os.path.join(self.mTempDir, 'install'))
+    self.assertEquals([datetime.date(2012, 1, day) for day in (4, 8, 11, 15)],
+                      nightly.getBuildDates(datetime.date(2012, 1, 1), datetime.date(2012, 1, 19)))
+    self.assertFalse(nightly.getBuildUrl(datetime.date(2012, 1, 2)))
+    self.assertEquals((None, '%012x' % 0xabc008),
+                      nightly.probeAppInfo(datetime.date(2012, 1, 8)))
+    self.assertTrue(nightly.download(datetime.date(2012, 1, 8)))
+    self.assertTrue(nightly.isCached(nightly.dest))
+    self.assertTrue(nightly.getCached(datetime.date(2012, 1, 8)))
+    nightly.cleanup()
+
+  def test_concurrent_downloads_into_the_cache(self):
+    archives = cache.ArchiveCache(os.path.join(self.mTempDir, 'cache'))
+    backend = SlowFileBackend('/')
+    date = datetime.date(2012, 1, 8)
+    url = runnightly.TemplateNightly('fakeapp', self.createTemplate(), backend).getBuildUrl(date)
+    paths = []
+    def download():
+      # a cache of its own, like another process would have
+      nightly = runnightly.TemplateNightly('fakeapp', self.createTemplate(), backend,
+                                           cache=cache.ArchiveCache(archives.directory))
+      paths.append(nightly.downloadBuild(url, date))
+    threads = [threading.Thread(target=download) for i in range(3)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    # whoever came second found the first one's archive
+    self.assertEquals(1, backend.mFetches)
+    self.assertEquals([paths[0]] * 3, paths)
+    self.assertEquals(open(backend._path(url), 'rb').read(), open(paths[0], 'rb').read())
+
+  def bisect(self, aTemplate, aBackend):
+    runner = OfflineRunner(appname='fakeapp', template=aTemplate, backend=aBackend,
+                           installDir=os.path.join(self.mTempDir, 'install'))
+    script = "import os, sys; sys.exit(open(os.environ['TRANSGRESSION_BINARY']).read() == 'bad')"
+    bisector = regression.Bisector(runner, appname='fakeapp',
+                                   testCommand='"%s" -c "%s"' % (sys.executable, script))
+    try:
+      return bisector.bisect(datetime.date(2012, 1, 1), datetime.date(2012, 1, 27))
+    finally:
+      runner.cleanup()
+
+  def test_offline_bisection(self):
+    self.assertEquals((datetime.date(2012, 1, 11), datetime.date(2012, 1, 15)),
+                      self.bisect(self.createTemplate(), backends.FileBackend()))
+
+  def test_http_bisection(self):
+    # archives from an HttpBackend are extracted as they download
+    server = TreeServer(('127.0.0.1', 0), TreeRequestHandler)
+    server.mRoot = self.mRoot
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+      repository = config.BinaryRepository({'protocol': 'http', 'location': '127.0.0.1:%d/%%year%%-%%month%%-%%day%%/%%commitid%%/%%appname%%-%%buildnumber%%.tar.bz2' % server.server_address[1]})
+      backend = repository.getBackend()
+      self.assertTrue(backend.streaming)
+      self.assertEquals((datetime.date(2012, 1, 11), datetime.date(2012, 1, 15)),
+                        self.bisect(repository.getLocationTemplate(), backend))
+      backend.close()
+    finally:
+      server.shutdown()
+      server.server_close()
+
+  def createNightly(self, aDate):
+    # laid out as on ftp.mozilla.org, the build's binary a script
+    directory = os.path.join(self.mTempDir, 'ftp', '%04d' % aDate.year, '%02d' % aDate.month,
+                             '%s-03-02-01-mozilla-central' % aDate)
+    os.makedirs(directory)
+    source = os.path.join(self.mTempDir, 'nightly', 'firefox')
+    if not os.path.isdir(source):
+      os.makedirs(source)
+    fp = open(os.path.join(source, 'firefox'), 'w')
+    fp.write('#!/bin/sh\n# %s\n' % (aDate.day >= 15 and 'bad' or 'good'))
+    fp.close()
+    os.chmod(os.path.join(source, 'firefox'), 0755)
+    bits = runnightly.get_platform()['bits'] == '64' and 'x86_64' or 'i686'
+    tar = tarfile.open(os.path.join(directory, 'firefox-12.0a1.en-US.linux-%s.tar.bz2' % bits), 'w:bz2')
+    tar.add(source, 'firefox')
+    tar.close()
+
+  def test_parallel_jobs(self):
+    # the runners of the jobs share the caches, the store and the session
+    # between the threads of the pool
+    if runnightly.get_platform()['name'] != 'Linux':
+      return
+    for (day, commitid) in BUILDS:
+      self.createNightly(datetime.date(2012, 1, day))
+    server = TreeServer(('127.0.0.1', 0), TreeRequestHandler)
+    server.mRoot = os.path.join(self.mTempDir, 'ftp')
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    getMonthUrl = runnightly.FirefoxNightly.getMonthUrl
+    runnightly.FirefoxNightly.getMonthUrl = lambda aSelf, aDate: \
+      'http://127.0.0.1:%d/%04d/%02d/' % (server.server_address[1], aDate.year, aDate.month)
+    try:
+      archives = cache.ArchiveCache(os.path.join(self.mTempDir, 'cache'))
+      store = buildstore.BuildStore(os.path.join(self.mTempDir, 'store'))
+      listings = listing.ListingCache(os.path.join(self.mTempDir, 'listings'))
+      script = "import os, sys; sys.exit('bad' in open(os.environ['TRANSGRESSION_BINARY']).read())"
+      for attempt in range(2):
+        # the second bisection checks every build out of the store
+        runner = runnightly.NightlyRunner(appname='firefox', cache=archives, store=store,
+                                          listings=listings, headless=True,
+                                          installDir=os.path.join(self.mTempDir, 'install'))
+        bisector = regression.Bisector(runner, testCommand='"%s" -c "%s"' % (sys.executable, script),
+                                       jobs=3)
+        try:
+          self.assertEquals((datetime.date(2012, 1, 11), datetime.date(2012, 1, 15)),
+                            bisector.bisect(datetime.date(2012, 1, 1), datetime.date(2012, 1, 27)))
+        finally:
+          runner.cleanup()
+        self.assertFalse(os.path.exists(os.path.join(self.mTempDir, 'install')))
+        self.assertEquals(['builds', 'cache', 'ftp', 'listings', 'nightly', 'source', 'store'],
+                          sorted(os.listdir(self.mTempDir)))
+      # the 4th, 11th and 19th, then the 15th
+      self.assertEquals(4, len(os.listdir(store.manifests)))
+    finally:
+      runnightly.FirefoxNightly.getMonthUrl = getMonthUrl
+      server.shutdown()
+      server.server_close()
+
+if __name__ == '__main__':
+  unittest.main()
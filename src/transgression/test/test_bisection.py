@@ -0,0 +1,93 @@
+import os
+import sys
+sys.path.insert(0,os.path.abspath(__file__+"/../.."))
+import datetime
+import shutil
+import tempfile
+import unittest
+from transgression import bisection
+
+class BuildRangeTest(unittest.TestCase):
+  def bisect(self, aBuilds, aFirstBad):
+    # returns the builds tested to find |aFirstBad|
+    builds = bisection.BuildRange(aBuilds)
+    tested = []
+    index = builds.next()
+    while index is not None:
+      tested.append(aBuilds[index])
+      if aBuilds[index] < aFirstBad:
+        builds.setGood(index)
+      else:
+        builds.setBad(index)
+      index = builds.next()
+    self.assertEquals(aFirstBad, builds.badBuild())
+    return tested
+
+  def test_bisect(self):
+    builds = range(0, 100, 3)
+    for firstBad in builds[1:]:
+      self.assertTrue(len(self.bisect(builds, firstBad)) <= 6)
+
+  def test_adjacent_builds_need_no_test(self):
+    self.assertEquals(None, bisection.BuildRange(['good', 'bad']).next())
+
+  def test_skip_alternates_around_the_middle(self):
+    builds = bisection.BuildRange(range(11))
+    order = []
+    for i in range(9):
+      index = builds.next()
+      order.append(index)
+      builds.skip(index)
+    self.assertEquals([5, 6, 4, 7, 3, 8, 2, 9, 1], order)
+    self.assertEquals(None, builds.next())
+    self.assertEquals(0, builds.remaining())
+
+  def test_next_if(self):
+    builds = bisection.BuildRange(range(9))
+    self.assertEquals(4, builds.next())
+    self.assertEquals(6, builds.nextIf(4, True))
+    self.assertEquals(2, builds.nextIf(4, False))
+    builds.setGood(4)
+    self.assertEquals(6, builds.next())
+
+  def test_split(self):
+    builds = bisection.BuildRange(range(13))
+    self.assertEquals([3, 6, 9], builds.split(3))
+    builds.skip(6)
+    self.assertEquals([3, 7, 9], builds.split(3))
+    self.assertEquals([1, 2, 3, 4], bisection.BuildRange(range(6)).split(8))
+
+  def test_record(self):
+    builds = bisection.BuildRange(range(13))
+    builds.record([(9, 'bad'), (3, 'good'), (6, 'skip')])
+    self.assertEquals((3, 9, set([6])), (builds.good, builds.bad, builds.skipped))
+    # a good verdict past a bad one doesn't count
+    builds.record([(4, 'bad'), (8, 'good')])
+    self.assertEquals((3, 4), (builds.good, builds.bad))
+
+class BisectionSessionTest(unittest.TestCase):
+  def setUp(self):
+    self.mTempDir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.mTempDir)
+
+  def test_round_trip(self):
+    path = bisection.BisectionSession.pathFor('firefox-test', self.mTempDir)
+    builds = bisection.BuildRange([datetime.date(2012, 1, day) for day in range(1, 10)])
+    builds.setGood(2)
+    builds.setBad(7)
+    builds.skip(4)
+    session = bisection.BisectionSession(path, 'firefox', 'mozilla-central')
+    session.save(builds, ('http://hg.mozilla.org/mozilla-central', 'abc'), '')
+
+    loaded = bisection.BisectionSession.load(path)
+    self.assertEquals(('firefox', 'mozilla-central'), (loaded.app, loaded.repo))
+    self.assertEquals(builds.builds, loaded.builds.builds)
+    self.assertEquals((2, 7, set([4])), (loaded.builds.good, loaded.builds.bad, loaded.builds.skipped))
+    self.assertEquals(('http://hg.mozilla.org/mozilla-central', 'abc'), loaded.goodAppInfo)
+    self.assertEquals('', loaded.badAppInfo)
+    self.assertEquals(['firefox-test.json'], os.listdir(self.mTempDir))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,186 @@
+import os
+import sys
+sys.path.insert(0,os.path.abspath(__file__+"/../.."))
+import datetime
+import posixpath
+import re
+import shutil
+import tarfile
+import tempfile
+import threading
+import unittest
+import urllib
+from BaseHTTPServer import HTTPServer
+from SimpleHTTPServer import SimpleHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from transgression import buildindex
+from transgression import runnightly
+
+# Serves the directory tree under self.server.mRoot, with listings.
+class TreeRequestHandler(SimpleHTTPRequestHandler):
+  def translate_path(self, aPath):
+    path = posixpath.normpath(urllib.unquote(aPath.split('?', 1)[0]))
+    self.server.mRequests.append(aPath)
+    return os.path.join(self.server.mRoot, *[part for part in path.split('/') if part])
+
+  def send_head(self):
+    # paths in mDropped get no answer at all
+    if self.path in self.server.mDropped:
+      self.close_connection = 1
+      return None
+    # paths in mFailing fail once
+    if self.path in self.server.mFailing:
+      self.server.mFailing.remove(self.path)
+      self.send_error(503)
+      return None
+    return SimpleHTTPRequestHandler.send_head(self)
+
+  def log_message(self, *aArgs):
+    pass
+
+class TreeServer(ThreadingMixIn, HTTPServer):
+  daemon_threads = True
+
+class LocalNightly(runnightly.FirefoxNightly):
+  def getMonthUrl(self, aDate):
+    return self.mBaseUrl + "%04d/%02d/" % (aDate.year, aDate.month)
+
+class BuildIndexTest(unittest.TestCase):
+  BUILDS = [
+    '2012/01/2012-01-01-03-05-26-mozilla-central/firefox-12.0a1.en-US.linux-x86_64.tar.bz2',
+    '2012/01/2012-01-01-03-05-26-mozilla-central/firefox-12.0a1.en-US.win32.zip',
+    '2012/01/2012-01-01-04-02-11-mozilla-aurora/firefox-11.0a2.en-US.linux-x86_64.tar.bz2',
+    '2012/01/2012-01-03-03-11-52-mozilla-central/firefox-12.0a1.en-US.linux-x86_64.tar.bz2',
+    '2012/02/2012-02-01-03-31-40-mozilla-central/firefox-13.0a1.en-US.linux-x86_64.tar.bz2',
+  ]
+
+  def setUp(self):
+    self.mTempDir = tempfile.mkdtemp()
+    root = os.path.join(self.mTempDir, 'nightly')
+    for build in self.BUILDS:
+      path = os.path.join(root, build)
+      if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+      fp = open(path, 'wb')
+      fp.write('x' * 1234)
+      fp.close()
+
+    self.mServer = TreeServer(('127.0.0.1', 0), TreeRequestHandler)
+    self.mServer.mRoot = root
+    self.mServer.mRequests = []
+    self.mServer.mFailing = set()
+    self.mServer.mDropped = set()
+    self.mThread = threading.Thread(target=self.mServer.serve_forever)
+    self.mThread.daemon = True
+    self.mThread.start()
+    self.mBaseUrl = 'http://127.0.0.1:%d/' % self.mServer.server_address[1]
+    self.mIndex = buildindex.BuildIndex(os.path.join(self.mTempDir, 'builds.sqlite'))
+
+  def tearDown(self):
+    self.mServer.shutdown()
+    self.mServer.server_close()
+    shutil.rmtree(self.mTempDir)
+
+  def createNightly(self):
+    nightly = LocalNightly(index=self.mIndex)
+    nightly.mBaseUrl = self.mBaseUrl
+    nightly.buildRegex = re.compile('.*linux-x86_64.tar.bz2')
+    return nightly
+
+  def test_crawl(self):
+    crawler = buildindex.Crawler(self.createNightly(), self.mIndex, threads=4)
+    self.assertEquals(4, crawler.crawl(datetime.date(2012, 1, 1), datetime.date(2012, 2, 1)))
+    builds = self.mIndex.builds('firefox', 'mozilla-central', crawler.platform,
+                                datetime.date(2012, 1, 1), datetime.date(2012, 1, 31))
+    self.assertEquals([(datetime.date(2012, 1, 1), '20120101030526', self.mBaseUrl + self.BUILDS[0]),
+                       (datetime.date(2012, 1, 3), '20120103031152', self.mBaseUrl + self.BUILDS[3])],
+                      builds)
+    self.assertEquals(self.mBaseUrl + self.BUILDS[2],
+                      self.mIndex.lookup('firefox', 'mozilla-aurora', crawler.platform, datetime.date(2012, 1, 1)))
+
+  def test_crawl_is_incremental(self):
+    buildindex.Crawler(self.createNightly(), self.mIndex).crawl(datetime.date(2012, 1, 1), datetime.date(2012, 1, 31))
+    requests = len(self.mServer.mRequests)
+    # only the month listing is needed to find out there is nothing new
+    self.assertEquals(0, buildindex.Crawler(self.createNightly(), self.mIndex).crawl(datetime.date(2012, 1, 1), datetime.date(2012, 1, 31)))
+    self.assertEquals(requests + 1, len(self.mServer.mRequests))
+
+  def test_failed_listings_are_crawled_again(self):
+    self.mServer.mFailing.add('/2012/01/')
+    self.mServer.mFailing.add('/2012/02/' + os.path.dirname(self.BUILDS[4]).split('/')[-1] + '/')
+    nightly = self.createNightly()
+    crawler = buildindex.Crawler(nightly, self.mIndex)
+    self.assertEquals(0, crawler.crawl(datetime.date(2012, 1, 1), datetime.date(2012, 2, 2)))
+    self.assertEquals(set([datetime.date(2012, 2, 2)]),
+                      self.mIndex.crawledDays('firefox', crawler.platform,
+                                              datetime.date(2012, 1, 1), datetime.date(2012, 2, 2)))
+    # the server is back
+    self.assertEquals(self.mBaseUrl + self.BUILDS[3], nightly.getBuildUrl(datetime.date(2012, 1, 3)))
+    self.assertEquals(self.mBaseUrl + self.BUILDS[4], nightly.getBuildUrl(datetime.date(2012, 2, 1)))
+    self.assertEquals([datetime.date(2012, 1, 1), datetime.date(2012, 1, 3), datetime.date(2012, 2, 1)],
+                      nightly.getBuildDates(datetime.date(2011, 12, 31), datetime.date(2012, 2, 2)))
+
+  def test_get_build_url_uses_the_index(self):
+    nightly = self.createNightly()
+    self.assertEquals(self.mBaseUrl + self.BUILDS[3], nightly.getBuildUrl(datetime.date(2012, 1, 3)))
+    self.assertEquals(False, nightly.getBuildUrl(datetime.date(2012, 1, 2)))
+
+    requests = len(self.mServer.mRequests)
+    self.assertEquals(self.mBaseUrl + self.BUILDS[3], self.createNightly().getBuildUrl(datetime.date(2012, 1, 3)))
+    self.assertEquals(requests, len(self.mServer.mRequests))
+
+  def test_build_dates(self):
+    nightly = self.createNightly()
+    # one listing per month is enough to know which days have a nightly
+    self.assertEquals([datetime.date(2012, 1, 1), datetime.date(2012, 1, 3)],
+                      nightly.getBuildDates(datetime.date(2011, 12, 31), datetime.date(2012, 2, 1)))
+    self.assertEquals(3, len(self.mServer.mRequests))
+
+  def test_build_dates_use_crawled_days(self):
+    nightly = self.createNightly()
+    nightly.buildRegex = re.compile('.*win32.zip')
+    buildindex.Crawler(nightly, self.mIndex).crawl(datetime.date(2012, 1, 1), datetime.date(2012, 1, 31))
+    self.assertEquals([datetime.date(2012, 1, 1)],
+                      nightly.getBuildDates(datetime.date(2011, 12, 31), datetime.date(2012, 2, 1)))
+
+  def test_probe_app_info(self):
+    source = os.path.join(self.mTempDir, 'application.ini')
+    fp = open(source, 'w')
+    fp.write("[App]\nSourceRepository=http://hg.mozilla.org/mozilla-central\nSourceStamp=4ac40cd2ab9f\n")
+    fp.close()
+    tar = tarfile.open(os.path.join(self.mTempDir, 'nightly', self.BUILDS[3]), 'w:bz2')
+    tar.add(source, 'firefox/application.ini')
+    tar.close()
+
+    expected = ('http://hg.mozilla.org/mozilla-central', '4ac40cd2ab9f')
+    self.assertEquals(expected, self.createNightly().probeAppInfo(datetime.date(2012, 1, 3)))
+    self.assertEquals(None, self.createNightly().probeAppInfo(datetime.date(2012, 1, 2)))
+    # the build index remembers it for the next session
+    requests = len(self.mServer.mRequests)
+    self.assertEquals(expected, self.createNightly().probeAppInfo(datetime.date(2012, 1, 3)))
+    self.assertEquals(requests, len(self.mServer.mRequests))
+
+  def test_probe_app_infos_from_metadata(self):
+    for (build, changeset) in ((self.BUILDS[0], '4ac40cd2ab9f'), (self.BUILDS[3], '6d3a7a4b1c5e')):
+      fp = open(os.path.join(self.mTempDir, 'nightly', build.replace('.tar.bz2', '.txt')), 'w')
+      fp.write("20120101030526\nhttp://hg.mozilla.org/mozilla-central/rev/%s\n" % changeset)
+      fp.close()
+    # the archives themselves aren't touched: they aren't even archives
+    infos = self.createNightly().probeAppInfos([datetime.date(2012, 1, day) for day in (1, 2, 3)])
+    self.assertEquals({datetime.date(2012, 1, 1): ('http://hg.mozilla.org/mozilla-central', '4ac40cd2ab9f'),
+                       datetime.date(2012, 1, 3): ('http://hg.mozilla.org/mozilla-central', '6d3a7a4b1c5e')},
+                      infos)
+
+  def test_probe_app_infos_when_the_server_drops_one(self):
+    for (build, changeset) in ((self.BUILDS[0], '4ac40cd2ab9f'), (self.BUILDS[3], '6d3a7a4b1c5e')):
+      fp = open(os.path.join(self.mTempDir, 'nightly', build.replace('.tar.bz2', '.txt')), 'w')
+      fp.write("20120101030526\nhttp://hg.mozilla.org/mozilla-central/rev/%s\n" % changeset)
+      fp.close()
+    # only the date whose metadata never comes back is lost
+    self.mServer.mDropped.add('/' + self.BUILDS[0].replace('.tar.bz2', '.txt'))
+    infos = self.createNightly().probeAppInfos([datetime.date(2012, 1, day) for day in (1, 3)])
+    self.assertEquals({datetime.date(2012, 1, 3): ('http://hg.mozilla.org/mozilla-central', '6d3a7a4b1c5e')},
+                      infos)
+
+if __name__ == '__main__':
+  unittest.main()
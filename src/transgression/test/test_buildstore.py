@@ -0,0 +1,93 @@
+import os
+import sys
+sys.path.insert(0,os.path.abspath(__file__+"/../.."))
+import shutil
+import stat
+import tempfile
+import unittest
+from transgression import buildstore
+
+class BuildStoreTest(unittest.TestCase):
+  def setUp(self):
+    self.mTempDir = tempfile.mkdtemp()
+    self.mStore = buildstore.BuildStore(os.path.join(self.mTempDir, 'store'))
+
+  def tearDown(self):
+    shutil.rmtree(self.mTempDir)
+
+  def createBuild(self, aName, aFiles):
+    root = os.path.join(self.mTempDir, aName)
+    for (path, content) in aFiles.items():
+      path = os.path.join(root, path)
+      if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+      fp = open(path, 'wb')
+      fp.write(content)
+      fp.close()
+    return root
+
+  def test_checkout(self):
+    build = self.createBuild('build1', {'firefox/firefox': '#!/bin/sh\n',
+                                        'firefox/omni.ja': 'x' * 1000,
+                                        'firefox/defaults/pref/channel.js': 'nightly'})
+    os.chmod(os.path.join(build, 'firefox/firefox'), 0755)
+    os.symlink('firefox', os.path.join(build, 'firefox/firefox-bin'))
+    self.mStore.add('firefox/2012-01-01', build)
+    shutil.rmtree(build)
+
+    dest = os.path.join(self.mTempDir, 'moznightlyapp')
+    self.assertTrue(self.mStore.checkout('firefox/2012-01-01', dest))
+    self.assertEquals('x' * 1000, open(os.path.join(dest, 'firefox/omni.ja')).read())
+    self.assertEquals('nightly', open(os.path.join(dest, 'firefox/defaults/pref/channel.js')).read())
+    self.assertEquals('firefox', os.readlink(os.path.join(dest, 'firefox/firefox-bin')))
+    mode = os.stat(os.path.join(dest, 'firefox/firefox')).st_mode
+    self.assertTrue(mode & stat.S_IXUSR)
+    self.assertFalse(mode & stat.S_IWUSR)
+
+    self.assertFalse(self.mStore.checkout('firefox/2012-01-02', dest + '2'))
+
+  def test_removing_a_checkout_keeps_the_objects_read_only(self):
+    build = self.createBuild('build1', {'firefox/firefox': '#!/bin/sh\n'})
+    os.chmod(os.path.join(build, 'firefox/firefox'), 0555)
+    os.chmod(os.path.join(build, 'firefox'), 0555)
+    self.mStore.add('firefox/2012-01-01', build)
+    objects = []
+    for root, dirs, files in os.walk(self.mStore.objects):
+      objects.extend([os.path.join(root, name) for name in files])
+    self.assertEquals(1, len(objects))
+
+    # as install() does: remove the stored tree, check it out, remove that
+    buildstore.rmtree(build)
+    self.assertFalse(os.path.exists(build))
+    self.assertTrue(self.mStore.checkout('firefox/2012-01-01', build))
+    buildstore.rmtree(build)
+    self.assertEquals(0555, stat.S_IMODE(os.stat(objects[0]).st_mode))
+    self.assertTrue(objects[0].endswith('-555'))
+    self.assertTrue(self.mStore.checkout('firefox/2012-01-01', build))
+    self.assertEquals(0555, stat.S_IMODE(os.stat(os.path.join(build, 'firefox/firefox')).st_mode))
+    buildstore.rmtree(build)
+    buildstore.rmtree(build)
+
+  def test_identical_files_are_stored_once(self):
+    build1 = self.createBuild('build1', {'omni.ja': 'x' * 1000, 'buildid': '1'})
+    build2 = self.createBuild('build2', {'omni.ja': 'x' * 1000, 'buildid': '2'})
+    self.mStore.add('1', build1)
+    self.mStore.add('2', build2)
+    self.assertEquals(1002, self.mStore.size())
+    self.assertTrue(os.path.samefile(os.path.join(build1, 'omni.ja'),
+                                     os.path.join(build2, 'omni.ja')))
+
+  def test_least_recently_used_builds_are_evicted(self):
+    store = buildstore.BuildStore(os.path.join(self.mTempDir, 'small'), maxBytes=2500)
+    for (i, name) in enumerate(['a', 'b', 'c']):
+      build = self.createBuild(name, {'omni.ja': name * 1000})
+      store.add(name, build)
+      # manifest times only have to differ for the test
+      os.utime(store._manifestPath(name), (i, i))
+      if name == 'b':
+        store.checkout('a', os.path.join(self.mTempDir, 'a2'))
+    self.assertEquals([True, False, True], [store.has(name) for name in 'abc'])
+    self.assertEquals(2000, store.size())
+
+if __name__ == '__main__':
+  unittest.main()
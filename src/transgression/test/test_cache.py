@@ -0,0 +1,78 @@
+import os
+import sys
+sys.path.insert(0,os.path.abspath(__file__+"/../.."))
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from transgression import cache
+
+class ArchiveCacheTest(unittest.TestCase):
+  def setUp(self):
+    self.mTempDir = tempfile.mkdtemp()
+    self.mCache = cache.ArchiveCache(os.path.join(self.mTempDir, 'cache'), 250)
+
+  def tearDown(self):
+    shutil.rmtree(self.mTempDir)
+
+  def addArchive(self, aKey, aName, aSize):
+    tmp = self.mCache.tempPath(aKey, aName)
+    fp = open(tmp, 'wb')
+    fp.write('x' * aSize)
+    fp.close()
+    return self.mCache.put(aKey, tmp, aName)
+
+  def test_put_and_get(self):
+    key = cache.ArchiveCache.buildKey('firefox', 'mozilla-central', 'Linux64', '2012-01-01')
+    self.assertEquals(None, self.mCache.get(key))
+    path = self.addArchive(key, 'firefox.tar.bz2', 10)
+    self.assertEquals(path, self.mCache.get(key))
+    self.assertEquals('firefox.tar.bz2', os.path.basename(path))
+    self.assertTrue(self.mCache.contains(path))
+    self.assertFalse(self.mCache.contains(os.path.join(self.mTempDir, 'firefox.tar.bz2')))
+
+  def test_evicts_least_recently_used(self):
+    first = self.addArchive('a', 'a.zip', 100)
+    second = self.addArchive('b', 'b.zip', 100)
+    os.utime(first, (time.time() - 20, time.time() - 20))
+    os.utime(second, (time.time() - 10, time.time() - 10))
+
+    # a hit makes 'a' the most recently used entry, so 'b' goes first
+    self.mCache.get('a')
+    self.addArchive('c', 'c.zip', 100)
+    self.assertNotEquals(None, self.mCache.get('a'))
+    self.assertEquals(None, self.mCache.get('b'))
+    self.assertNotEquals(None, self.mCache.get('c'))
+    self.assertEquals(200, self.mCache.size())
+
+  def test_pinned_entries_are_not_evicted(self):
+    first = self.addArchive('a', 'a.zip', 200)
+    pin = self.mCache.pin(first)
+    self.addArchive('b', 'b.zip', 100)
+    self.assertTrue(os.path.exists(first))
+    pin.release()
+    self.addArchive('c', 'c.zip', 10)
+    self.assertEquals(None, self.mCache.get('a'))
+
+  def test_threads_share_the_lock(self):
+    self.addArchive('a', 'a.zip', 10)
+    errors = []
+    def getMany():
+      try:
+        for i in range(300):
+          self.assertNotEquals(None, self.mCache.get('a'))
+      except Exception as e:
+        errors.append(e)
+    threads = [threading.Thread(target=getMany) for i in range(4)]
+    for thread in threads:
+      # a deadlock fails the test rather than hanging the suite
+      thread.daemon = True
+      thread.start()
+    for thread in threads:
+      thread.join(10)
+    self.assertEquals([], [thread for thread in threads if thread.is_alive()])
+    self.assertEquals([], errors)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -1,6 +1,8 @@
 import os
 import sys
 sys.path.insert(0,os.path.abspath(__file__+"/../.."))
+import shutil
+import tempfile
 import unittest
 import json
 from transgression import config
@@ -8,6 +10,16 @@ from transgression import config
 class ConfigTest(unittest.TestCase):
   def setUp(self):
     self.mJsonString = open(os.path.abspath(os.path.dirname(os.path.realpath(__file__))+"/data/testConfig.json"), 'r').read()
+    self.mTempDir = tempfile.mkdtemp()
+    self.mPath = os.path.join(self.mTempDir, 'config.json')
+
+  def tearDown(self):
+    shutil.rmtree(self.mTempDir)
+
+  def loadConfig(self):
+    configObj = json.loads(self.mJsonString, object_hook=config.config_decoder)
+    configObj.setPath(self.mPath)
+    return configObj
 
   def test_configuration_construction(self):
     configObj = json.loads(self.mJsonString, object_hook=config.config_decoder)
@@ -19,7 +31,7 @@ class ConfigTest(unittest.TestCase):
     self.assertEquals('jenkinsmonkey.local/APKS/%year%-%month%-%day%/%time%/%commitid%/%appname%-debug-%buildnumber%.apk', configObj.getApplication('Jingit').getPlatformConfiguration('android').getBinaryRepository().getLocationFormatString())
 
   def test_configuration_add_application(self):
-    configObj = json.loads(self.mJsonString, object_hook=config.config_decoder)
+    configObj = self.loadConfig()
     platformConfigDict = { 'windows' : { 'firstBinaryDate' : '2010-01-01', 'processName' : 'Jingit-bin', 'binaryRepository' : { 'protocol' : 'sftp', 'location': 'www.google.com'}}}
     configObj.addApplication('testApp', platformConfigDict)
     self.assertTrue(configObj.hasApplication('testApp'))
@@ -28,6 +40,9 @@ class ConfigTest(unittest.TestCase):
     self.assertEquals(2010, configObj.getApplication('testApp').getPlatformConfiguration('windows').getFirstBinaryDate().year)
     self.assertEquals('sftp', configObj.getApplication('testApp').getPlatformConfiguration('windows').getBinaryRepository().getProtocol())
     self.assertEquals('www.google.com', configObj.getApplication('testApp').getPlatformConfiguration('windows').getBinaryRepository().getLocationFormatString())
+    saved = config.load_config(self.mPath)
+    self.assertTrue(saved.hasApplication('testApp'))
+    self.assertEquals(2, saved.getNumApplications())
 
   # def test_add_application(self):
   #   configObj = json.loads(self.mJsonString, object_hook=config.config_decoder)
@@ -35,27 +50,38 @@ class ConfigTest(unittest.TestCase):
   #   configObj.addApplication('WokkaWokka', platformConfigDict)
 
   def test_json_encoding(self):
-    configObj = json.loads(self.mJsonString, object_hook=config.config_decoder)
+    configObj = self.loadConfig()
     app = configObj.getApplication('Jingit')
     platConfig = app.getPlatformConfiguration('android')
     binRepo = platConfig.getBinaryRepository()
 
-    expectedBinaryRepoOutput = "{ 'protocol' : 'sftp', 'location' : 'jenkinsmonkey.local/APKS/%year%-%month%-%day%/%time%/%commitid%/%appname%-debug-%buildnumber%.apk'}"
+    expectedBinaryRepo = { 'protocol' : 'sftp', 'location' : 'jenkinsmonkey.local/APKS/%year%-%month%-%day%/%time%/%commitid%/%appname%-debug-%buildnumber%.apk'}
+    self.assertEquals(expectedBinaryRepo, json.loads(json.dumps(binRepo, cls=config.BinaryRepositoryEncoder)))
+
+    expectedPlatConfig = { 'processName' : 'air.com.jingit.mobile', 'firstBinaryDate' : '2009-01-01', 'binaryRepository' : expectedBinaryRepo }
+    self.assertEquals(expectedPlatConfig, json.loads(json.dumps(platConfig, cls=config.PlatformConfigurationEncoder)))
 
-    self.assertEquals(expectedBinaryRepoOutput, config.BinaryRepositoryEncoder.encode(binRepo))
-    self.assertEquals(expectedBinaryRepoOutput, json.dumps(binRepo, cls=config.BinaryRepositoryEncoder))
+    expectedAppConfig = { 'platformConfigurations' : { 'android' : expectedPlatConfig }}
+    self.assertEquals(expectedAppConfig, json.loads(json.dumps(app, cls=config.ApplicationConfigEncoder)))
 
-    expectedPlatConfigOutput = "{ 'processName' : 'air.com.jingit.mobile', 'firstBinaryDate' : '2009-01-01', 'binaryRepository' : " + expectedBinaryRepoOutput + "}"
-    self.assertEquals(expectedPlatConfigOutput, config.PlatformConfigurationEncoder.encode(platConfig))
-    self.assertEquals(expectedPlatConfigOutput, json.dumps(platConfig, cls=config.PlatformConfigurationEncoder))
+    expectedConfig = { '__type__' : 'transgression-configuration', 'applications' : { 'Jingit' : expectedAppConfig }}
+    self.assertEquals(expectedConfig, json.loads(json.dumps(configObj, cls=config.ConfigEncoder, indent=2)))
+    self.assertEquals(json.loads(self.mJsonString), json.loads(json.dumps(configObj, cls=config.ConfigEncoder)))
 
-    expectedAppConfigOutput = "{ 'Jingit': { 'platformConfigurations' : { " + expectedPlatConfigOutput + "}}}"
-    self.assertEquals(expectedAppConfigOutput, config.ApplicationConfigEncoder.encode(app))
-    self.assertEquals(expectedAppConfigOutput, json.dumps(app, cls=config.ApplicationConfigEncoder))
+  def test_round_trip(self):
+    configObj = self.loadConfig()
+    with configObj.batch():
+      for i in range(200):
+        platformConfigDict = { 'linux' : { 'firstBinaryDate' : '2012-01-01', 'processName' : 'app%d' % i, 'binaryRepository' : { 'protocol' : 'file', 'location': 'localhost/builds/app%d/%%appname%%.tar.bz2' % i}}}
+        configObj.addApplication('app%d' % i, platformConfigDict)
+      # nothing is written until the batch ends
+      self.assertFalse(os.path.exists(self.mPath))
+    self.assertEquals([], [name for name in os.listdir(self.mTempDir) if name != 'config.json'])
 
-    expectedConfigOutput = "{ '__type__' : 'transgression-configuration', 'applications' : " + expectedAppConfigOutput + "}}"
-    self.assertEquals(expectedConfigOutput, config.ConfigEncoder.encode(configObj))
-    self.assertEquals(expectedConfigOutput, json.dumps(configObj, cls=config.ConfigEncoder, indent=2))
+    saved = config.load_config(self.mPath)
+    self.assertEquals(201, saved.getNumApplications())
+    self.assertEquals('app42', saved.getApplication('app42').getPlatformConfiguration('linux').getProcessName())
+    self.assertEquals(open(self.mPath).read(), json.dumps(saved, cls=config.ConfigEncoder, indent=2, sort_keys=True))
 
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,143 @@
+import os
+import sys
+sys.path.insert(0,os.path.abspath(__file__+"/../.."))
+import shutil
+import tempfile
+import threading
+import unittest
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from transgression import download
+
+class ArchiveRequestHandler(BaseHTTPRequestHandler):
+  # Serves self.server.mPayload with Range support, cutting the response
+  # short after self.server.mCutAfter bytes if that is set.
+  def do_GET(self):
+    payload = self.server.mPayload
+    self.server.mRequests.append(dict(self.headers))
+    start = 0
+    end = len(payload) - 1
+    rangeHeader = self.headers.getheader('Range')
+    ifRange = self.headers.getheader('If-Range')
+    if rangeHeader and not self.server.mNoRanges and ifRange in (None, '"v1"'):
+      (start, end) = rangeHeader[len('bytes='):].split('-')
+      start = int(start)
+      end = int(end or len(payload) - 1)
+      self.send_response(206)
+      self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end, len(payload)))
+    else:
+      self.send_response(200)
+    self.send_header('ETag', '"v1"')
+    self.send_header('Content-Length', str(end + 1 - start))
+    self.end_headers()
+    body = payload[start:end + 1]
+    if self.server.mCutAfter:
+      body = body[:self.server.mCutAfter]
+      self.server.mCutAfter = None
+    self.wfile.write(body)
+
+  def log_message(self, *aArgs):
+    pass
+
+class ArchiveServer(ThreadingMixIn, HTTPServer):
+  daemon_threads = True
+
+class DownloadTest(unittest.TestCase):
+  def setUp(self):
+    self.mTempDir = tempfile.mkdtemp()
+    self.mServer = ArchiveServer(('127.0.0.1', 0), ArchiveRequestHandler)
+    self.mServer.mPayload = os.urandom(300 * 1024)
+    self.mServer.mCutAfter = None
+    self.mServer.mRequests = []
+    self.mServer.mNoRanges = False
+    self.mThread = threading.Thread(target=self.mServer.serve_forever)
+    self.mThread.daemon = True
+    self.mThread.start()
+    self.mUrl = 'http://127.0.0.1:%d/firefox.tar.bz2' % self.mServer.server_address[1]
+
+  def tearDown(self):
+    self.mServer.shutdown()
+    self.mServer.server_close()
+    shutil.rmtree(self.mTempDir)
+
+  def test_download_streams_in_chunks(self):
+    dest = os.path.join(self.mTempDir, 'firefox.tar.bz2')
+    calls = []
+    download.download(self.mUrl, dest, progress=lambda r, l: calls.append((r, l)), chunkSize=64 * 1024)
+    self.assertEquals(self.mServer.mPayload, open(dest, 'rb').read())
+    self.assertEquals((0, 300 * 1024), calls[0])
+    self.assertEquals((300 * 1024, 300 * 1024), calls[-1])
+    self.assertEquals(6, len(calls))
+
+  def test_short_download_is_an_error(self):
+    dest = os.path.join(self.mTempDir, 'firefox.tar.bz2')
+    self.mServer.mCutAfter = 100 * 1024
+    self.assertRaises(download.DownloadError, download.download, self.mUrl, dest)
+    self.assertFalse(os.path.exists(dest))
+    self.assertEquals(100 * 1024, os.path.getsize(dest + '.part'))
+
+  def test_interrupted_download_resumes(self):
+    dest = os.path.join(self.mTempDir, 'firefox.tar.bz2')
+    self.mServer.mCutAfter = 100 * 1024
+    self.assertRaises(download.DownloadError, download.download, self.mUrl, dest)
+
+    calls = []
+    download.download(self.mUrl, dest, progress=lambda r, l: calls.append((r, l)))
+    self.assertEquals('bytes=102400-', self.mServer.mRequests[-1]['range'])
+    self.assertEquals((100 * 1024, 300 * 1024), calls[0])
+    self.assertEquals(self.mServer.mPayload, open(dest, 'rb').read())
+    self.assertFalse(os.path.exists(dest + '.part'))
+    self.assertFalse(os.path.exists(dest + '.part.json'))
+
+  def test_changed_file_is_downloaded_again(self):
+    dest = os.path.join(self.mTempDir, 'firefox.tar.bz2')
+    fp = open(dest + '.part', 'wb')
+    fp.write('stale')
+    fp.close()
+    partial = download.PartialDownload(dest)
+    partial.url = self.mUrl
+    partial.etag = '"v0"'
+    partial.save()
+
+    download.download(self.mUrl, dest)
+    self.assertEquals(self.mServer.mPayload, open(dest, 'rb').read())
+
+  def test_cancel_from_progress_callback(self):
+    dest = os.path.join(self.mTempDir, 'firefox.tar.bz2')
+    def cancel(aReceived, aLength):
+      if aReceived > 0:
+        raise download.DownloadCancelled()
+    self.assertRaises(download.DownloadCancelled, download.download, self.mUrl, dest, cancel)
+    self.assertFalse(os.path.exists(dest))
+
+  def test_segmented_download(self):
+    dest = os.path.join(self.mTempDir, 'firefox.tar.bz2')
+    calls = []
+    download.download(self.mUrl, dest, progress=lambda r, l: calls.append((r, l)), segments=4)
+    self.assertEquals(self.mServer.mPayload, open(dest, 'rb').read())
+    ranges = sorted([request['range'] for request in self.mServer.mRequests])
+    self.assertEquals(['bytes=0-0', 'bytes=0-76799', 'bytes=153600-230399',
+                       'bytes=230400-307199', 'bytes=76800-153599'], ranges)
+    self.assertEquals((300 * 1024, 300 * 1024), calls[-1])
+
+  def test_segmented_download_without_range_support(self):
+    dest = os.path.join(self.mTempDir, 'firefox.tar.bz2')
+    self.mServer.mNoRanges = True
+    download.download(self.mUrl, dest, segments=4)
+    self.assertEquals(self.mServer.mPayload, open(dest, 'rb').read())
+    self.assertEquals(2, len(self.mServer.mRequests))
+
+  def test_open_download_keeps_a_copy(self):
+    dest = os.path.join(self.mTempDir, 'firefox.tar.bz2')
+    self.mServer.mCutAfter = 100 * 1024
+    self.assertRaises(download.DownloadError, download.download, self.mUrl, dest)
+
+    # the part saved by the failed attempt is replayed before the rest
+    with download.open_download(self.mUrl, dest) as stream:
+      head = stream.read(1000)
+    self.assertEquals(self.mServer.mPayload[:1000], head)
+    self.assertEquals('bytes=102400-', self.mServer.mRequests[-1]['range'])
+    self.assertEquals(self.mServer.mPayload, open(dest, 'rb').read())
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,95 @@
+import os
+import sys
+sys.path.insert(0,os.path.abspath(__file__+"/../.."))
+import threading
+import time
+import unittest
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from transgression import httpsession
+
+class KeepAliveRequestHandler(BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+
+  def setup(self):
+    BaseHTTPRequestHandler.setup(self)
+    self.server.mConnections += 1
+
+  def do_GET(self):
+    if self.path == '/moved':
+      self.send_response(302)
+      self.send_header('Location', '/body')
+      self.send_header('Content-Length', '0')
+      self.end_headers()
+      return
+    if self.path == '/slow':
+      with self.server.mLock:
+        self.server.mActive += 1
+        self.server.mMaxActive = max(self.server.mMaxActive, self.server.mActive)
+      time.sleep(0.1)
+      with self.server.mLock:
+        self.server.mActive -= 1
+    body = 'x' * 1000
+    self.send_response(200)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, *aArgs):
+    pass
+
+class KeepAliveServer(ThreadingMixIn, HTTPServer):
+  daemon_threads = True
+
+class HttpSessionTest(unittest.TestCase):
+  def setUp(self):
+    self.mServer = KeepAliveServer(('127.0.0.1', 0), KeepAliveRequestHandler)
+    self.mServer.mConnections = 0
+    self.mServer.mActive = 0
+    self.mServer.mMaxActive = 0
+    self.mServer.mLock = threading.Lock()
+    self.mThread = threading.Thread(target=self.mServer.serve_forever)
+    self.mThread.daemon = True
+    self.mThread.start()
+    self.mBaseUrl = 'http://127.0.0.1:%d' % self.mServer.server_address[1]
+
+  def tearDown(self):
+    self.mServer.shutdown()
+    self.mServer.server_close()
+
+  def test_connections_are_reused(self):
+    session = httpsession.HttpSession()
+    for i in range(5):
+      response, content = session.get(self.mBaseUrl + '/body')
+      self.assertEquals(200, response.status)
+      self.assertEquals(1000, len(content))
+    session.close()
+    self.assertEquals(1, self.mServer.mConnections)
+
+  def test_unread_responses_are_not_reused(self):
+    session = httpsession.HttpSession()
+    response = session.request(self.mBaseUrl + '/body')
+    response.read(10)
+    response.close()
+    self.assertEquals(200, session.get(self.mBaseUrl + '/body')[0].status)
+    self.assertEquals(2, self.mServer.mConnections)
+
+  def test_redirects_are_followed(self):
+    response, content = httpsession.HttpSession().get(self.mBaseUrl + '/moved')
+    self.assertEquals(200, response.status)
+    self.assertEquals(self.mBaseUrl + '/body', response.url)
+    self.assertEquals(1000, len(content))
+
+  def test_connections_per_host_are_limited(self):
+    session = httpsession.HttpSession(maxPerHost=2)
+    threads = [threading.Thread(target=session.get, args=(self.mBaseUrl + '/slow',))
+               for i in range(6)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEquals(2, self.mServer.mMaxActive)
+    self.assertEquals(2, self.mServer.mConnections)
+
+if __name__ == '__main__':
+  unittest.main()
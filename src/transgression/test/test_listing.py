@@ -0,0 +1,126 @@
+import os
+import sys
+sys.path.insert(0,os.path.abspath(__file__+"/../.."))
+import datetime
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from transgression import listing
+
+MONTH_LISTING = """<html><body><h1>Index of /pub/firefox/nightly/2012/01/</h1>
+<a href="/pub/firefox/nightly/2012/">Parent Directory</a>
+<a href="2012-01-01-03-05-26-mozilla-central/">2012-01-01-03-05-26-mozilla-central/</a>
+<a href='2012-01-02-03-05-26-mozilla-central/'>2012-01-02-03-05-26-mozilla-central/</a>
+<a href=2012-01-02-04-02-11-mozilla-aurora/>2012-01-02-04-02-11-mozilla-aurora/</a>
+</body></html>"""
+
+class ListingRequestHandler(BaseHTTPRequestHandler):
+  def do_GET(self):
+    self.server.mRequests.append(dict(self.headers))
+    if '1999' in self.path:
+      self.send_error(404)
+      return
+    if self.headers.getheader('If-None-Match') == '"month"':
+      self.send_response(304)
+      self.end_headers()
+      return
+    self.send_response(200)
+    self.send_header('ETag', '"month"')
+    self.send_header('Content-Length', str(len(MONTH_LISTING)))
+    self.end_headers()
+    self.wfile.write(MONTH_LISTING)
+
+  def log_message(self, *aArgs):
+    pass
+
+class ListingCacheTest(unittest.TestCase):
+  def setUp(self):
+    self.mTempDir = tempfile.mkdtemp()
+    self.mServer = HTTPServer(('127.0.0.1', 0), ListingRequestHandler)
+    self.mServer.mRequests = []
+    self.mThread = threading.Thread(target=self.mServer.serve_forever)
+    self.mThread.daemon = True
+    self.mThread.start()
+    self.mUrl = 'http://127.0.0.1:%d/pub/firefox/nightly/2012/01/' % self.mServer.server_address[1]
+
+  def tearDown(self):
+    self.mServer.shutdown()
+    self.mServer.server_close()
+    shutil.rmtree(self.mTempDir)
+
+  def test_recent_listings_are_revalidated(self):
+    self.assertEquals(MONTH_LISTING, listing.ListingCache(self.mTempDir).fetch(self.mUrl))
+    # a new cache object stands in for a later process
+    self.assertEquals(MONTH_LISTING, listing.ListingCache(self.mTempDir).fetch(self.mUrl))
+    self.assertEquals(2, len(self.mServer.mRequests))
+    self.assertEquals('"month"', self.mServer.mRequests[1]['if-none-match'])
+
+  def test_settled_listings_are_not_requested_again(self):
+    settled = time.time() - 60
+    listing.ListingCache(self.mTempDir).fetch(self.mUrl, settled)
+    cache = listing.ListingCache(self.mTempDir)
+    self.assertEquals(MONTH_LISTING, cache.fetch(self.mUrl, settled))
+    self.assertEquals(0, cache.requests)
+    self.assertEquals(1, len(self.mServer.mRequests))
+
+  def test_listings_stored_before_settling_are_revalidated_once(self):
+    # stored while the month was still going
+    listing.ListingCache(self.mTempDir).fetch(self.mUrl)
+    settled = time.time() + 0.01
+    time.sleep(0.02)
+    cache = listing.ListingCache(self.mTempDir)
+    self.assertEquals(MONTH_LISTING, cache.fetch(self.mUrl, settled))
+    self.assertEquals(MONTH_LISTING, cache.fetch(self.mUrl, settled))
+    self.assertEquals(1, cache.requests)
+    self.assertEquals('"month"', self.mServer.mRequests[1]['if-none-match'])
+
+  def test_missing_listing(self):
+    missing = self.mUrl.replace('2012/01', '1999/01')
+    self.assertEquals(None, listing.ListingCache(self.mTempDir).fetch(missing, time.time()))
+
+  def test_concurrent_saves(self):
+    # the crawler, prefetching and parallel jobs share one cache
+    cache = listing.ListingCache(self.mTempDir)
+    errors = []
+    def saveMany():
+      for i in range(200):
+        try:
+          cache._save({'url': self.mUrl, 'fetched': time.time(), 'content': MONTH_LISTING * 20})
+        except Exception as e:
+          errors.append(e)
+    threads = [threading.Thread(target=saveMany) for i in range(8)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEquals([], errors)
+    self.assertEquals(MONTH_LISTING * 20, cache.fetch(self.mUrl, time.time() - 60))
+    self.assertEquals([], [name for name in os.listdir(self.mTempDir) if name.endswith('.tmp')])
+
+  def test_month_settled_since(self):
+    self.assertEquals(None, listing.monthSettledSince(datetime.date.today()))
+    settled = listing.monthSettledSince(datetime.date(2012, 1, 15))
+    self.assertEquals(time.mktime((2012, 2, 1, 0, 0, 0, 0, 0, -1)) + listing.SETTLE_MARGIN, settled)
+
+class ParseLinksTest(unittest.TestCase):
+  def test_parse_links(self):
+    self.assertEquals(('/pub/firefox/nightly/2012/',
+                       '2012-01-01-03-05-26-mozilla-central/',
+                       '2012-01-02-03-05-26-mozilla-central/',
+                       '2012-01-02-04-02-11-mozilla-aurora/'), listing.parseLinks(MONTH_LISTING))
+
+  def test_parse_links_ignores_other_tags(self):
+    content = '<link href="style.css"><A NAME="top" HREF="a.zip?x=1&amp;y=2">a</A><area href="map">'
+    self.assertEquals(('a.zip?x=1&y=2',), listing.parseLinks(content))
+
+  def test_day_dir_regex(self):
+    match = listing.dayDirRegex.match('2010-03-18-03-45-15-mozilla-1.9.2/')
+    self.assertEquals(('2010-03-18', '03-45-15', 'mozilla-1.9.2'), match.groups())
+    match = listing.dayDirRegex.match('2008-06-17-02-trunk/')
+    self.assertEquals(('2008-06-17', '02', 'trunk'), match.groups())
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,84 @@
+import os
+import sys
+sys.path.insert(0,os.path.abspath(__file__+"/../.."))
+import datetime
+import unittest
+from transgression import location
+
+TEMPLATE = 'jenkinsmonkey.local/APKS/%year%-%month%-%day%/%time%/%commitid%/%appname%-debug-%buildnumber%.apk'
+
+# A Jenkins tree of two builds a day, and some clutter, as listings.
+class FakeTree(object):
+  def __init__(self):
+    self.mListings = {'.': ['APKS', 'other'], 'APKS': ['notes.txt', 'latest']}
+    self.mListed = []
+    buildnumber = 100
+    for day in range(1, 6):
+      dayDir = 'APKS/2012-01-%02d' % day
+      self.mListings['APKS'].append(dayDir[5:])
+      self.mListings[dayDir] = []
+      for time in ('03-00-00', '15-00-00'):
+        buildnumber += 1
+        commit = '%012x' % (buildnumber * 7919)
+        self.mListings[dayDir].append(time)
+        self.mListings[dayDir + '/' + time] = [commit]
+        self.mListings[dayDir + '/' + time + '/' + commit] = ['Jingit-debug-%d.apk' % buildnumber, 'build.log']
+
+  def listdirs(self, aPaths):
+    self.mListed.append(aPaths)
+    return dict([(path, self.mListings[path]) for path in aPaths if path in self.mListings])
+
+class LocationTemplateTest(unittest.TestCase):
+  def test_split_location(self):
+    self.assertEquals(('jenkinsmonkey.local', 'APKS/%year%'), location.split_location('jenkinsmonkey.local/APKS/%year%'))
+    self.assertEquals(('jenkinsmonkey.local', '.'), location.split_location('jenkinsmonkey.local'))
+
+  def test_walk(self):
+    tree = FakeTree()
+    template = location.LocationTemplate(TEMPLATE)
+    self.assertEquals('jenkinsmonkey.local', template.host)
+    index = template.walk(tree.listdirs)
+    self.assertEquals(10, len(index))
+    build = index.builds[0]
+    self.assertEquals('APKS/2012-01-01/03-00-00/%012x/Jingit-debug-101.apk' % (101 * 7919), build.path)
+    self.assertEquals((datetime.date(2012, 1, 1), '03-00-00', '%012x' % (101 * 7919), 101),
+                      (build.date, build.time, build.commitid, build.buildnumber))
+    self.assertEquals([datetime.date(2012, 1, day) for day in range(1, 6)], index.dates())
+    self.assertEquals(101, index.lookup(datetime.date(2012, 1, 1)).buildnumber)
+    self.assertEquals([110], [build.buildnumber for build in index.byCommit('%012x' % (110 * 7919))])
+    # one call per level below the fixed APKS, which isn't listed itself
+    # but whose contents are
+    self.assertEquals(['APKS'], tree.mListed[0])
+    self.assertEquals(4, len(tree.mListed))
+
+  def test_walk_is_pruned_to_the_dates(self):
+    tree = FakeTree()
+    index = location.LocationTemplate(TEMPLATE).walk(tree.listdirs, datetime.date(2012, 1, 2),
+                                                      datetime.date(2012, 1, 3))
+    self.assertEquals([datetime.date(2012, 1, 2), datetime.date(2012, 1, 3)], index.dates())
+    listed = sum(tree.mListed, [])
+    self.assertFalse([path for path in listed if '2012-01-01' in path or '2012-01-05' in path])
+
+  def test_known_values_are_not_listed(self):
+    tree = FakeTree()
+    template = location.LocationTemplate('host/APKS/%year%-%month%-%day%/%time%')
+    index = template.walk(tree.listdirs, values={'year': '2012', 'month': '01', 'day': '04'})
+    self.assertEquals(['APKS/2012-01-04/03-00-00', 'APKS/2012-01-04/15-00-00'], [build.path for build in index])
+    self.assertEquals([['APKS/2012-01-04']], tree.mListed)
+
+  def test_repeated_placeholder_must_agree(self):
+    listings = {'.': ['2012', '2013'], '2012': ['app-2012.apk', 'app-2013.apk']}
+    template = location.LocationTemplate('host/%year%/app-%year%.apk')
+    index = template.walk(lambda aPaths: dict([(path, listings.get(path, [])) for path in aPaths]))
+    self.assertEquals(['2012/app-2012.apk'], [build.path for build in index])
+
+  def test_expand(self):
+    template = location.LocationTemplate('host//srv/%appname%/%buildnumber%.apk')
+    self.assertEquals('/srv/Jingit/12.apk', template.expand({'appname': 'Jingit', 'buildnumber': '12'}))
+    self.assertEquals(None, template.expand({'appname': 'Jingit'}))
+
+  def test_unknown_placeholder(self):
+    self.assertRaises(ValueError, location.LocationTemplate, 'host/%branch%/app.apk')
+
+if __name__ == '__main__':
+  unittest.main()
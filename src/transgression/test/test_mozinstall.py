@@ -0,0 +1,191 @@
+import os
+import sys
+sys.path.insert(0,os.path.abspath(__file__+"/../.."))
+import mmap
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import unittest
+import zipfile
+from StringIO import StringIO
+from transgression import mozInstall
+from transgression import parallelbz2
+
+# Hands out data in small, uneven reads, the way a network stream does.
+class TrickleStream(object):
+  def __init__(self, aData):
+    self.mData = StringIO(aData)
+
+  def read(self, aSize=-1):
+    if aSize < 0:
+      return self.mData.read()
+    return self.mData.read(min(aSize, 1000))
+
+# Builds a small firefox tree to archive, and checks what was installed.
+class ArchiveTestCase(unittest.TestCase):
+  def setUp(self):
+    self.mTempDir = tempfile.mkdtemp()
+    self.mSourceDir = os.path.join(self.mTempDir, 'firefox')
+    os.makedirs(os.path.join(self.mSourceDir, 'components'))
+    self.mFiles = {
+      'firefox': os.urandom(50000),
+      'application.ini': '[App]\nSourceStamp=abcdef\n',
+      os.path.join('components', 'libxul.so'): 'x' * 200000,
+    }
+    for name, content in self.mFiles.items():
+      fp = open(os.path.join(self.mSourceDir, name), 'wb')
+      fp.write(content)
+      fp.close()
+    os.chmod(os.path.join(self.mSourceDir, 'firefox'), 0755)
+    self.mDest = os.path.join(self.mTempDir, 'moznightlyapp')
+
+  def tearDown(self):
+    shutil.rmtree(self.mTempDir)
+
+  def assertInstalled(self):
+    for name, content in self.mFiles.items():
+      self.assertEquals(content, open(os.path.join(self.mDest, 'firefox', name), 'rb').read())
+    self.assertEquals(0755, os.stat(os.path.join(self.mDest, 'firefox', 'firefox')).st_mode & 0777)
+
+class StreamInstallTest(ArchiveTestCase):
+  def test_tar_bz2(self):
+    archive = os.path.join(self.mTempDir, 'firefox.tar.bz2')
+    tar = tarfile.open(archive, 'w:bz2')
+    tar.add(self.mSourceDir, 'firefox')
+    tar.close()
+    mozInstall.streamInstall(TrickleStream(open(archive, 'rb').read()), archive, self.mDest)
+    self.assertInstalled()
+
+  def test_tar_copies_big_members_in_chunks(self):
+    archive = os.path.join(self.mTempDir, 'firefox.tar.gz')
+    tar = tarfile.open(archive, 'w:gz')
+    tar.add(self.mSourceDir, 'firefox')
+    tar.close()
+    copied = []
+    ParallelWriter = mozInstall.ParallelWriter
+    class SmallWriter(ParallelWriter):
+      def __init__(aSelf):
+        ParallelWriter.__init__(aSelf, bufferSize=100000)
+
+      def copy(aSelf, aPath, aFp, aMode, chunkSize=1024 * 1024):
+        copied.append(os.path.relpath(aPath, self.mDest))
+        ParallelWriter.copy(aSelf, aPath, aFp, aMode, chunkSize=4096)
+    mozInstall.ParallelWriter = SmallWriter
+    try:
+      mozInstall.streamInstall(TrickleStream(open(archive, 'rb').read()), archive, self.mDest)
+    finally:
+      mozInstall.ParallelWriter = ParallelWriter
+    self.assertInstalled()
+    self.assertEquals([os.path.join('firefox', 'components', 'libxul.so')], copied)
+
+  def test_zip(self):
+    archive = os.path.join(self.mTempDir, 'firefox.zip')
+    subprocess.check_call(['zip', '-q', '-r', archive, 'firefox'], cwd=self.mTempDir)
+    mozInstall.streamInstall(TrickleStream(open(archive, 'rb').read()), archive, self.mDest)
+    self.assertInstalled()
+
+  def test_zip_with_data_descriptors(self):
+    # zip -fd writes sizes and checksums after each member's data
+    archive = os.path.join(self.mTempDir, 'firefox.zip')
+    subprocess.check_call(['zip', '-q', '-fd', '-r', archive, 'firefox'], cwd=self.mTempDir)
+    mozInstall.streamInstall(TrickleStream(open(archive, 'rb').read()), archive, self.mDest)
+    self.assertInstalled()
+
+  def test_corrupt_zip(self):
+    archive = os.path.join(self.mTempDir, 'firefox.zip')
+    subprocess.check_call(['zip', '-q', '-r', '-0', archive, 'firefox'], cwd=self.mTempDir)
+    data = open(archive, 'rb').read()
+    corrupt = data.replace('SourceStamp', 'SourceStump')
+    self.assertRaises(zipfile.BadZipfile, mozInstall.streamInstall, TrickleStream(corrupt), archive, self.mDest)
+
+  def test_zip_with_symlink(self):
+    archive = os.path.join(self.mTempDir, 'firefox.zip')
+    os.symlink('firefox', os.path.join(self.mSourceDir, 'firefox-bin'))
+    subprocess.check_call(['zip', '-q', '-y', '-r', archive, 'firefox'], cwd=self.mTempDir)
+    mozInstall.streamInstall(TrickleStream(open(archive, 'rb').read()), archive, self.mDest)
+    self.assertInstalled()
+    self.assertEquals('firefox', os.readlink(os.path.join(self.mDest, 'firefox', 'firefox-bin')))
+
+  def test_zip_member_outside_of_archive(self):
+    archive = os.path.join(self.mTempDir, 'evil.zip')
+    zipped = zipfile.ZipFile(archive, 'w')
+    zipped.writestr('../application.ini', 'evil')
+    zipped.close()
+    self.assertRaises(ValueError, mozInstall.streamInstall, TrickleStream(open(archive, 'rb').read()), archive, self.mDest)
+    self.assertFalse(os.path.exists(os.path.join(self.mTempDir, 'application.ini')))
+
+class MozInstallerTest(ArchiveTestCase):
+  def setUp(self):
+    ArchiveTestCase.setUp(self)
+    # the shell commands this replaced broke on spaces
+    self.mDest = os.path.join(self.mTempDir, 'install dir', 'moznightlyapp')
+    os.symlink('firefox', os.path.join(self.mSourceDir, 'firefox-bin'))
+
+  def assertInstalled(self):
+    ArchiveTestCase.assertInstalled(self)
+    self.assertEquals('firefox', os.readlink(os.path.join(self.mDest, 'firefox', 'firefox-bin')))
+
+  def createTar(self, aCompression):
+    archive = os.path.join(self.mTempDir, 'fire fox.tar.' + aCompression)
+    tar = tarfile.open(archive, 'w:' + aCompression)
+    tar.add(self.mSourceDir, 'firefox')
+    tar.close()
+    return archive
+
+  def test_tar_bz2(self):
+    mozInstall.MozInstaller(src=self.createTar('bz2'), dest=self.mDest, dest_app=None)
+    self.assertInstalled()
+
+  def test_tar_bz2_in_parallel(self):
+    # the blocks are found in the mapped archive
+    archives = []
+    def reader(aData, aProcesses):
+      archives.append(aData)
+      return parallelbz2.ParallelBZ2Reader(aData, aProcesses)
+    (minSize, processes) = (parallelbz2.MIN_PARALLEL_SIZE, mozInstall.BZ2_PROCESSES)
+    parallelbz2.MIN_PARALLEL_SIZE = 0
+    mozInstall.BZ2_PROCESSES = 2
+    mozInstall.ParallelBZ2Reader = reader
+    try:
+      mozInstall.MozInstaller(src=self.createTar('bz2'), dest=self.mDest, dest_app=None)
+    finally:
+      parallelbz2.MIN_PARALLEL_SIZE = minSize
+      mozInstall.BZ2_PROCESSES = processes
+      mozInstall.ParallelBZ2Reader = parallelbz2.ParallelBZ2Reader
+    self.assertInstalled()
+    self.assertTrue(isinstance(archives[0], mmap.mmap))
+    self.assertRaises(ValueError, archives[0].read, 1)
+
+  def test_tar_bz2_on_one_process(self):
+    # the archive is streamed through tarfile instead
+    processes = mozInstall.BZ2_PROCESSES
+    mozInstall.BZ2_PROCESSES = 1
+    mozInstall.ParallelBZ2Reader = None
+    try:
+      mozInstall.MozInstaller(src=self.createTar('bz2'), dest=self.mDest, dest_app=None)
+    finally:
+      mozInstall.BZ2_PROCESSES = processes
+      mozInstall.ParallelBZ2Reader = parallelbz2.ParallelBZ2Reader
+    self.assertInstalled()
+
+  def test_tar_gz(self):
+    mozInstall.MozInstaller(src=self.createTar('gz'), dest=self.mDest, dest_app=None)
+    self.assertInstalled()
+
+  def test_zip(self):
+    archive = os.path.join(self.mTempDir, 'fire fox.zip')
+    subprocess.check_call(['zip', '-q', '-y', '-r', archive, 'firefox'], cwd=self.mTempDir)
+    mozInstall.MozInstaller(src=archive, dest=self.mDest, dest_app=None)
+    self.assertInstalled()
+
+  def test_member_outside_of_archive(self):
+    archive = os.path.join(self.mTempDir, 'evil.tar.gz')
+    tar = tarfile.open(archive, 'w:gz')
+    tar.add(os.path.join(self.mSourceDir, 'application.ini'), '../application.ini')
+    tar.close()
+    self.assertRaises(ValueError, mozInstall.MozInstaller, src=archive, dest=self.mDest, dest_app=None)
+    self.assertFalse(os.path.exists(os.path.join(self.mTempDir, 'install dir', 'application.ini')))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,87 @@
+import os
+import sys
+sys.path.insert(0,os.path.abspath(__file__+"/../.."))
+import bz2
+import unittest
+from StringIO import StringIO
+from transgression import parallelbz2
+
+def readAll(aReader):
+  chunks = []
+  while True:
+    chunk = aReader.read(10240)
+    if not chunk:
+      break
+    chunks.append(chunk)
+  aReader.close()
+  return ''.join(chunks)
+
+class ParallelBZ2Test(unittest.TestCase):
+  def setUp(self):
+    # compressible enough to be quick, random enough for several blocks at
+    # the smallest block size
+    random = os.urandom(400000)
+    self.mData = ''.join([random[i:i + 1000] * 3 for i in range(0, len(random), 1000)])
+    self.mCompressed = bz2.compress(self.mData, 1)
+    self.mMinSize = parallelbz2.MIN_PARALLEL_SIZE
+    parallelbz2.MIN_PARALLEL_SIZE = 0
+
+  def tearDown(self):
+    parallelbz2.MIN_PARALLEL_SIZE = self.mMinSize
+
+  def test_find_blocks(self):
+    blocks = parallelbz2.find_blocks(self.mCompressed)
+    self.assertTrue(len(blocks) >= 10)
+    # the first block follows the 4 byte stream header
+    self.assertEquals(32, blocks[0][0])
+    for (block, following) in zip(blocks, blocks[1:]):
+      self.assertEquals(block[1], following[0])
+
+  def test_same_output_as_serial(self):
+    reader = parallelbz2.ParallelBZ2Reader(self.mCompressed, processes=3)
+    self.assertTrue(reader.pool is not None)
+    self.assertEquals(self.mData, readAll(reader))
+
+  def test_concatenated_streams(self):
+    compressed = self.mCompressed + bz2.compress('trailer' * 1000)
+    reader = parallelbz2.ParallelBZ2Reader(compressed, processes=2)
+    self.assertEquals(self.mData + 'trailer' * 1000, readAll(reader))
+
+  def test_falls_back_to_serial(self):
+    reader = parallelbz2.ParallelBZ2Reader(self.mCompressed, processes=2)
+    blocks = parallelbz2.find_blocks(self.mCompressed)
+    # as if the middle of the third block looked like a block header
+    (start, end) = blocks[2]
+    middle = (start + end) / 2
+    reader.chunks = reader._parallelChunks(blocks[:2] + [(start, middle), (middle, end)] + blocks[3:])
+    self.assertEquals(self.mData, readAll(reader))
+
+class BackgroundBZ2Test(unittest.TestCase):
+  def setUp(self):
+    self.mData = os.urandom(100000) * 5
+    self.mCompressed = bz2.compress(self.mData, 1)
+
+  def test_read(self):
+    reader = parallelbz2.BackgroundBZ2Reader(StringIO(self.mCompressed), chunkSize=1000, ahead=2)
+    self.assertEquals(self.mData[:7], reader.read(7))
+    self.assertEquals(self.mData[7:], readAll(reader))
+    self.assertEquals('', reader.read())
+
+  def test_concatenated_streams(self):
+    compressed = self.mCompressed + bz2.compress('trailer' * 1000)
+    reader = parallelbz2.BackgroundBZ2Reader(StringIO(compressed), chunkSize=1000)
+    self.assertEquals(self.mData + 'trailer' * 1000, readAll(reader))
+
+  def test_corrupt_data(self):
+    reader = parallelbz2.BackgroundBZ2Reader(StringIO('BZh9' + 'x' * 1000))
+    self.assertRaises(IOError, reader.read)
+    reader.close()
+
+  def test_close_before_the_end(self):
+    reader = parallelbz2.BackgroundBZ2Reader(StringIO(self.mCompressed), chunkSize=1000, ahead=2)
+    reader.read(10)
+    reader.close()
+    self.assertFalse(reader.thread.is_alive())
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,164 @@
+import os
+import sys
+sys.path.insert(0,os.path.abspath(__file__+"/../.."))
+import datetime
+import shutil
+import tempfile
+import threading
+import unittest
+from transgression import buildstore
+from transgression import prefetch
+from transgression import runnightly
+
+# Downloads by writing the date into the archive. Downloads of the dates in
+# mBlocked wait for mProceed halfway through.
+class FakeApp(object):
+  def __init__(self, aDir):
+    self.mDir = aDir
+    self.installDir = os.path.join(aDir, 'moznightlyapp')
+    self.mCached = set()
+    self.mMissing = set()
+    self.mBlocked = set()
+    self.mStarted = threading.Event()
+    self.mProceed = threading.Event()
+
+  def getCached(self, aDate):
+    path = os.path.join(self.mDir, 'cached-%s.tar.bz2' % aDate)
+    if aDate in self.mCached:
+      open(path, 'w').write(str(aDate))
+      return path
+    return None
+
+  def isCached(self, aPath):
+    return os.path.basename(aPath).startswith('cached-')
+
+  def getCacheKey(self, aDate):
+    return 'fakeapp/%s' % aDate
+
+  def getBuildUrl(self, aDate):
+    if aDate in self.mMissing:
+      return False
+    return 'http://example.com/%s/fakeapp.tar.bz2' % aDate
+
+  def downloadBuild(self, aUrl, aDate, aDest, progress=None):
+    # like download.download, what was received is kept in <dest>.part, and
+    # how to resume it in <dest>.part.json
+    open(aDest + '.part', 'w').write(str(aDate))
+    open(aDest + '.part.json', 'w').write('{}')
+    if aDate in self.mBlocked:
+      progress(1, 2)
+      self.mStarted.set()
+      self.mProceed.wait(10)
+    progress(2, 2)
+    os.rename(aDest + '.part', aDest)
+    os.remove(aDest + '.part.json')
+    return os.path.abspath(aDest)
+
+  def extract(self, aSrc, aDest):
+    os.makedirs(aDest)
+    shutil.copy(aSrc, os.path.join(aDest, 'fakeapp'))
+    return aDest
+
+class PrefetcherTest(unittest.TestCase):
+  def setUp(self):
+    self.mTempDir = tempfile.mkdtemp()
+    self.mApp = FakeApp(self.mTempDir)
+    self.mDate = datetime.date(2012, 1, 4)
+    # prefetches are downloaded to the working directory
+    self.mCwd = os.getcwd()
+    os.chdir(self.mTempDir)
+
+  def tearDown(self):
+    self.mApp.mProceed.set()
+    os.chdir(self.mCwd)
+    shutil.rmtree(self.mTempDir)
+
+  def prefetched(self, aPrefetcher, aDate):
+    aPrefetcher._builds[aDate].done.wait(10)
+    return aPrefetcher._builds[aDate]
+
+  def test_claim(self):
+    prefetcher = prefetch.Prefetcher(self.mApp, extract=True)
+    prefetcher.prefetch(self.mDate)
+    build = prefetcher.claim(self.mDate)
+    self.assertEquals('ready', build.state)
+    self.assertEquals('2012-01-04', open(build.dest).read())
+    self.assertEquals('2012-01-04', open(os.path.join(build.extracted, 'fakeapp')).read())
+    self.assertEquals(self.mApp.installDir + '-2012-01-04', build.extracted)
+    # it is the caller's now
+    self.assertEquals("", prefetcher.status())
+    self.assertEquals(None, prefetcher.claim(self.mDate))
+    self.assertTrue(os.path.exists(build.dest))
+
+  def test_claim_missing_build(self):
+    self.mApp.mMissing.add(self.mDate)
+    prefetcher = prefetch.Prefetcher(self.mApp)
+    prefetcher.prefetch(self.mDate)
+    self.assertEquals('2012-01-04: missing', str(self.prefetched(prefetcher, self.mDate)))
+    self.assertEquals(None, prefetcher.claim(self.mDate))
+    self.assertEquals(None, prefetcher.claim(datetime.date(2012, 1, 5)))
+
+  def test_status(self):
+    self.mApp.mBlocked.add(self.mDate)
+    self.mApp.mMissing.add(datetime.date(2012, 1, 5))
+    prefetcher = prefetch.Prefetcher(self.mApp)
+    prefetcher.prefetch(self.mDate)
+    self.assertTrue(self.mApp.mStarted.wait(10))
+    prefetcher.prefetch(datetime.date(2012, 1, 5))
+    self.prefetched(prefetcher, datetime.date(2012, 1, 5))
+    self.assertEquals("2012-01-04: downloading 50%, 2012-01-05: missing", prefetcher.status())
+    self.mApp.mProceed.set()
+    self.prefetched(prefetcher, self.mDate)
+    self.assertEquals("2012-01-04: ready, 2012-01-05: missing", prefetcher.status())
+
+  def test_cancel_during_download(self):
+    self.mApp.mBlocked.add(self.mDate)
+    prefetcher = prefetch.Prefetcher(self.mApp, extract=True)
+    prefetcher.prefetch(self.mDate)
+    self.assertTrue(self.mApp.mStarted.wait(10))
+    build = prefetcher._builds[self.mDate]
+    prefetcher.cancel(self.mDate)
+    self.assertEquals("", prefetcher.status())
+    self.mApp.mProceed.set()
+    self.assertTrue(build.done.wait(10))
+    self.assertEquals('cancelled', build.state)
+    self.assertEquals(None, build.extracted)
+    # nothing was extracted, and the partial download is gone
+    self.assertEquals([], os.listdir(self.mTempDir))
+    self.assertEquals(None, prefetcher.claim(self.mDate))
+
+  def test_cancel_discards_downloads_but_not_cached_archives(self):
+    cachedDate = datetime.date(2012, 1, 5)
+    self.mApp.mCached.add(cachedDate)
+    prefetcher = prefetch.Prefetcher(self.mApp, extract=True)
+    for date in (self.mDate, cachedDate):
+      prefetcher.prefetch(date)
+      self.assertEquals('ready', self.prefetched(prefetcher, date).state)
+    self.assertEquals(['cached-2012-01-05.tar.bz2', 'moznightlyapp-2012-01-04',
+                       'moznightlyapp-2012-01-05', 'prefetch-2012-01-04-fakeapp.tar.bz2'],
+                      sorted(os.listdir(self.mTempDir)))
+    prefetcher.cleanup()
+    self.assertEquals(['cached-2012-01-05.tar.bz2'], os.listdir(self.mTempDir))
+    self.assertEquals("", prefetcher.status())
+
+  def test_stored_build_drops_its_prefetch(self):
+    store = buildstore.BuildStore(os.path.join(self.mTempDir, 'store'))
+    build = os.path.join(self.mTempDir, 'build')
+    os.makedirs(build)
+    open(os.path.join(build, 'fakeapp'), 'w').write('stored')
+    store.add(self.mApp.getCacheKey(self.mDate), build)
+    shutil.rmtree(build)
+
+    runner = runnightly.NightlyRunner(appname='firefox', store=store)
+    runner.app = self.mApp
+    runner.store = store
+    runner.prefetcher = prefetch.Prefetcher(self.mApp, extract=True)
+    runner.prefetch(self.mDate)
+    self.prefetched(runner.prefetcher, self.mDate)
+    self.assertTrue(runner.install(self.mDate))
+    self.assertEquals('stored', open(os.path.join(self.mApp.installDir, 'fakeapp')).read())
+    self.assertEquals("", runner.prefetchStatus())
+    self.assertEquals(['moznightlyapp', 'store'], sorted(os.listdir(self.mTempDir)))
+
+if __name__ == '__main__':
+  unittest.main()
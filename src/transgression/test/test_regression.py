@@ -0,0 +1,142 @@
+import os
+import sys
+sys.path.insert(0,os.path.abspath(__file__+"/../.."))
+import datetime
+import shutil
+import tempfile
+import unittest
+from transgression import bisection
+from transgression import regression
+
+# Stands in for NightlyRunner: a nightly every other day, none on the 9th.
+class FakeRunner(object):
+  def __init__(self, aStarted=None):
+    if aStarted is None:
+      aStarted = []
+    self.mStarted = aStarted
+    self.mInstallDir = 'moznightlyapp'
+    self.mCrashAfter = None
+
+  def getBuildDates(self, aStart, aEnd):
+    day = aStart + datetime.timedelta(days=2)
+    dates = []
+    while day < aEnd:
+      dates.append(day)
+      day += datetime.timedelta(days=2)
+    return dates
+
+  def start(self, aDate):
+    if aDate == datetime.date(2012, 1, 9):
+      return False
+    if len(self.mStarted) == self.mCrashAfter:
+      raise KeyboardInterrupt()
+    self.mStarted.append(aDate)
+    return True
+
+  def stop(self):
+    pass
+
+  def prefetch(self, aDate):
+    pass
+
+  def cancelPrefetch(self, aDate):
+    pass
+
+  def getAppInfo(self):
+    return ('http://hg.mozilla.org/mozilla-central', 'abc')
+
+  def probeAppInfos(self, aDates):
+    return dict([(date, ('http://hg.mozilla.org/mozilla-central', 'rev%d' % date.day))
+                 for date in aDates if date != datetime.date(2012, 1, 9)])
+
+  def getBinary(self):
+    return '/nonexistent/%s/firefox' % self.mInstallDir
+
+  def spawn(self, aInstallDir):
+    runner = FakeRunner(self.mStarted)
+    runner.mInstallDir = aInstallDir
+    return runner
+
+  def cleanup(self):
+    pass
+
+class BisectorTest(unittest.TestCase):
+  def createBisector(self, aScript, aTimeout=None, aJobs=1):
+    command = '"%s" -c "%s"' % (sys.executable, aScript)
+    return regression.Bisector(FakeRunner(), testCommand=command, testTimeout=aTimeout,
+                               jobs=aJobs)
+
+  def test_test_command(self):
+    # the regression is in the nightly of the 15th
+    bisector = self.createBisector("import os, sys; sys.exit(os.environ['TRANSGRESSION_DATE'] >= '2012-01-15')")
+    result = bisector.bisect(datetime.date(2012, 1, 1), datetime.date(2012, 1, 31))
+    self.assertEquals((datetime.date(2012, 1, 13), datetime.date(2012, 1, 15)), result)
+    self.assertTrue(len(bisector.runner.mStarted) <= 4)
+
+  def test_skip_exit_code(self):
+    bisector = self.createBisector("import sys; sys.exit(%d)" % regression.SKIP_EXIT_CODE)
+    result = bisector.bisect(datetime.date(2012, 1, 1), datetime.date(2012, 1, 9))
+    self.assertEquals((datetime.date(2012, 1, 1), datetime.date(2012, 1, 9)), result)
+    self.assertEquals([datetime.date(2012, 1, 5), datetime.date(2012, 1, 7),
+                       datetime.date(2012, 1, 3)], bisector.runner.mStarted)
+
+  def test_parallel_bisection(self):
+    bisector = self.createBisector("import os, sys; sys.exit(os.environ['TRANSGRESSION_DATE'] >= '2012-01-15')",
+                                   aJobs=3)
+    result = bisector.bisect(datetime.date(2012, 1, 1), datetime.date(2012, 1, 31))
+    self.assertEquals((datetime.date(2012, 1, 13), datetime.date(2012, 1, 15)), result)
+    # two rounds: the 7th, 15th and 23rd, then the 9th (missing), 11th and 13th
+    self.assertEquals(set([datetime.date(2012, 1, day) for day in (7, 15, 23, 11, 13)]),
+                      set(bisector.runner.mStarted))
+
+  def test_changesets(self):
+    command = '"%s" -c "%s"' % (sys.executable, "import os, sys; sys.exit(os.environ['TRANSGRESSION_DATE'] >= '2012-01-15')")
+    bisector = regression.Bisector(FakeRunner(), testCommand=command, changesets=True)
+    bisector.bisect(datetime.date(2012, 1, 1), datetime.date(2012, 1, 31))
+    # the changesets come from the metadata of the ends of the range
+    self.assertEquals('http://hg.mozilla.org/mozilla-central/pushloghtml?fromchange=rev13&tochange=rev15',
+                      bisector.getPushlogUrl(datetime.date(2012, 1, 13), datetime.date(2012, 1, 15)))
+
+  def test_changesets_without_repository(self):
+    # as for the builds of a binaryRepository
+    bisector = regression.Bisector(FakeRunner())
+    bisector.goodAppInfo = (None, '0abc013')
+    bisector.badAppInfo = (None, '0abc015')
+    self.assertEquals(None, bisector.getPushlogUrl(datetime.date(2012, 1, 13), datetime.date(2012, 1, 15)))
+    self.assertEquals('0abc013 to 0abc015',
+                      bisector.getChangesetRange(datetime.date(2012, 1, 13), datetime.date(2012, 1, 15)))
+    bisector.goodAppInfo = ''
+    self.assertEquals(None, bisector.getPushlogUrl(datetime.date(2012, 1, 13), datetime.date(2012, 1, 15)))
+    self.assertEquals('2012-01-13 to 0abc015',
+                      bisector.getChangesetRange(datetime.date(2012, 1, 13), datetime.date(2012, 1, 15)))
+
+  def test_default_jobs(self):
+    self.assertTrue(regression.default_jobs() >= 1)
+
+  def test_hung_test_is_skipped(self):
+    bisector = self.createBisector("import time; time.sleep(30)", aTimeout=0.5)
+    self.assertEquals('skip', bisector.runTestCommand(datetime.date(2012, 1, 3)))
+
+  def test_resume(self):
+    tempDir = tempfile.mkdtemp()
+    try:
+      path = os.path.join(tempDir, 'session.json')
+      script = "import os, sys; sys.exit(os.environ['TRANSGRESSION_DATE'] >= '2012-01-15')"
+      bisector = self.createBisector(script)
+      bisector.session = bisection.BisectionSession(path, 'firefox')
+      bisector.runner.mCrashAfter = 2
+      self.assertRaises(KeyboardInterrupt, bisector.bisect,
+                        datetime.date(2012, 1, 1), datetime.date(2012, 1, 31))
+      tested = bisector.runner.mStarted
+
+      bisector = self.createBisector(script)
+      bisector.session = bisection.BisectionSession.load(path)
+      self.assertEquals((datetime.date(2012, 1, 13), datetime.date(2012, 1, 15)), bisector.resume())
+      # nothing that was tested before the crash is tested again
+      self.assertEquals([], [date for date in bisector.runner.mStarted if date in tested])
+      self.assertEquals(('http://hg.mozilla.org/mozilla-central', 'abc'), bisector.goodAppInfo)
+    finally:
+      shutil.rmtree(tempDir)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,148 @@
+import os
+import sys
+sys.path.insert(0,os.path.abspath(__file__+"/../.."))
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+import paramiko
+from transgression import sftp
+
+gHostKey = None
+
+def getHostKey():
+  global gHostKey
+  if gHostKey is None:
+    gHostKey = paramiko.RSAKey.generate(1024)
+  return gHostKey
+
+# Lets in user "tester" with password "secret", for SFTP only.
+class StubServer(paramiko.ServerInterface):
+  def check_auth_password(self, aUsername, aPassword):
+    if (aUsername, aPassword) == ('tester', 'secret'):
+      return paramiko.AUTH_SUCCESSFUL
+    return paramiko.AUTH_FAILED
+
+  def get_allowed_auths(self, aUsername):
+    return 'password'
+
+  def check_channel_request(self, aKind, aChanId):
+    if aKind == 'session':
+      return paramiko.OPEN_SUCCEEDED
+    return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+class StubHandle(paramiko.SFTPHandle):
+  def stat(self):
+    return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+
+# Serves the directory aRoot, read-only, counting the SFTP sessions opened.
+class StubSFTPServer(paramiko.SFTPServerInterface):
+  def __init__(self, aServer, aRoot, aSessions):
+    paramiko.SFTPServerInterface.__init__(self, aServer)
+    self.mRoot = aRoot
+    aSessions.append(self)
+
+  def realPath(self, aPath):
+    return os.path.join(self.mRoot, self.canonicalize(aPath).lstrip('/'))
+
+  def list_folder(self, aPath):
+    path = self.realPath(aPath)
+    try:
+      return [paramiko.SFTPAttributes.from_stat(os.stat(os.path.join(path, name)), name)
+              for name in os.listdir(path)]
+    except OSError as e:
+      return paramiko.SFTPServer.convert_errno(e.errno)
+
+  def stat(self, aPath):
+    try:
+      return paramiko.SFTPAttributes.from_stat(os.stat(self.realPath(aPath)))
+    except OSError as e:
+      return paramiko.SFTPServer.convert_errno(e.errno)
+
+  lstat = stat
+
+  def open(self, aPath, aFlags, aAttr):
+    try:
+      fp = open(self.realPath(aPath), 'rb')
+    except IOError as e:
+      return paramiko.SFTPServer.convert_errno(e.errno)
+    handle = StubHandle(aFlags)
+    handle.readfile = fp
+    return handle
+
+class SFTPPoolTest(unittest.TestCase):
+  def setUp(self):
+    self.mRoot = tempfile.mkdtemp()
+    for day in ('2012-01-01', '2012-01-02', '2012-01-03'):
+      os.makedirs(os.path.join(self.mRoot, 'APKS', day))
+      fp = open(os.path.join(self.mRoot, 'APKS', day, 'app-debug.apk'), 'wb')
+      fp.write(day * 10)
+      fp.close()
+    self.mPayload = os.urandom(1024 * 1024)
+    fp = open(os.path.join(self.mRoot, 'APKS', 'big.apk'), 'wb')
+    fp.write(self.mPayload)
+    fp.close()
+
+    self.mConnections = 0
+    self.mSessions = []
+    self.mTransports = []
+    self.mSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    self.mSocket.bind(('127.0.0.1', 0))
+    self.mSocket.listen(5)
+    self.mThread = threading.Thread(target=self.serve)
+    self.mThread.daemon = True
+    self.mThread.start()
+    self.mPool = sftp.SFTPPool(username='tester', password='secret',
+                               port=self.mSocket.getsockname()[1])
+
+  def serve(self):
+    while True:
+      try:
+        (connection, address) = self.mSocket.accept()
+      except socket.error:
+        return
+      self.mConnections += 1
+      transport = paramiko.Transport(connection)
+      transport.add_server_key(getHostKey())
+      transport.set_subsystem_handler('sftp', paramiko.SFTPServer, StubSFTPServer,
+                                      self.mRoot, self.mSessions)
+      transport.start_server(server=StubServer())
+      self.mTransports.append(transport)
+
+  def tearDown(self):
+    self.mPool.close()
+    self.mSocket.close()
+    for transport in self.mTransports:
+      transport.close()
+    shutil.rmtree(self.mRoot)
+
+  def test_listdirs_share_one_connection(self):
+    paths = ['APKS/2012-01-0%d' % day for day in range(1, 8)]
+    listings = self.mPool.listdirs('127.0.0.1', paths)
+    self.assertEquals(dict([(path, ['app-debug.apk']) for path in paths[:3]]), listings)
+    self.assertEquals(['app-debug.apk'], self.mPool.listdir('127.0.0.1', 'APKS/2012-01-02'))
+    # one handshake, and no more sessions than the pool allows
+    self.assertEquals(1, self.mConnections)
+    self.assertTrue(1 <= len(self.mSessions) <= sftp.DEFAULT_CHANNELS)
+
+  def test_fetch(self):
+    dest = os.path.join(self.mRoot, 'fetched.apk')
+    progress = []
+    self.mPool.fetch('127.0.0.1', 'APKS/big.apk', dest,
+                     lambda aReceived, aLength: progress.append((aReceived, aLength)))
+    self.assertEquals(self.mPayload, open(dest, 'rb').read())
+    self.assertEquals((len(self.mPayload), len(self.mPayload)), progress[-1])
+    self.assertRaises(IOError, self.mPool.fetch, '127.0.0.1', 'APKS/missing.apk', dest + '2')
+    self.assertFalse(os.path.exists(dest + '2'))
+    self.assertEquals(1, self.mConnections)
+
+  def test_wrong_password(self):
+    pool = sftp.SFTPPool(username='tester', password='wrong', port=self.mSocket.getsockname()[1])
+    try:
+      self.assertRaises(paramiko.AuthenticationException, pool.connect, '127.0.0.1')
+    finally:
+      pool.close()
+
+if __name__ == '__main__':
+  unittest.main()
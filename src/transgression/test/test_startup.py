@@ -0,0 +1,57 @@
+import os
+import sys
+sys.path.insert(0,os.path.abspath(__file__+"/../.."))
+import json
+import subprocess
+import unittest
+from transgression import utils
+
+# Only needed once a nightly runs, an SFTP repository is used or the menu
+# is shown; starting the command line shouldn't import them.
+HEAVY_MODULES = ['paramiko', 'mozrunner', 'mozprofile', 'curses']
+
+# Imports |aModule| in a fresh interpreter, the way the command line entry
+# points do, and returns how long it took and which modules came with it.
+IMPORT_SCRIPT = """
+import json, sys, time
+start = time.time()
+__import__(sys.argv[1])
+json.dump({'seconds': time.time() - start, 'modules': sorted(sys.modules)}, sys.stdout)
+"""
+
+class StartupTest(unittest.TestCase):
+  def importModule(self, aModule):
+    root = os.path.abspath(__file__+"/../..")
+    env = dict(os.environ)
+    # the prettylogger next to us, as setup.sh installs it
+    env['PYTHONPATH'] = os.pathsep.join([root, os.path.join(root, '..', 'prettylogger'),
+                                         env.get('PYTHONPATH', '')])
+    process = subprocess.Popen([sys.executable, '-W', 'ignore', '-c', IMPORT_SCRIPT, aModule],
+                               env=env, stdout=subprocess.PIPE)
+    output = process.communicate()[0]
+    self.assertEquals(0, process.returncode)
+    return json.loads(output)
+
+  def assertLight(self, aModule):
+    result = self.importModule(aModule)
+    heavy = [name for name in HEAVY_MODULES if name in result['modules']]
+    self.assertEquals([], heavy, "importing %s took %.0f ms and pulled in %s"
+                      % (aModule, result['seconds'] * 1000, ", ".join(heavy)))
+
+  def test_regression_imports_lightly(self):
+    self.assertLight('transgression.regression')
+
+  def test_runnightly_imports_lightly(self):
+    self.assertLight('transgression.runnightly')
+
+  def test_core_imports_lightly(self):
+    self.assertLight('transgression.core')
+
+  def test_platform_is_cached(self):
+    first = utils.get_platform()
+    first['name'] = 'Plan 9'
+    self.assertNotEquals('Plan 9', utils.get_platform()['name'])
+    self.assertTrue(utils._platform is not None)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,149 @@
+import json
+import tarfile
+import zipfile
+from ConfigParser import ConfigParser, Error as ConfigParserError
+from StringIO import StringIO
+
+from download import HttpError, RangeFile, open_url
+
+ARCHIVE_EXTENSIONS = ('.tar.bz2', '.tar.gz', '.zip', '.dmg', '.apk')
+
+def parse_app_info(content):
+    """Return the (repo, changeset) of the application.ini text |content|, or
+       None if it doesn't name them."""
+    parser = ConfigParser()
+    try:
+        parser.readfp(StringIO(content))
+        return (parser.get('App', 'SourceRepository'), parser.get('App', 'SourceStamp'))
+    except ConfigParserError:
+        return None
+
+def _is_app_ini(name):
+    # firefox/application.ini, or at the root of an apk; not the one of an
+    # application bundled further down
+    parts = name.lstrip('./').split('/')
+    return parts[-1] == 'application.ini' and len(parts) <= 2
+
+def _tar_compression(name):
+    if name.endswith('.tar.bz2'):
+        return 'bz2'
+    if name.endswith('.tar.gz'):
+        return 'gz'
+    return None
+
+def _is_zip(name):
+    return name.endswith('.zip') or name.endswith('.apk')
+
+def read_tar_app_info(fileobj, compression):
+    """Return the (repo, changeset) of the build in the tar archive read from
+       |fileobj|, compressed with |compression| ("bz2" or "gz"). Nothing
+       after application.ini is read."""
+    try:
+        tar = tarfile.open(fileobj=fileobj, mode="r|" + compression)
+        try:
+            for member in tar:
+                if member.isfile() and _is_app_ini(member.name):
+                    return parse_app_info(tar.extractfile(member).read())
+        finally:
+            tar.close()
+    except (tarfile.TarError, IOError, EOFError):
+        pass
+    return None
+
+def read_zip_app_info(fileobj):
+    """Same for the zip archive |fileobj|, which must be seekable: only the
+       central directory and application.ini are read."""
+    try:
+        archive = zipfile.ZipFile(fileobj)
+        try:
+            for name in archive.namelist():
+                if _is_app_ini(name):
+                    return parse_app_info(archive.read(name))
+        finally:
+            archive.close()
+    except zipfile.BadZipfile:
+        pass
+    return None
+
+def read_app_info(path):
+    """Return the (repo, changeset) of the build in the archive at |path|, or
+       None if it isn't an archive application.ini can be read from (e.g. a
+       disk image)."""
+    compression = _tar_compression(path)
+    if compression:
+        fp = open(path, 'rb')
+        try:
+            return read_tar_app_info(fp, compression)
+        finally:
+            fp.close()
+    if _is_zip(path):
+        fp = open(path, 'rb')
+        try:
+            return read_zip_app_info(fp)
+        finally:
+            fp.close()
+    return None
+
+def fetch_app_info(url, session):
+    """Same for the archive at |url|, downloading as little of it as the
+       format allows: a tar is streamed up to application.ini and the rest of
+       the response dropped, a zip is read with range requests. Raises
+       DownloadError if the server can't serve the ranges a zip needs."""
+    compression = _tar_compression(url)
+    if compression:
+        response = open_url(session, url)
+        try:
+            return read_tar_app_info(response, compression)
+        finally:
+            response.close()
+    if _is_zip(url):
+        fp = RangeFile(session, url)
+        try:
+            return read_zip_app_info(fp)
+        finally:
+            fp.close()
+    return None
+
+def parse_build_json(content):
+    """Return the (repo, changeset) of the build metadata |content| of a
+       nightly's .json file, or None."""
+    try:
+        metadata = json.loads(content)
+        return (metadata['moz_source_repo'], metadata['moz_source_stamp'])
+    except (ValueError, KeyError, TypeError):
+        return None
+
+def parse_build_txt(content):
+    """Same for a nightly's .txt file: the build id, then the url of the
+       changeset, "<repo>/rev/<changeset>"."""
+    lines = content.split()
+    if len(lines) < 2 or '/rev/' not in lines[1]:
+        # older nightlies only give the changeset, not where it is from
+        return None
+    (repo, changeset) = lines[1].rsplit('/rev/', 1)
+    return (repo, changeset)
+
+def metadata_urls(url):
+    """The urls of the metadata files next to the archive at |url|, with the
+       parser of each."""
+    for extension in ARCHIVE_EXTENSIONS:
+        if url.endswith(extension):
+            base = url[:-len(extension)]
+            return [(base + '.json', parse_build_json), (base + '.txt', parse_build_txt)]
+    return []
+
+def fetch_build_metadata(url, session):
+    """Return the (repo, changeset) of the archive at |url| from the small
+       metadata files published next to it, or None if there are none."""
+    for (metadataUrl, parse) in metadata_urls(url):
+        try:
+            response = open_url(session, metadataUrl)
+        except HttpError:
+            continue
+        try:
+            info = parse(response.read())
+        finally:
+            response.close()
+        if info:
+            return info
+    return None
@@ -0,0 +1,214 @@
+import errno
+import os
+import urlparse
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+
+from download import CHUNK_SIZE, HttpError, copy_stream, download, open_download, open_url
+from httpsession import HttpSession
+from listing import parseLinks
+
+class Backend(object):
+    """Where builds are kept, as transgression needs it: directories to list,
+       files to size, read and download. Paths are relative to the backend's
+       root. Anything missing raises IOError."""
+
+    # whether stream() can stand in for fetch(), so archives can be
+    # extracted as they arrive
+    streaming = False
+
+    def listdir(self, path):
+        raise NotImplementedError
+
+    def listdirs(self, paths, threads=8):
+        """Return a dict of the listings of |paths|, fetched at once. Paths
+           that can't be listed are left out."""
+        def listOne(path):
+            try:
+                return self.listdir(path)
+            except IOError:
+                return None
+
+        if not paths:
+            return {}
+        pool = ThreadPool(min(threads, len(paths)))
+        try:
+            listings = pool.map(listOne, paths)
+        finally:
+            pool.close()
+        return dict([(path, listing) for (path, listing) in zip(paths, listings)
+                     if listing is not None])
+
+    def stat(self, path):
+        """Return the size of the file at |path|."""
+        raise NotImplementedError
+
+    def open(self, path):
+        """A context manager giving the file at |path| opened for reading."""
+        raise NotImplementedError
+
+    def stream(self, path, dest=None, progress=None):
+        """A context manager giving the file at |path| opened for reading,
+           saved to |dest| (if given) as it's read, as download.open_download
+           does. Only for backends that are |streaming|."""
+        raise NotImplementedError
+
+    def fetch(self, path, dest, progress=None, segments=1):
+        """Download |path| to |dest|, calling |progress| as
+           download.copy_stream does. Returns |dest|."""
+        tmp = '%s.%d.part' % (dest, os.getpid())
+        try:
+            with self.open(path) as fp:
+                out = open(tmp, 'wb')
+                try:
+                    copy_stream(fp, out, self.stat(path), progress, CHUNK_SIZE)
+                finally:
+                    out.close()
+            os.rename(tmp, dest)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        return dest
+
+    def close(self):
+        pass
+
+def _http_error(url, status):
+    if status == 404:
+        return IOError(errno.ENOENT, "No such file", url)
+    return IOError(errno.EIO, "HTTP error %d" % status, url)
+
+class HttpBackend(Backend):
+    """Builds on a web server with directory listings, under |base|.
+       Absolute urls are taken as they are, so this also serves
+       ftp.mozilla.org's nightlies."""
+
+    streaming = True
+
+    def __init__(self, base='', session=None, listings=None):
+        self.base = base
+        self.session = session or HttpSession()
+        self.listings = listings
+
+    def url(self, path):
+        return urlparse.urljoin(self.base, path)
+
+    def listdir(self, path):
+        url = self.url(path).rstrip('/') + '/'
+        if self.listings:
+            content = self.listings.fetch(url, None, self.session)
+        else:
+            resp, content = self.session.get(url)
+            if resp.status != 200:
+                content = None
+        if content is None:
+            raise IOError(errno.ENOENT, "No such directory", url)
+        # only what is in the directory, not links up or elsewhere
+        names = [href.rstrip('/') for href in parseLinks(content)]
+        return [name for name in names
+                if name and '/' not in name and name not in ('.', '..') and name[0] != '?']
+
+    def stat(self, path):
+        url = self.url(path)
+        response = self.session.request(url, "HEAD")
+        response.close()
+        if response.status >= 400:
+            raise _http_error(url, response.status)
+        length = response.getheader('content-length')
+        if length is None:
+            return None
+        return int(length)
+
+    @contextmanager
+    def open(self, path):
+        url = self.url(path)
+        try:
+            response = open_url(self.session, url)
+        except HttpError as e:
+            raise _http_error(url, e.status)
+        try:
+            yield response
+        finally:
+            response.close()
+
+    def stream(self, path, dest=None, progress=None):
+        return open_download(self.url(path), dest, progress=progress, session=self.session)
+
+    def fetch(self, path, dest, progress=None, segments=1):
+        # resumable, and over several connections if asked to
+        return download(self.url(path), dest, progress, segments=segments, session=self.session)
+
+    def close(self):
+        self.session.close()
+
+class SFTPBackend(Backend):
+    """Builds on |host| over SFTP, through one pooled SSH connection."""
+
+    def __init__(self, host, pool=None, username=None):
+        self.host = host
+        if pool is None:
+            # paramiko is only needed by those with SFTP repositories
+            from sftp import SFTPPool
+            pool = SFTPPool(username=username)
+        self.pool = pool
+
+    def listdir(self, path):
+        return self.pool.listdir(self.host, path)
+
+    def listdirs(self, paths, threads=8):
+        return self.pool.listdirs(self.host, paths)
+
+    def stat(self, path):
+        return self.pool.stat(self.host, path).st_size
+
+    def open(self, path):
+        return self.pool.open(self.host, path)
+
+    def fetch(self, path, dest, progress=None, segments=1):
+        return self.pool.fetch(self.host, path, dest, progress)
+
+    def close(self):
+        self.pool.close()
+
+class FileBackend(Backend):
+    """Builds in a local directory tree, e.g. to try a bisection on builds
+       made up for it without a network."""
+
+    def __init__(self, root='/'):
+        self.root = root
+
+    def _path(self, path):
+        return os.path.join(self.root, path)
+
+    def listdir(self, path):
+        try:
+            return os.listdir(self._path(path))
+        except OSError as e:
+            raise IOError(e.errno, e.strerror, path)
+
+    def stat(self, path):
+        try:
+            return os.path.getsize(self._path(path))
+        except OSError as e:
+            raise IOError(e.errno, e.strerror, path)
+
+    @contextmanager
+    def open(self, path):
+        fp = open(self._path(path), 'rb')
+        try:
+            yield fp
+        finally:
+            fp.close()
+
+def get_backend(protocol, host='', session=None, listings=None, username=None):
+    """Return the backend for a repository's |protocol| ("http", "https",
+       "sftp" or "file") on |host|; paths given to it are relative to the
+       root of |host| (or of the login directory for sftp)."""
+    if protocol in ('http', 'https'):
+        return HttpBackend('%s://%s/' % (protocol, host), session, listings)
+    if protocol == 'sftp':
+        return SFTPBackend(host, username=username)
+    if protocol == 'file':
+        # file://localhost/some/path and file:///some/path alike
+        return FileBackend('/')
+    raise ValueError("no backend for protocol %s" % protocol)
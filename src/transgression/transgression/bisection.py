@@ -0,0 +1,155 @@
+import errno
+import json
+import os
+
+from utils import get_date
+
+DEFAULT_SESSION_DIR = os.path.join(os.path.expanduser('~/.transgression'), 'sessions')
+
+class BuildRange(object):
+    """The ordered list of builds from the last known good one to the first
+       known bad one, and what has been learned about the builds in between.
+       Bisecting over the builds that exist, rather than over calendar days,
+       means no step is spent on a day without a nightly."""
+
+    def __init__(self, builds):
+        if len(builds) < 2:
+            raise ValueError("a range needs a good and a bad build")
+        self.builds = list(builds)
+        self.good = 0
+        self.bad = len(self.builds) - 1
+        self.skipped = set()
+
+    def goodBuild(self):
+        return self.builds[self.good]
+
+    def badBuild(self):
+        return self.builds[self.bad]
+
+    def remaining(self):
+        """The number of builds between good and bad that can still be
+           tested."""
+        return len([i for i in range(self.good + 1, self.bad) if i not in self.skipped])
+
+    def _closest(self, target, good, bad, excluded):
+        # the build closest to |target|, alternating to either side of it
+        # when builds there are excluded
+        for distance in range(0, bad - good):
+            for i in (target + distance, target - distance):
+                if good < i < bad and i not in excluded:
+                    return i
+        return None
+
+    def _nearest(self, good, bad, skipped):
+        return self._closest((good + bad) / 2, good, bad, skipped)
+
+    def next(self):
+        """Return the index of the build to test next, or None when good and
+           bad are adjacent, apart from skipped builds."""
+        return self._nearest(self.good, self.bad, self.skipped)
+
+    def nextIf(self, index, good):
+        """Return the build next() would pick after |index| got a good or bad
+           verdict, without recording it."""
+        if good:
+            return self._nearest(index, self.bad, self.skipped)
+        return self._nearest(self.good, index, self.skipped)
+
+    def split(self, count):
+        """Return up to |count| builds that cut the range into count + 1
+           roughly equal parts, for testing at the same time."""
+        indexes = []
+        chosen = set(self.skipped)
+        for part in range(1, count + 1):
+            cut = self.good + (self.bad - self.good) * part / (count + 1)
+            index = self._closest(cut, self.good, self.bad, chosen)
+            if index is None:
+                break
+            indexes.append(index)
+            chosen.add(index)
+        return sorted(indexes)
+
+    def record(self, verdicts):
+        """Narrow the range by the verdicts of builds tested together, a list
+           of (index, verdict) with verdicts 'good', 'bad' or 'skip'. If the
+           verdicts contradict each other, the oldest bad build wins."""
+        for (index, verdict) in sorted(verdicts):
+            if not self.good < index < self.bad:
+                continue
+            if verdict == 'good':
+                self.setGood(index)
+            elif verdict == 'bad':
+                self.setBad(index)
+            else:
+                self.skip(index)
+
+    def setGood(self, index):
+        self.good = index
+
+    def setBad(self, index):
+        self.bad = index
+
+    def skip(self, index):
+        self.skipped.add(index)
+
+class BisectionSession(object):
+    """A bisection in progress, kept in a JSON file that is rewritten after
+       every verdict, so an interrupted bisection can pick up exactly where it
+       stopped."""
+
+    def __init__(self, path, app=None, repo=None):
+        self.path = path
+        self.app = app
+        self.repo = repo
+        self.builds = None
+        self.goodAppInfo = ''
+        self.badAppInfo = ''
+
+    @staticmethod
+    def pathFor(name, directory=DEFAULT_SESSION_DIR):
+        """The file of the session called |name|, which may also be a path."""
+        if os.sep in name or name.endswith('.json'):
+            return name
+        return os.path.join(directory, name + '.json')
+
+    def save(self, builds, goodAppInfo, badAppInfo):
+        self.builds = builds
+        self.goodAppInfo = goodAppInfo
+        self.badAppInfo = badAppInfo
+        directory = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        state = {'app': self.app, 'repo': self.repo,
+                 'builds': [str(build) for build in builds.builds],
+                 'good': builds.good, 'bad': builds.bad,
+                 'skipped': sorted(builds.skipped),
+                 'goodAppInfo': goodAppInfo or None,
+                 'badAppInfo': badAppInfo or None}
+        # a crash must leave either the old state or the new one, so write
+        # it out in full under another name before renaming it into place
+        tmp = '%s.%d.tmp' % (self.path, os.getpid())
+        fp = open(tmp, 'w')
+        json.dump(state, fp)
+        fp.flush()
+        os.fsync(fp.fileno())
+        fp.close()
+        os.rename(tmp, self.path)
+
+    @classmethod
+    def load(cls, path):
+        state = json.load(open(path))
+        session = cls(path, state.get('app'), state.get('repo'))
+        builds = BuildRange([get_date(build) for build in state['builds']])
+        builds.good = state['good']
+        builds.bad = state['bad']
+        builds.skipped = set(state['skipped'])
+        session.builds = builds
+        if state.get('goodAppInfo'):
+            session.goodAppInfo = tuple(state['goodAppInfo'])
+        if state.get('badAppInfo'):
+            session.badAppInfo = tuple(state['badAppInfo'])
+        return session
@@ -0,0 +1,233 @@
+import datetime
+import errno
+import httplib
+import os
+import socket
+import sqlite3
+import sys
+import threading
+from multiprocessing.pool import ThreadPool
+from optparse import OptionParser
+
+from listing import dayDirRegex
+from utils import get_date
+
+DEFAULT_INDEX_PATH = os.path.join(os.path.expanduser('~/.transgression'), 'builds.sqlite')
+
+# Days are only recorded as crawled once no more builds can show up for them.
+SETTLE_DAYS = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS builds (
+    app TEXT NOT NULL,
+    repo TEXT NOT NULL,
+    platform TEXT NOT NULL,
+    date TEXT NOT NULL,
+    buildid TEXT NOT NULL,
+    url TEXT NOT NULL,
+    size INTEGER,
+    PRIMARY KEY (app, repo, platform, buildid)
+);
+CREATE INDEX IF NOT EXISTS builds_by_date ON builds (app, repo, platform, date);
+CREATE TABLE IF NOT EXISTS crawled_days (
+    app TEXT NOT NULL,
+    platform TEXT NOT NULL,
+    date TEXT NOT NULL,
+    PRIMARY KEY (app, platform, date)
+);
+CREATE TABLE IF NOT EXISTS app_info (
+    url TEXT PRIMARY KEY,
+    repo TEXT NOT NULL,
+    changeset TEXT NOT NULL
+);
+"""
+
+class BuildIndex(object):
+    """A local SQLite table of the nightlies that exist on the server, one row
+       per build, so finding a build doesn't take any listing requests."""
+
+    def __init__(self, path=DEFAULT_INDEX_PATH):
+        if not os.path.isdir(os.path.dirname(path)):
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        # prefetch threads look builds up too, so share the connection
+        # behind a lock
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.lock = threading.Lock()
+        with self.lock:
+            self.db.executescript(SCHEMA)
+
+    def add(self, builds):
+        """Record |builds|, a list of (app, repo, platform, date, buildid, url,
+           size) tuples."""
+        with self.lock:
+            with self.db:
+                self.db.executemany("INSERT OR REPLACE INTO builds VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                    [(app, repo, platform, str(date), buildid, url, size)
+                                     for (app, repo, platform, date, buildid, url, size) in builds])
+
+    def markCrawled(self, app, platform, dates):
+        with self.lock:
+            with self.db:
+                self.db.executemany("INSERT OR REPLACE INTO crawled_days VALUES (?, ?, ?)",
+                                    [(app, platform, str(date)) for date in dates])
+
+    def crawledDays(self, app, platform, start, end):
+        with self.lock:
+            rows = self.db.execute("SELECT date FROM crawled_days WHERE app = ? AND platform = ? "
+                                   "AND date BETWEEN ? AND ?",
+                                   (app, platform, str(start), str(end))).fetchall()
+        return set([get_date(row[0]) for row in rows])
+
+    def isCrawled(self, app, platform, date):
+        return date in self.crawledDays(app, platform, date, date)
+
+    def lookup(self, app, repo, platform, date):
+        """Return the url of the first nightly from |date|, or None."""
+        with self.lock:
+            row = self.db.execute("SELECT url FROM builds WHERE app = ? AND repo = ? "
+                                  "AND platform = ? AND date = ? ORDER BY buildid LIMIT 1",
+                                  (app, repo, platform, str(date))).fetchone()
+        if row:
+            return row[0]
+        return None
+
+    def builds(self, app, repo, platform, start, end):
+        """Return (date, buildid, url) of every nightly between |start| and
+           |end|, oldest first."""
+        with self.lock:
+            rows = self.db.execute("SELECT date, buildid, url FROM builds WHERE app = ? "
+                                   "AND repo = ? AND platform = ? AND date BETWEEN ? AND ? "
+                                   "ORDER BY buildid",
+                                   (app, repo, platform, str(start), str(end))).fetchall()
+        return [(get_date(date), buildid, url) for (date, buildid, url) in rows]
+
+    def appInfo(self, url):
+        """Return the (repo, changeset) recorded for the build at |url|, or
+           None."""
+        with self.lock:
+            row = self.db.execute("SELECT repo, changeset FROM app_info WHERE url = ?",
+                                  (url,)).fetchone()
+        if row:
+            return (row[0], row[1])
+        return None
+
+    def addAppInfo(self, url, repo, changeset):
+        with self.lock:
+            with self.db:
+                self.db.execute("INSERT OR REPLACE INTO app_info VALUES (?, ?, ?)",
+                                (url, repo, changeset))
+
+class Crawler(object):
+    """Fills a BuildIndex from the nightly tree of |app|'s server, fetching
+       the listings of a range of days on a pool of threads. Days the index
+       already has are skipped, so repeated crawls only add what is new."""
+
+    def __init__(self, app, index, threads=8):
+        self.app = app
+        self.index = index
+        self.threads = threads
+        self.platform = app.getPlatformKey()
+
+    def crawl(self, start, end):
+        """Index the nightlies from |start| to |end| (inclusive). Returns the
+           number of builds found."""
+        crawled = self.index.crawledDays(self.app.appName, self.platform, start, end)
+        dirs = []
+        # days are only marked crawled if every listing they are in was
+        # fetched
+        listedMonths = set()
+        month = datetime.date(start.year, start.month, 1)
+        while month <= end:
+            monthUrl = self.app.getMonthUrl(month)
+            links = self.app.getMonthLinks(month)
+            if links is not None:
+                listedMonths.add((month.year, month.month))
+            for href in links or ():
+                match = dayDirRegex.match(href)
+                if not match:
+                    continue
+                date = get_date(match.group(1))
+                if start <= date <= end and date not in crawled:
+                    buildid = (match.group(1) + match.group(2)).replace("-", "")
+                    dirs.append((monthUrl + href, date, buildid, match.group(3)))
+            month = (month + datetime.timedelta(days=31)).replace(day=1)
+
+        pool = ThreadPool(self.threads)
+        try:
+            results = pool.map(self._crawlDir, dirs)
+        finally:
+            pool.close()
+        builds = sum([dirBuilds for dirBuilds in results if dirBuilds is not None], [])
+        self.index.add(builds)
+        failed = set([date for ((dirUrl, date, buildid, repo), dirBuilds) in zip(dirs, results)
+                      if dirBuilds is None])
+
+        settled = datetime.date.today() - datetime.timedelta(days=SETTLE_DAYS)
+        days = []
+        day = start
+        while day <= min(end, settled):
+            if (day.year, day.month) in listedMonths and day not in failed:
+                days.append(day)
+            day += datetime.timedelta(days=1)
+        self.index.markCrawled(self.app.appName, self.platform, days)
+        return len(builds)
+
+    def _crawlDir(self, dayDir):
+        # returns None if the directory couldn't be listed
+        (dirUrl, date, buildid, repo) = dayDir
+        try:
+            links = self.app.getDirLinks(dirUrl, date)
+            if links is None:
+                return None
+            builds = []
+            for href in links:
+                if self.app.buildRegex.match(href):
+                    url = dirUrl + href
+                    builds.append((self.app.appName, repo, self.platform, date, buildid,
+                                   url, self._getSize(url)))
+            return builds
+        except (socket.error, httplib.HTTPException):
+            return None
+
+    def _getSize(self, url):
+        resp = self.app.session.request(url, "HEAD")
+        resp.close()
+        length = resp.getheader('content-length')
+        if resp.status != 200 or length is None:
+            return None
+        return int(length)
+
+def cli(args=sys.argv[1:]):
+    """transgression index command line entry point"""
+    from listing import ListingCache
+    from runnightly import NightlyRunner
+
+    parser = OptionParser(usage="%prog index [options]")
+    parser.add_option("-n", "--app", dest="app", help="application name",
+                      type="choice",
+                      metavar="[%s]" % "|".join(NightlyRunner.apps.keys()),
+                      choices=NightlyRunner.apps.keys(),
+                      default="firefox")
+    parser.add_option("-s", "--start", dest="start", help="first day to index",
+                      metavar="YYYY-MM-DD", default=None)
+    parser.add_option("-e", "--end", dest="end", help="last day to index, default is today",
+                      metavar="YYYY-MM-DD", default=str(datetime.date.today()))
+    parser.add_option("-j", "--threads", dest="threads", type="int",
+                      help="number of listings to fetch at once", default=8)
+    parser.add_option("--index", dest="index", help="path of the build index",
+                      metavar="PATH", default=DEFAULT_INDEX_PATH)
+    options, args = parser.parse_args(args)
+    if not options.start:
+        parser.error("--start is required")
+
+    index = BuildIndex(options.index)
+    app = NightlyRunner.apps[options.app](listings=ListingCache())
+    found = Crawler(app, index, options.threads).crawl(get_date(options.start), get_date(options.end))
+    print "Indexed %d nightlies" % found
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,250 @@
+import errno
+import hashlib
+import json
+import os
+import shutil
+import stat
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from cache import FileLock
+
+DEFAULT_STORE_DIR = os.path.join(os.path.expanduser('~/.transgression'), 'builds')
+DEFAULT_STORE_SIZE = 4 * 1024 * 1024 * 1024
+
+# ioctl that makes a file share the blocks of another (btrfs, xfs)
+FICLONE = 0x40049409
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+def _file_hash(path, chunkSize=1024 * 1024):
+    digest = hashlib.sha1()
+    fp = open(path, 'rb')
+    try:
+        while True:
+            chunk = fp.read(chunkSize)
+            if not chunk:
+                break
+            digest.update(chunk)
+    finally:
+        fp.close()
+    return digest.hexdigest()
+
+def _clone(src, dest):
+    """Make |dest| share the blocks of |src| where the file system can,
+       otherwise copy it."""
+    if fcntl:
+        srcFp = open(src, 'rb')
+        destFp = open(dest, 'wb')
+        try:
+            try:
+                fcntl.ioctl(destFp.fileno(), FICLONE, srcFp.fileno())
+                return
+            except IOError:
+                pass
+            shutil.copyfileobj(srcFp, destFp)
+            return
+        finally:
+            srcFp.close()
+            destFp.close()
+    shutil.copyfile(src, dest)
+
+def _link(src, dest):
+    try:
+        os.link(src, dest)
+    except (OSError, AttributeError) as e:
+        # EXDEV: another file system; EMLINK: too many links to the object;
+        # no os.link at all on Windows
+        if isinstance(e, OSError) and e.errno not in (errno.EXDEV, errno.EMLINK, errno.EPERM):
+            raise
+        _clone(src, dest)
+
+def _removeShared(function, path, excinfo):
+    # Windows won't remove read-only files; those are copies there, not
+    # links to the objects, so they can be made writable
+    if os.path.exists(path) and os.stat(path).st_nlink <= 1:
+        os.chmod(path, stat.S_IWRITE)
+        function(path)
+    else:
+        raise excinfo[0], excinfo[1], excinfo[2]
+
+def rmtree(path):
+    """Remove the tree at |path|, if there is one, such as a checked out
+       build. Unlike mozfile.rmtree it leaves the modes of the files alone:
+       they can be links to the objects every checkout shares. Only the
+       directories, which are the checkout's own, are made writable."""
+    if os.path.islink(path) or os.path.isfile(path):
+        os.remove(path)
+        return
+    if not os.path.isdir(path):
+        return
+    os.chmod(path, stat.S_IMODE(os.stat(path).st_mode) | stat.S_IRWXU)
+    for root, dirs, files in os.walk(path):
+        for name in dirs:
+            dirPath = os.path.join(root, name)
+            if not os.path.islink(dirPath):
+                os.chmod(dirPath, stat.S_IMODE(os.stat(dirPath).st_mode) | stat.S_IRWXU)
+    shutil.rmtree(path, onerror=_removeShared)
+
+class BuildStore(object):
+    """Extracted builds, kept so that going back to a build, or on to a
+       neighbouring one that shares most of its files, takes links rather
+       than decompression.
+
+       Every file is stored once per content and mode, under its SHA-1 in
+       objects/, and every build is a manifest in manifests/ of the paths that
+       point at them. Checking a build out hard links the objects into place
+       (or clones or copies them when the install directory is on another
+       file system). Objects are read-only, so a build writing to its own
+       files can't change what the other builds share. The objects are kept
+       under |maxBytes| by dropping the least recently used builds."""
+
+    def __init__(self, directory=DEFAULT_STORE_DIR, maxBytes=DEFAULT_STORE_SIZE):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.objects = os.path.join(directory, 'objects')
+        self.manifests = os.path.join(directory, 'manifests')
+        _makedirs(self.objects)
+        _makedirs(self.manifests)
+        self.lock = FileLock(os.path.join(directory, '.lock'))
+
+    def _manifestPath(self, key):
+        return os.path.join(self.manifests, hashlib.sha1(key).hexdigest() + '.json')
+
+    def _objectPath(self, name):
+        return os.path.join(self.objects, name[:2], name[2:])
+
+    def _loadManifest(self, path):
+        try:
+            return json.load(open(path))
+        except (IOError, ValueError):
+            return None
+
+    def has(self, key):
+        return os.path.exists(self._manifestPath(key))
+
+    def add(self, key, src):
+        """Store the extracted build in the directory |src| as |key|. Files of
+           |src| become links to the stored objects."""
+        entries = []
+        with self.lock:
+            for root, dirs, files in os.walk(src):
+                relRoot = os.path.relpath(root, src)
+                for name in sorted(dirs):
+                    path = os.path.join(root, name)
+                    relPath = os.path.normpath(os.path.join(relRoot, name))
+                    if os.path.islink(path):
+                        entries.append([relPath, 'link', os.readlink(path)])
+                    else:
+                        entries.append([relPath, 'dir', stat.S_IMODE(os.stat(path).st_mode)])
+                for name in sorted(files):
+                    path = os.path.join(root, name)
+                    relPath = os.path.normpath(os.path.join(relRoot, name))
+                    if os.path.islink(path):
+                        entries.append([relPath, 'link', os.readlink(path)])
+                        continue
+                    entries.append([relPath, 'file', self._addObject(path)])
+
+            manifestPath = self._manifestPath(key)
+            tmp = '%s.%d.tmp' % (manifestPath, os.getpid())
+            fp = open(tmp, 'w')
+            json.dump({'key': key, 'entries': entries}, fp)
+            fp.close()
+            os.rename(tmp, manifestPath)
+            self._evict(keep=manifestPath)
+
+    def _addObject(self, path):
+        # must be called with the store lock held
+        # the mode is part of the name: links share it
+        mode = stat.S_IMODE(os.stat(path).st_mode) & ~0222
+        name = '%s-%o' % (_file_hash(path), mode)
+        objectPath = self._objectPath(name)
+        if os.path.exists(objectPath):
+            # the same file is stored already, point |path| at it instead
+            tmp = '%s.%d.tmp' % (path, os.getpid())
+            _link(objectPath, tmp)
+            os.rename(tmp, path)
+        else:
+            _makedirs(os.path.dirname(objectPath))
+            os.chmod(path, mode)
+            tmp = '%s.%d.tmp' % (objectPath, os.getpid())
+            _link(path, tmp)
+            os.chmod(tmp, mode)
+            os.rename(tmp, objectPath)
+        return name
+
+    def checkout(self, key, dest):
+        """Recreate the build stored as |key| in the directory |dest|. Returns
+           False if the store doesn't have it."""
+        manifestPath = self._manifestPath(key)
+        with self.lock:
+            manifest = self._loadManifest(manifestPath)
+            if not manifest or manifest.get('key') != key:
+                return False
+            # most recently used builds are the last to be evicted
+            os.utime(manifestPath, None)
+            _makedirs(dest)
+            dirModes = []
+            for (relPath, kind, value) in manifest['entries']:
+                path = os.path.join(dest, relPath)
+                if kind == 'dir':
+                    _makedirs(path)
+                    dirModes.append((path, value))
+                elif kind == 'link':
+                    os.symlink(value, path)
+                else:
+                    _link(self._objectPath(value), path)
+            # modes last, a read-only directory couldn't be filled
+            for (path, mode) in reversed(dirModes):
+                os.chmod(path, mode)
+        return True
+
+    def size(self):
+        total = 0
+        for root, dirs, files in os.walk(self.objects):
+            for name in files:
+                total += os.path.getsize(os.path.join(root, name))
+        return total
+
+    def _evict(self, keep=None):
+        # must be called with the store lock held
+        manifests = []
+        for name in os.listdir(self.manifests):
+            if name.endswith('.json'):
+                path = os.path.join(self.manifests, name)
+                manifests.append((os.path.getmtime(path), path))
+        manifests.sort()
+
+        total = self.size()
+        while total > self.maxBytes and manifests:
+            (mtime, path) = manifests.pop(0)
+            if path == keep:
+                continue
+            os.remove(path)
+            total -= self._collect()
+
+    def _collect(self):
+        # remove the objects no manifest refers to anymore, returning the
+        # bytes freed
+        used = set()
+        for name in os.listdir(self.manifests):
+            manifest = self._loadManifest(os.path.join(self.manifests, name))
+            if manifest:
+                used.update([value for (relPath, kind, value) in manifest['entries']
+                             if kind == 'file'])
+        freed = 0
+        for root, dirs, files in os.walk(self.objects):
+            for name in files:
+                if os.path.basename(root) + name not in used:
+                    path = os.path.join(root, name)
+                    freed += os.path.getsize(path)
+                    os.remove(path)
+        return freed
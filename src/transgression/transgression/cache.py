@@ -0,0 +1,227 @@
+import errno
+import hashlib
+import os
+import shutil
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: entries can't be pinned, the cache-wide lock uses msvcrt
+    fcntl = None
+    import msvcrt
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~/.transgression'), 'cache')
+DEFAULT_CACHE_SIZE = 2 * 1024 * 1024 * 1024
+# Partial downloads nobody has resumed for this long are thrown away.
+PARTIAL_MAX_AGE = 7 * 24 * 60 * 60
+
+class FileLock(object):
+    """An exclusive lock on a file, shared between processes, and between
+       the threads of this one that use the same FileLock."""
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+        # the descriptor belongs to whichever thread holds the lock, so the
+        # others wait here before opening theirs
+        self.threadLock = threading.Lock()
+
+    def acquire(self):
+        self.threadLock.acquire()
+        try:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT)
+            try:
+                if fcntl:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                else:
+                    msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+            except:
+                os.close(fd)
+                raise
+        except:
+            self.threadLock.release()
+            raise
+        self.fd = fd
+
+    def release(self):
+        fd = self.fd
+        self.fd = None
+        try:
+            if fcntl:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+            os.close(fd)
+        finally:
+            self.threadLock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+class CachePin(object):
+    """Keeps a cache entry from being evicted (by this or any other process)
+       while it is in use."""
+
+    def __init__(self, path):
+        self.fd = os.open(path, os.O_RDONLY)
+        if fcntl:
+            fcntl.flock(self.fd, fcntl.LOCK_SH)
+
+    def release(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    __del__ = release
+
+class ArchiveCache(object):
+    """A directory of downloaded build archives, shared by every transgression
+       process on the machine and bounded to |maxBytes| by evicting the least
+       recently used archives.
+
+       Each entry is a directory named after its key that holds the archive
+       under its original file name, so installers can still tell the archive
+       type from the extension."""
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, maxBytes=DEFAULT_CACHE_SIZE):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError as e:
+                # somebody else may have created it in the meantime
+                if e.errno != errno.EEXIST:
+                    raise
+        self._lock = FileLock(os.path.join(self.directory, '.lock'))
+
+    @staticmethod
+    def buildKey(appName, repoName, platform, date):
+        return os.path.join(appName, repoName, platform, str(date))
+
+    @staticmethod
+    def urlKey(url):
+        return os.path.join('url', hashlib.sha1(url).hexdigest())
+
+    def _entryDir(self, key):
+        return os.path.join(self.directory, key)
+
+    def _entryFile(self, key):
+        entryDir = self._entryDir(key)
+        if not os.path.isdir(entryDir):
+            return None
+        for name in os.listdir(entryDir):
+            if not name.startswith('.'):
+                return os.path.join(entryDir, name)
+        return None
+
+    def get(self, key):
+        """Return the path of the archive stored under |key|, or None. A hit
+           marks the entry as the most recently used one."""
+        with self._lock:
+            path = self._entryFile(key)
+            if path:
+                os.utime(path, None)
+            return path
+
+    def _makeEntryDir(self, key):
+        entryDir = self._entryDir(key)
+        if not os.path.isdir(entryDir):
+            try:
+                os.makedirs(entryDir)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        return entryDir
+
+    def downloadLock(self, key, filename):
+        """A FileLock to hold from tempPath() until put() while downloading
+           |filename| for |key|, so that no two processes write to the same
+           temporary file. Whoever held it before may have added the archive
+           in the meantime, so look it up again once it is held."""
+        return FileLock(os.path.join(self._makeEntryDir(key), '.' + filename + '.lock'))
+
+    def tempPath(self, key, filename):
+        """A path on the cache's file system to download an archive to before
+           it is added with put(), with downloadLock() held. It is the same
+           for every process, so an interrupted download can be resumed by
+           the next one."""
+        return os.path.join(self._makeEntryDir(key), '.' + filename)
+
+    def put(self, key, src, filename=None):
+        """Move the archive at |src| into the cache under |key| and return its
+           new path. Older entries are evicted to stay within the budget."""
+        filename = filename or os.path.basename(src)
+        with self._lock:
+            entryDir = self._entryDir(key)
+            if not os.path.isdir(entryDir):
+                os.makedirs(entryDir)
+            dest = os.path.join(entryDir, filename)
+            shutil.move(src, dest)
+            os.utime(dest, None)
+            self._evict(keep=dest)
+        return dest
+
+    def contains(self, path):
+        return os.path.abspath(path).startswith(os.path.abspath(self.directory) + os.sep)
+
+    def pin(self, path):
+        return CachePin(path)
+
+    def size(self):
+        return sum([size for (mtime, size, path) in self._entries()])
+
+    def _entries(self, partial=False):
+        # with |partial|, list the leftovers of unfinished downloads instead;
+        # the lock files are neither
+        entries = []
+        for root, dirs, files in os.walk(self.directory):
+            for name in files:
+                if name.startswith('.') != partial or name.endswith('.lock'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _isPinned(self, path):
+        if not fcntl:
+            return False
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return False
+        except IOError:
+            return True
+        finally:
+            os.close(fd)
+
+    def _evict(self, keep=None):
+        # must be called with the cache lock held
+        for mtime, size, path in self._entries(partial=True):
+            if mtime < time.time() - PARTIAL_MAX_AGE and not self._isPinned(path):
+                os.remove(path)
+
+        entries = sorted(self._entries())
+        total = sum([size for (mtime, size, path) in entries])
+        for mtime, size, path in entries:
+            if total <= self.maxBytes:
+                break
+            if path == keep or self._isPinned(path):
+                continue
+            os.remove(path)
+            total -= size
+            try:
+                os.removedirs(os.path.dirname(path))
+            except OSError:
+                # the entry directory still holds another download in progress
+                pass
@@ -1,12 +1,22 @@
 import json
 import datetime
 import os
+from contextlib import contextmanager
+
+from backends import get_backend
+from location import LocationTemplate
+
+DEFAULT_CONFIG_PATH = os.path.join(os.path.expanduser('~/.transgression'), 'config.json')
 
 class BinaryRepositoryEncoder(json.JSONEncoder):
+  """Encodes each object as the dict its constructor (or config_decoder)
+     takes back. Subclasses handle the objects that contain it, so json
+     writes a whole configuration in one pass."""
 
-  @staticmethod
-  def encode(aObject):
-    return "{ 'protocol' : '" + aObject.mProtocol + "', 'location' : " + "'" + aObject.mLocationString + "'}"
+  def default(self, aObject):
+    if isinstance(aObject, BinaryRepository):
+      return {'protocol' : aObject.getProtocol(), 'location' : aObject.getLocationFormatString()}
+    return json.JSONEncoder.default(self, aObject)
 
 class BinaryRepository(object):
   def __init__(self, aBinaryRepositoryDict):
@@ -22,11 +32,19 @@ class BinaryRepository(object):
   def getLocationFormatString(self):
     return self.mLocationString
 
-class PlatformConfigurationEncoder(json.JSONEncoder):
-  @staticmethod
-  def encode(aObject):
-    encodedObject = "{ 'processName' : '" + aObject.getProcessName() + "', 'firstBinaryDate' : '" + aObject.getFirstBinaryDateString() + "', 'binaryRepository' : " + BinaryRepositoryEncoder.encode(aObject.getBinaryRepository()) + "}"
-    return encodedObject
+  def getLocationTemplate(self):
+    return LocationTemplate(self.mLocationString)
+
+  def getBackend(self, aSession=None):
+    return get_backend(self.mProtocol, self.getLocationTemplate().host, aSession)
+
+class PlatformConfigurationEncoder(BinaryRepositoryEncoder):
+  def default(self, aObject):
+    if isinstance(aObject, PlatformConfiguration):
+      return {'processName' : aObject.getProcessName(),
+              'firstBinaryDate' : aObject.getFirstBinaryDateString(),
+              'binaryRepository' : aObject.getBinaryRepository()}
+    return BinaryRepositoryEncoder.default(self, aObject)
 
 class PlatformConfiguration(json.JSONEncoder):
   def __init__(self, aProcessName, aFirstBinDateString, aBinaryRepo):
@@ -51,20 +69,11 @@ class PlatformConfiguration(json.JSONEncoder):
     firstBinaryDate = datetime.datetime.strptime(aDateString, "%Y-%m-%d")
     return firstBinaryDate
 
-class ApplicationConfigEncoder(json.JSONEncoder):
-  @staticmethod
-  def encode(aObject):
-    encodedObject = "{ '" + aObject.getAppName() + "': { 'platformConfigurations' : { ";
-    platConfigs = aObject.getPlatformConfigurations()
-    lastPCString = ""
-    for platConfigKey in platConfigs.keys():
-        if len(lastPCString) != 0:
-          encodedObject = encodedObject + ", "
-        lastPCString = PlatformConfigurationEncoder.encode(platConfigs[platConfigKey])
-        encodedObject = encodedObject + lastPCString
-
-    encodedObject = encodedObject + "}}}"
-    return encodedObject
+class ApplicationConfigEncoder(PlatformConfigurationEncoder):
+  def default(self, aObject):
+    if isinstance(aObject, ApplicationConfig):
+      return {'platformConfigurations' : aObject.getPlatformConfigurations()}
+    return PlatformConfigurationEncoder.default(self, aObject)
 
 class ApplicationConfig(object):
   def __init__(self, aAppName, aPlatformConfigurationDict=None):
@@ -88,34 +97,27 @@ class ApplicationConfig(object):
 
     return platConfigs
 
-class ConfigEncoder(json.JSONEncoder):
-  @staticmethod
-  def encode(aObject):
-    encodedString = "{ '__type__' : 'transgression-configuration', 'applications' : "
-    apps = aObject.getAllApplications()
-    appString = ""
-    for appKey in apps.keys():
-      if len(appString) != 0:
-        encodedString = encodedString + ", "
-
-      appString = ApplicationConfigEncoder.encode(apps[appKey])
-      encodedString = encodedString + appString
-
-    encodedString = encodedString + "}}"
-
-    return encodedString
+class ConfigEncoder(ApplicationConfigEncoder):
+  def default(self, aObject):
+    if isinstance(aObject, Config):
+      return {'__type__' : 'transgression-configuration',
+              'applications' : aObject.getAllApplications()}
+    return ApplicationConfigEncoder.default(self, aObject)
 
 class Config(object):
-  def __init__(self, aConfigurationDict):
+  def __init__(self, aConfigurationDict, aPath=DEFAULT_CONFIG_PATH):
     self.mApps = dict()
     for key in aConfigurationDict.keys():
       self.mApps[key] = ApplicationConfig(key, aConfigurationDict[key]['platformConfigurations'])
+    self.mPath = aPath
+    self.mBatchDepth = 0
+    self.mDirty = False
 
   def getApplication(self, aName):
     return self.mApps[aName]
 
   def hasApplication(self, aName):
-    return aName in self.mApps.keys()
+    return aName in self.mApps
 
   def getAllApplications(self):
     return self.mApps
@@ -123,20 +125,62 @@ class Config(object):
   def getNumApplications(self):
     return len(self.mApps)
 
+  def getPath(self):
+    return self.mPath
+
+  def setPath(self, aPath):
+    self.mPath = aPath
+
   def addApplication(self, aApplicationName, aPlatformConfigurationDict):
-    platConfigDict = dict()
-    platConfigDict['platformConfigurations'] = aPlatformConfigurationDict
-    self.mApps[aApplicationName] = ApplicationConfig(aApplicationName, platConfigDict['platformConfigurations'])
-    self.__writeConfigToFile()
-
-  def __writeConfigToFile(self):
-    jsonString = json.dumps(self, cls=config.ConfigEncoder, indent=2)
-    fp = open(os.path.join(os.path.expanduser('~/.transgression'), 'config.json'), "w")
-    fp.write(jsonString)
-    fp.close()
+    self.mApps[aApplicationName] = ApplicationConfig(aApplicationName, aPlatformConfigurationDict)
+    self.mDirty = True
+    if not self.mBatchDepth:
+      self.save()
+
+  @contextmanager
+  def batch(self):
+    """Write the file once, when the block ends, however many applications
+       are added in it."""
+    self.mBatchDepth += 1
+    try:
+      yield self
+    finally:
+      self.mBatchDepth -= 1
+    if not self.mBatchDepth and self.mDirty:
+      self.save()
+
+  def save(self):
+    """Write the configuration to its file, streamed through json in one
+       pass. It's written next to the file and renamed over it, so a
+       failed write leaves the old one."""
+    directory = os.path.dirname(self.mPath)
+    if directory and not os.path.isdir(directory):
+      os.makedirs(directory)
+    tmp = '%s.%d.tmp' % (self.mPath, os.getpid())
+    try:
+      fp = open(tmp, 'w')
+      try:
+        json.dump(self, fp, cls=ConfigEncoder, indent=2, sort_keys=True)
+      finally:
+        fp.close()
+      os.rename(tmp, self.mPath)
+    finally:
+      if os.path.exists(tmp):
+        os.remove(tmp)
+    self.mDirty = False
 
 def config_decoder(aObject):
   if '__type__' in aObject and aObject['__type__'] == 'transgression-configuration':
-        return Config(aObject['applications'])
+    return Config(aObject['applications'])
 
   return aObject
+
+def load_config(aPath=DEFAULT_CONFIG_PATH):
+  """Read the configuration at |aPath|; it's saved back there."""
+  fp = open(aPath, 'r')
+  try:
+    configObj = json.load(fp, object_hook=config_decoder)
+  finally:
+    fp.close()
+  configObj.setPath(aPath)
+  return configObj
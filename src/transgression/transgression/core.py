@@ -1,11 +1,10 @@
 import os.path
-import paramiko
+import sys
 from time import sleep
 import getpass
 from prettylogger.core import PrettyLogger
-from ui import showMenu
-import json
 import config
+import buildindex
 
 gLogger = None
 gBinTypeSelected = None
@@ -55,7 +54,7 @@ class SFTPRepository(BinaryRepository):
   _mHostname = ''
   _mUsername = ''
   _mPath = ''
-  __mPassword = None
+  _mPool = None
 
   def __init__(self, aHostname, aUsername, aPath):
     self._mType = 'sftp'
@@ -66,16 +65,45 @@ class SFTPRepository(BinaryRepository):
   def __str__(self):
     return "sftp://" + self._mUsername + "@" + self._mHostname + "/" + self._mPath
 
+  # Open the connection to the host, or return the one that is open already.
+  # The SSH agent and keys are tried first, then the user is asked for a
+  # password.
   def connect(self):
-    global gLogger
-    ssh = paramiko.SSHClient()
-    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-
+    # paramiko is slow to import, and only SFTP repositories need it
+    import paramiko
+    import sftp
+    if not self._mPool:
+      self._mPool = sftp.SFTPPool(username=self._mUsername)
     try:
-      ssh.connect(aHost, username=self._mUserName)
-    except Exception as e:
-      self.__mPassword = None
-      raise e
+      self._mPool.connect(self._mHostname)
+    except paramiko.AuthenticationException:
+      if self._mPool.password is not None:
+        self._mPool.password = None
+        raise
+      self._mPool.password = getpass.getpass("Password for " + str(self) + ": ")
+      self._mPool.connect(self._mHostname)
+    return self._mPool
+
+  def close(self):
+    if self._mPool:
+      self._mPool.close()
+      self._mPool = None
+
+  def __remotePath(self, aRelativePath):
+    return self._mPath.rstrip('/') + '/' + aRelativePath
+
+  def listDirectory(self, aRelativePath=''):
+    return self.connect().listdir(self._mHostname, self.__remotePath(aRelativePath))
+
+  # Listings of several directories at once, as a dict; directories that
+  # can't be listed are left out.
+  def listDirectories(self, aRelativePaths):
+    paths = dict([(self.__remotePath(path), path) for path in aRelativePaths])
+    listings = self.connect().listdirs(self._mHostname, paths.keys())
+    return dict([(paths[path], listing) for (path, listing) in listings.items()])
+
+  def fetch(self, aRelativePath, aDest, aProgress=None):
+    return self.connect().fetch(self._mHostname, self.__remotePath(aRelativePath), aDest, aProgress)
 
   def getType(self):
     return self._mType
@@ -136,18 +164,18 @@ def getListOfBinaries(aConfigurator):
   binariesList = []
 #try:
   binariesSection = aConfigurator.getSectionByPath('Binaries')
-  gLogger.debug("binaries section: " + str(binariesSection))
+  gLogger.debug("binaries section: %s", binariesSection)
   allBinSections = binariesSection.getSubSections()
   for binSection in allBinSections:
-    gLogger.debug("binSection: " + str(binSection))
+    gLogger.debug("binSection: %s", binSection)
     progName = binSection.getOption('binaryName').getValue()
     repoSection = binSection.getSubSection('Repository')
     repoType = repoSection.getOption('type')
-    gLogger.debug("repo type: " + str(repoType))
+    gLogger.debug("repo type: %s", repoType)
     if repoType.getValue() == 'sftp':
-      repoPath = repoSection.getOption('path')
-      repoUser = repoSection.getOption('user')
-      repoHost = repoSection.getOption('host')
+      repoPath = repoSection.getOption('path').getValue()
+      repoUser = repoSection.getOption('user').getValue()
+      repoHost = repoSection.getOption('host').getValue()
       newRepo = SFTPRepository(repoHost, repoUser, repoPath)
       binariesList.append(BinaryConfiguration(progName, newRepo))
 #except Exception as e:
@@ -159,12 +187,16 @@ def setupRegressionTest(aProgramConfig):
   print("About to regression test " + aProgramConfig.getName())
 
 def loadConfigFromJsonFile(aPath):
-  configString = open(aPath, 'r').read()
-  return json.loads(configString, object_hook=config.config_decoder)
+  return config.load_config(aPath)
 
 def main():
   global gLogger
 
+  # Subcommands
+  if len(sys.argv) > 1 and sys.argv[1] == 'index':
+    buildindex.cli(sys.argv[2:])
+    return
+
   DEBUG = True
   VERBOSE = False
 
@@ -188,6 +220,7 @@ def main():
       # TODO: We don't currently support the ability to add new binaries
       #       except via the config file.
       # allPrograms.append(('Create New Binary', None))
+      from ui import showMenu
       programChoice = showMenu(allPrograms)
       # if not programChoice:
       #   gLogger.debug("Program choice was None")
@@ -0,0 +1,486 @@
+import json
+import os
+import re
+import sys
+import threading
+from contextlib import contextmanager
+
+from httpsession import HttpSession
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Archives are copied from the network to disk through a buffer of this size,
+# so memory use doesn't depend on the size of the archive.
+CHUNK_SIZE = 64 * 1024
+
+class DownloadError(Exception):
+    pass
+
+class DownloadCancelled(DownloadError):
+    """Raised from a progress callback to abandon a download."""
+    pass
+
+class HttpError(DownloadError):
+    def __init__(self, url, status):
+        DownloadError.__init__(self, "%s: HTTP error %d" % (url, status))
+        self.status = status
+
+def open_url(session, url, headers=None):
+    """Request |url| through |session|, raising HttpError unless the server
+       answers with a success status."""
+    response = session.request(url, headers=headers)
+    if response.status >= 400:
+        response.close()
+        raise HttpError(url, response.status)
+    return response
+
+def get_content_length(response):
+    length = response.getheader('Content-Length')
+    if length is None:
+        return None
+    return int(length)
+
+def copy_stream(response, fp, length=None, progress=None, chunkSize=CHUNK_SIZE,
+                received=0):
+    """Copy the body of |response| to the file object |fp|, one chunk at a
+       time. |progress| is called as progress(received, length) after every
+       chunk. Returns the number of bytes received, counting from |received|."""
+    if progress:
+        progress(received, length)
+    while True:
+        chunk = response.read(chunkSize)
+        if not chunk:
+            break
+        fp.write(chunk)
+        received += len(chunk)
+        if progress:
+            progress(received, length)
+    return received
+
+class PartialDownload(object):
+    """Bookkeeping for a download that may get interrupted. The bytes received
+       so far are kept in <dest>.part, and what is needed to resume them with a
+       Range request is kept next to it in <dest>.part.json."""
+
+    def __init__(self, dest):
+        self.path = dest + '.part'
+        self.metaPath = self.path + '.json'
+        self.url = None
+        self.etag = None
+        self.lastModified = None
+        self.received = 0
+        self.length = None
+        # [start, end, received] of each range of a segmented download
+        self.segments = None
+
+    def load(self):
+        if not os.path.exists(self.metaPath):
+            return
+        try:
+            meta = json.load(open(self.metaPath))
+        except ValueError:
+            # a session died while writing it, we'll just start over
+            return
+        self.url = meta.get('url')
+        self.etag = meta.get('etag')
+        self.lastModified = meta.get('lastModified')
+        self.received = meta.get('received', 0)
+        self.length = meta.get('length')
+        self.segments = meta.get('segments')
+
+    def save(self):
+        tmp = self.metaPath + '.tmp'
+        fp = open(tmp, 'w')
+        json.dump({'url': self.url, 'etag': self.etag,
+                   'lastModified': self.lastModified,
+                   'received': self.received, 'length': self.length,
+                   'segments': self.segments}, fp)
+        fp.close()
+        os.rename(tmp, self.metaPath)
+
+    def validator(self):
+        # If-Range takes either; a strong ETag is the safer of the two
+        return self.etag or self.lastModified
+
+    def resumeHeaders(self, url, offset):
+        if not offset or self.url != url or not self.validator():
+            return {}
+        return {'Range': 'bytes=%d-' % offset, 'If-Range': self.validator()}
+
+    def finish(self, dest):
+        os.rename(self.path, dest)
+        if os.path.exists(self.metaPath):
+            os.remove(self.metaPath)
+
+def _try_lock(fd):
+    if not fcntl:
+        return True
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except IOError:
+        return False
+
+def _open_partial(dest):
+    partial = PartialDownload(dest)
+    fd = os.open(partial.path, os.O_RDWR | os.O_CREAT, 0644)
+    if not _try_lock(fd):
+        # another process is fetching the same file, don't write over it
+        os.close(fd)
+        partial = PartialDownload("%s.%d" % (dest, os.getpid()))
+        fd = os.open(partial.path, os.O_RDWR | os.O_CREAT, 0644)
+    partial.load()
+    return partial, os.fdopen(fd, 'r+b')
+
+contentRangeRegex = re.compile(r'bytes (\d+)-\d+/(\d+|\*)')
+
+def _resumed_range(response, offset):
+    """Return the total length announced by a 206 response that continues
+       at |offset|, or False if the response doesn't continue our data."""
+    if response.status != 206:
+        return False
+    match = contentRangeRegex.match(response.getheader('Content-Range') or '')
+    if not match or int(match.group(1)) != offset:
+        return False
+    if match.group(2) == '*':
+        return None
+    return int(match.group(2))
+
+def _open_resumed(session, url, partial, fp):
+    """Request |url|, asking only for what |fp| doesn't hold yet if the
+       server can tell us it hasn't changed. Returns the response, the offset
+       it continues |fp| at and the expected total length."""
+    offset = os.fstat(fp.fileno()).st_size
+    try:
+        response = open_url(session, url, partial.resumeHeaders(url, offset))
+    except HttpError as e:
+        if e.status != 416:
+            raise
+        # whatever we have doesn't fit the file anymore
+        offset = 0
+        response = open_url(session, url)
+
+    total = _resumed_range(response, offset)
+    if total is False:
+        offset = 0
+        total = get_content_length(response)
+        partial.etag = partial.lastModified = None
+    fp.seek(offset)
+    fp.truncate()
+
+    partial.url = url
+    partial.etag = response.getheader('ETag') or partial.etag
+    partial.lastModified = response.getheader('Last-Modified') or partial.lastModified
+    partial.length = total
+    partial.received = offset
+    partial.save()
+    return response, offset, total
+
+def _download_stream(session, url, partial, fp, progress, chunkSize):
+    """Fetch |url| over a single connection, continuing whatever is in |fp|.
+       Returns the bytes received and the expected total."""
+    response, offset, total = _open_resumed(session, url, partial, fp)
+    try:
+        return copy_stream(response, fp, total, progress, chunkSize, offset), total
+    finally:
+        response.close()
+        fp.flush()
+        partial.received = fp.tell()
+        partial.save()
+
+def _probe_ranges(session, url, partial):
+    """Ask for the first byte of |url| to learn whether the server supports
+       Range requests. Returns the total length, or None if it doesn't."""
+    headers = {'Range': 'bytes=0-0'}
+    if partial.segments and partial.url == url and partial.validator():
+        headers['If-Range'] = partial.validator()
+    response = open_url(session, url, headers)
+    try:
+        total = _resumed_range(response, 0)
+        resumed = 'If-Range' in headers
+        if not total and resumed:
+            # the file changed since the segments were planned
+            partial.segments = None
+            return _probe_ranges(session, url, partial)
+        if not total:
+            return None
+        partial.etag = response.getheader('ETag') or (resumed and partial.etag) or None
+        partial.lastModified = (response.getheader('Last-Modified') or
+                                (resumed and partial.lastModified) or None)
+        if not resumed or partial.length != total:
+            partial.segments = None
+        return total
+    finally:
+        response.close()
+
+def _plan_segments(total, count):
+    size = (total + count - 1) / count
+    return [[start, min(start + size, total) - 1, 0] for start in range(0, total, size)]
+
+def _download_segments(session, url, partial, fp, count, progress, chunkSize):
+    """Fetch |url| as |count| byte ranges over concurrent connections, each
+       written at its offset in the preallocated |fp|. Returns the bytes
+       received and the total, or None if the server doesn't support ranges."""
+    total = _probe_ranges(session, url, partial)
+    if total is None:
+        return None
+    if not partial.segments:
+        partial.segments = _plan_segments(total, count)
+        fp.truncate(total)
+    partial.url = url
+    partial.length = total
+    partial.save()
+
+    lock = threading.Lock()
+    errors = []
+    headers = {}
+    if partial.validator():
+        headers['If-Range'] = partial.validator()
+
+    def received():
+        return sum([segment[2] for segment in partial.segments])
+
+    def fetch(segment):
+        start, end, done = segment
+        segmentFp = open(partial.path, 'r+b')
+        try:
+            if start + done > end:
+                return
+            segmentHeaders = dict(headers)
+            segmentHeaders['Range'] = 'bytes=%d-%d' % (start + done, end)
+            response = open_url(session, url, segmentHeaders)
+            try:
+                if _resumed_range(response, start + done) != total:
+                    raise DownloadError("%s changed during the download" % url)
+                segmentFp.seek(start + done)
+
+                def segmentProgress(segmentReceived, length):
+                    if errors:
+                        # another segment failed, stop this one too
+                        raise DownloadCancelled()
+                    with lock:
+                        segment[2] = segmentReceived
+                        if progress:
+                            progress(received(), total)
+
+                copy_stream(response, segmentFp, None, segmentProgress, chunkSize, done)
+            finally:
+                response.close()
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            segmentFp.close()
+
+    threads = [threading.Thread(target=fetch, args=(segment,)) for segment in partial.segments]
+    try:
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            # join with a timeout, so Ctrl-C still gets through to us
+            while thread.is_alive():
+                thread.join(0.5)
+    except KeyboardInterrupt:
+        errors.append(DownloadCancelled())
+        for thread in threads:
+            thread.join()
+        raise
+    finally:
+        partial.received = received()
+        partial.save()
+
+    if errors:
+        # report what went wrong rather than the segments it cancelled
+        failures = [e for e in errors if not isinstance(e, DownloadCancelled)]
+        raise (failures or errors)[0]
+    return received(), total
+
+def download(url, dest, progress=None, chunkSize=CHUNK_SIZE, segments=1,
+             session=None):
+    """Stream |url| into the file |dest|. If an earlier attempt was
+       interrupted, the download resumes where it stopped, provided the server
+       confirms the file hasn't changed since. Raises DownloadError if the
+       server sends fewer or more bytes than it announced; what was received
+       is then kept for the next attempt.
+
+       With |segments| > 1 the file is fetched over that many connections at
+       once, if the server supports Range requests, within the per-host
+       connection limit of |session|."""
+    session = session or HttpSession()
+    partial, fp = _open_partial(dest)
+    try:
+        result = None
+        if segments > 1 or partial.segments:
+            result = _download_segments(session, url, partial, fp, max(segments, 1),
+                                        progress, chunkSize)
+        if result is None:
+            if partial.segments:
+                # the preallocated file is no use to a single stream
+                partial.segments = None
+                fp.truncate(0)
+            result = _download_stream(session, url, partial, fp, progress, chunkSize)
+        received, total = result
+    finally:
+        fp.close()
+
+    if total is not None and received != total:
+        raise DownloadError("%s: received %d bytes, expected %d" % (url, received, total))
+    partial.finish(dest)
+    return dest
+
+class TeeStream(object):
+    """A file-like view of a download, for consumers that process an archive
+       while it arrives. Everything read from the network is also written to
+       |fp|, if given. The first |offset| bytes come from |replay| (what an
+       earlier attempt already saved) rather than from the network."""
+
+    def __init__(self, response, fp=None, length=None, progress=None, offset=0,
+                 replay=None):
+        self.response = response
+        self.fp = fp
+        self.length = length
+        self.progress = progress
+        self.offset = offset
+        self.replay = replay
+        self.received = 0
+
+    def read(self, size=-1):
+        if size < 0:
+            size = self.length or sys.maxint
+        if self.received < self.offset:
+            chunk = self.replay.read(min(size, self.offset - self.received))
+        else:
+            chunk = self.response.read(size)
+            if self.fp:
+                self.fp.write(chunk)
+        self.received += len(chunk)
+        if self.progress and chunk:
+            self.progress(self.received, self.length)
+        return chunk
+
+    def drain(self, chunkSize=CHUNK_SIZE):
+        # archive readers may stop before the end of the file (e.g. at the
+        # padding after a tar's end marker), but the copy must be complete
+        while self.read(chunkSize):
+            pass
+
+    def check(self, url):
+        if self.length is not None and self.received != self.length:
+            raise DownloadError("%s: received %d bytes, expected %d" % (url, self.received, self.length))
+
+class RangeFile(object):
+    """A read-only, seekable file object of |url|, fetched with range
+       requests of at least |blockSize| bytes as it is read, for readers that
+       only need a few parts of a large archive (e.g. the directory at the end
+       of a zip and one member). Raises DownloadError if the server doesn't
+       support ranges."""
+
+    def __init__(self, session, url, blockSize=CHUNK_SIZE):
+        self.session = session
+        self.url = url
+        self.blockSize = blockSize
+        self.position = 0
+        self.blockStart = 0
+        self.block = ''
+        response = open_url(session, url, {'Range': 'bytes=0-0'})
+        try:
+            self.length = _resumed_range(response, 0)
+            response.read()
+        finally:
+            response.close()
+        if not self.length:
+            raise DownloadError("%s: the server doesn't support range requests" % url)
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.position
+        elif whence == 2:
+            offset += self.length
+        self.position = max(0, offset)
+
+    def tell(self):
+        return self.position
+
+    def read(self, size=-1):
+        if size < 0:
+            size = self.length - self.position
+        chunks = []
+        while size > 0 and self.position < self.length:
+            offset = self.position - self.blockStart
+            if not 0 <= offset < len(self.block):
+                self._fetch(size)
+                offset = self.position - self.blockStart
+            chunk = self.block[offset:offset + size]
+            chunks.append(chunk)
+            self.position += len(chunk)
+            size -= len(chunk)
+        return ''.join(chunks)
+
+    def _fetch(self, size):
+        # near the end, take the whole last block: whatever reads a trailer
+        # usually goes on to read what comes just before it
+        start = min(self.position, max(0, self.length - self.blockSize))
+        end = min(max(self.position + size, start + self.blockSize), self.length) - 1
+        response = open_url(self.session, self.url, {'Range': 'bytes=%d-%d' % (start, end)})
+        try:
+            if _resumed_range(response, start) is False:
+                raise DownloadError("%s: the server ignored a range request" % self.url)
+            block = response.read()
+        finally:
+            response.close()
+        if len(block) != end + 1 - start:
+            raise DownloadError("%s: received %d bytes, expected %d" % (self.url, len(block), end + 1 - start))
+        self.block = block
+        self.blockStart = start
+
+    def close(self):
+        self.block = ''
+
+@contextmanager
+def open_download(url, dest=None, chunkSize=CHUNK_SIZE, progress=None, session=None):
+    """Open |url| as a TeeStream. If |dest| is given the archive is also saved
+       there, resuming an interrupted earlier download the same way download()
+       does."""
+    session = session or HttpSession()
+    if dest is None:
+        response = open_url(session, url)
+        try:
+            stream = TeeStream(response, None, get_content_length(response), progress)
+            yield stream
+            stream.drain(chunkSize)
+        finally:
+            response.close()
+        stream.check(url)
+        return
+
+    partial, fp = _open_partial(dest)
+    try:
+        response, offset, total = _open_resumed(session, url, partial, fp)
+        replay = open(partial.path, 'rb')
+        try:
+            stream = TeeStream(response, fp, total, progress, offset, replay)
+            yield stream
+            stream.drain(chunkSize)
+        finally:
+            replay.close()
+            response.close()
+            fp.flush()
+            partial.received = fp.tell()
+            partial.save()
+    finally:
+        fp.close()
+    stream.check(url)
+    partial.finish(dest)
+
+def print_progress(received, length):
+    """A progress callback that keeps a percentage on the current line."""
+    if length:
+        sys.stdout.write("\r%3d%% of %d KB" % (received * 100 / length, length / 1024))
+        if received >= length:
+            sys.stdout.write("\n")
+    else:
+        sys.stdout.write("\r%d KB" % (received / 1024))
+    sys.stdout.flush()
@@ -0,0 +1,133 @@
+import httplib
+import socket
+import threading
+import urlparse
+
+DEFAULT_TIMEOUT = 60
+DEFAULT_MAX_PER_HOST = 8
+
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+class HttpResponse(object):
+    """The response to an HttpSession request. Its connection goes back to
+       the session's pool once the body has been read to the end; closing
+       the response before that drops the connection instead."""
+
+    def __init__(self, session, key, connection, response, url):
+        self._session = session
+        self._key = key
+        self._connection = connection
+        self._response = response
+        self.status = response.status
+        self.url = url
+
+    def getheader(self, name, default=None):
+        return self._response.getheader(name, default)
+
+    def read(self, size=None):
+        if self._connection is None:
+            return ''
+        if size is None:
+            data = self._response.read()
+        else:
+            data = self._response.read(size)
+        if self._response.isclosed():
+            self._release(not self._response.will_close)
+        return data
+
+    def close(self):
+        if self._connection is not None:
+            # whatever is left of the body is still on the wire, so this
+            # connection can't carry another request
+            self._release(False)
+
+    def _release(self, reuse):
+        connection = self._connection
+        self._connection = None
+        self._session._release(self._key, connection, reuse)
+
+class HttpSession(object):
+    """Keep-alive HTTP connections shared by everything that talks to the
+       build servers: listings, downloads and repository backends. At most
+       |maxPerHost| connections are open to a host at once; further requests
+       wait for one to be released."""
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, maxPerHost=DEFAULT_MAX_PER_HOST):
+        self.timeout = timeout
+        self.maxPerHost = maxPerHost
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._slots = {}
+
+    def _acquire(self, key):
+        with self._lock:
+            slots = self._slots.get(key)
+            if slots is None:
+                slots = self._slots[key] = threading.BoundedSemaphore(self.maxPerHost)
+        slots.acquire()
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+        (scheme, netloc) = key
+        if scheme == 'https':
+            return httplib.HTTPSConnection(netloc, timeout=self.timeout), False
+        return httplib.HTTPConnection(netloc, timeout=self.timeout), False
+
+    def _release(self, key, connection, reuse):
+        if reuse:
+            with self._lock:
+                self._idle.setdefault(key, []).append(connection)
+        else:
+            connection.close()
+        self._slots[key].release()
+
+    def request(self, url, method="GET", headers=None, redirects=5):
+        """Send a request and return an HttpResponse, following redirects.
+           Error statuses are returned, not raised."""
+        parts = urlparse.urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        while True:
+            connection, reused = self._acquire(key)
+            try:
+                connection.request(method, path, headers=headers or {})
+                response = connection.getresponse()
+                break
+            except (socket.error, httplib.HTTPException):
+                self._release(key, connection, False)
+                # the server may have closed an idle connection, which is
+                # only worth one more try on a fresh one
+                if not reused:
+                    raise
+
+        wrapped = HttpResponse(self, key, connection, response, url)
+        if response.length == 0:
+            # nothing to read, hand the connection back right away
+            wrapped.read()
+
+        if response.status in REDIRECT_STATUSES and redirects:
+            location = urlparse.urljoin(url, wrapped.getheader('location'))
+            wrapped.read()
+            if response.status == 303 or (response.status in (301, 302) and method != 'HEAD'):
+                method = 'GET'
+            return self.request(location, method, headers, redirects - 1)
+        return wrapped
+
+    def get(self, url, headers=None):
+        """Request |url| and read the whole body. Returns (response, body)."""
+        response = self.request(url, headers=headers)
+        try:
+            return response, response.read()
+        finally:
+            response.close()
+
+    def close(self):
+        with self._lock:
+            for connections in self._idle.values():
+                for connection in connections:
+                    connection.close()
+            self._idle = {}
@@ -0,0 +1,132 @@
+import datetime
+import errno
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+
+from httpsession import HttpSession
+
+DEFAULT_LISTING_CACHE_DIR = os.path.join(os.path.expanduser('~/.transgression'), 'listings')
+
+# The href of an <a> tag, whether its value is double, single or not quoted.
+hrefRegex = re.compile(r"""<a\s[^>]*?\bhref\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))""", re.I)
+
+# A per-day directory of nightlies in a month listing, e.g.
+# 2012-01-01-03-05-26-mozilla-central/ or, for the oldest ones, 2008-06-17-02-trunk/
+dayDirRegex = re.compile(r'^(\d{4}-\d{2}-\d{2})-([\d-]+)-([^/]+)/$')
+
+def iterLinks(content):
+    """Yield the target of every link in the HTML listing |content|, in a
+       single pass and without building a document tree."""
+    for match in hrefRegex.finditer(content):
+        href = match.group(1)
+        if href is None:
+            href = match.group(2)
+        if href is None:
+            href = match.group(3)
+        yield href.replace('&amp;', '&')
+
+def parseLinks(content):
+    # a tuple of plain strings is all that's kept of a listing
+    return tuple(iterLinks(content))
+
+# A month's listings only stop changing a while after it ends, in whatever
+# time zone the server keeps and with the last nightlies still uploading.
+SETTLE_MARGIN = 24 * 60 * 60
+
+def monthSettledSince(date):
+    """The time after which the listings of the month of |date| don't change
+       anymore, or None if that time hasn't come yet."""
+    nextMonth = (datetime.date(date.year, date.month, 1) + datetime.timedelta(days=31)).replace(day=1)
+    settled = time.mktime(nextMonth.timetuple()) + SETTLE_MARGIN
+    if settled > time.time():
+        return None
+    return settled
+
+class ListingCache(object):
+    """Keeps the directory listings of the nightly server on disk, along with
+       their ETag and Last-Modified headers, so later runs can skip or
+       revalidate the requests for them.
+
+       Listings the caller knows stopped changing at some time (e.g. of
+       months that are over) are served without any request once they were
+       fetched after that time; the others are revalidated with a
+       conditional GET."""
+
+    def __init__(self, directory=DEFAULT_LISTING_CACHE_DIR):
+        self.directory = directory
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        self.requests = 0
+
+    def _path(self, url):
+        return os.path.join(self.directory, hashlib.sha1(url).hexdigest() + '.json')
+
+    def _load(self, url):
+        try:
+            entry = json.load(open(self._path(url)))
+        except (IOError, ValueError):
+            return None
+        if entry.get('url') != url:
+            return None
+        return entry
+
+    def _save(self, entry):
+        path = self._path(entry['url'])
+        # write under a unique name and rename, so concurrent readers never
+        # see half a listing
+        # (one per thread, too)
+        (fd, tmp) = tempfile.mkstemp(suffix='.tmp', prefix=os.path.basename(path) + '.',
+                                     dir=self.directory)
+        try:
+            fp = os.fdopen(fd, 'w')
+            try:
+                json.dump(entry, fp)
+            finally:
+                fp.close()
+            os.rename(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def fetch(self, url, settledSince=None, session=None):
+        """Return the body of the listing at |url|, or None if the server
+           doesn't have it. |settledSince| is the time (in seconds since the
+           epoch) after which the listing can't change anymore, if it has
+           passed; a listing stored since then is served without a request.
+           Requests go through |session|, if given."""
+        entry = self._load(url)
+        if entry and settledSince is not None and entry.get('fetched', 0) >= settledSince:
+            return entry['content']
+
+        headers = {}
+        if entry and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry.get('lastModified'):
+            headers['If-Modified-Since'] = entry['lastModified']
+
+        self.requests += 1
+        fetched = time.time()
+        resp, content = (session or HttpSession()).get(url, headers)
+        if resp.status == 304 and entry:
+            if settledSince is not None:
+                # as it is now, it stays
+                entry['fetched'] = fetched
+                self._save(entry)
+            return entry['content']
+        if resp.status != 200:
+            return None
+
+        # listings are stored as text; latin-1 round-trips any byte
+        content = content.decode('latin-1')
+        self._save({'url': url, 'etag': resp.getheader('etag'),
+                    'lastModified': resp.getheader('last-modified'),
+                    'fetched': fetched, 'content': content})
+        return content
@@ -0,0 +1,197 @@
+import datetime
+import re
+
+# What each placeholder of a location template matches.
+PLACEHOLDERS = {
+    'year': r'\d{4}',
+    'month': r'\d{2}',
+    'day': r'\d{2}',
+    'time': r'\d[\d:.\-]*',
+    'commitid': r'[0-9a-fA-F]+',
+    'appname': r'[^/]+?',
+    'buildnumber': r'\d+',
+}
+
+placeholderRegex = re.compile(r'%(\w+)%')
+
+def split_location(location):
+    """Split "host/some/path" into the host and the path on it, which is
+       relative to the directory the login starts in, as scp's host:path."""
+    (host, _, path) = location.partition('/')
+    return host, path or '.'
+
+def _join(parent, name):
+    if parent in ('', '.'):
+        return name
+    return parent.rstrip('/') + '/' + name
+
+def _date(values):
+    try:
+        return datetime.date(int(values['year']), int(values['month']), int(values['day']))
+    except (KeyError, ValueError):
+        return None
+
+def _in_range(values, start, end):
+    # as much of the date as is known so far has to fit between the bounds
+    if 'year' not in values:
+        return True
+    known = (int(values['year']),)
+    if 'month' in values:
+        known += (int(values['month']),)
+        if 'day' in values:
+            if not _date(values):
+                return False
+            known += (int(values['day']),)
+    return (start.timetuple()[:len(known)] <= known <= end.timetuple()[:len(known)])
+
+class _Segment(object):
+    """One directory (or file) name of a template, compiled to a regular
+       expression with a group per placeholder."""
+
+    def __init__(self, text):
+        self.text = text
+        self.names = placeholderRegex.findall(text)
+        pattern = ''
+        seen = set()
+        pos = 0
+        for match in placeholderRegex.finditer(text):
+            name = match.group(1)
+            if name not in PLACEHOLDERS:
+                raise ValueError("unknown placeholder %%%s%% in %s" % (name, text))
+            pattern += re.escape(text[pos:match.start()])
+            if name in seen:
+                pattern += '(?P=%s)' % name
+            else:
+                pattern += '(?P<%s>%s)' % (name, PLACEHOLDERS[name])
+                seen.add(name)
+            pos = match.end()
+        self.regex = re.compile(pattern + re.escape(text[pos:]) + '$')
+
+    def expand(self, values):
+        """The name with |values| filled in, or None if it needs others."""
+        if [name for name in self.names if name not in values]:
+            return None
+        return placeholderRegex.sub(lambda match: values[match.group(1)], self.text)
+
+    def match(self, name, values):
+        """Return |values| with those |name| gives added, or None if it
+           doesn't match or contradicts them."""
+        match = self.regex.match(name)
+        if not match:
+            return None
+        found = match.groupdict()
+        for (key, value) in found.items():
+            if values.get(key, value) != value:
+                return None
+        merged = dict(values)
+        merged.update(found)
+        return merged
+
+class RemoteBuild(object):
+    """A build found under a location template, with what its path says
+       about it."""
+
+    def __init__(self, path, values):
+        self.path = path
+        self.values = values
+        self.date = _date(values)
+        self.time = values.get('time', '')
+        self.commitid = values.get('commitid')
+        self.buildnumber = None
+        if 'buildnumber' in values:
+            self.buildnumber = int(values['buildnumber'])
+
+    def key(self):
+        return (self.date or datetime.date.min, self.time, self.buildnumber, self.path)
+
+    def __repr__(self):
+        return "<RemoteBuild %s>" % self.path
+
+class RemoteBuildIndex(object):
+    """The builds found under a location template, oldest first: by date,
+       time of day and build number."""
+
+    def __init__(self, builds):
+        self.builds = sorted(builds, key=RemoteBuild.key)
+
+    def __len__(self):
+        return len(self.builds)
+
+    def __iter__(self):
+        return iter(self.builds)
+
+    def dates(self):
+        return sorted(set([build.date for build in self.builds if build.date]))
+
+    def between(self, start, end):
+        return [build for build in self.builds if build.date and start <= build.date <= end]
+
+    def lookup(self, date):
+        """Return the first build from |date|, or None."""
+        builds = self.between(date, date)
+        if builds:
+            return builds[0]
+        return None
+
+    def byCommit(self, commitid):
+        """Return the builds of the changeset starting with |commitid|."""
+        return [build for build in self.builds
+                if build.commitid and build.commitid.startswith(commitid)]
+
+class LocationTemplate(object):
+    """A compiled binaryRepository location such as
+       host/APKS/%year%-%month%-%day%/%time%/%commitid%/%appname%-%buildnumber%.apk,
+       split into the host and one matcher per level of the path below it."""
+
+    def __init__(self, location):
+        self.location = location
+        (self.host, self.path) = split_location(location)
+        self.root = ''
+        path = self.path
+        if path.startswith('/'):
+            self.root = '/'
+            path = path.lstrip('/')
+        self.segments = [_Segment(text) for text in path.split('/') if text]
+
+    def expand(self, values):
+        """The path with |values| filled in, or None if it needs others."""
+        path = self.root
+        for segment in self.segments:
+            name = segment.expand(values)
+            if name is None:
+                return None
+            path = _join(path, name)
+        return path
+
+    def walk(self, listdirs, start=None, end=None, values=None):
+        """Find the builds under the template. |listdirs| takes a list of
+           directories and returns a dict of their listings (e.g. the
+           listdirs of an SFTPPool, for self.host); each level of the tree is
+           listed with one call, so its directories can be listed at once.
+           Only what can still match is listed: directories that are fixed
+           (or fixed by |values|, e.g. {'appname': ...}) not at all, and with
+           |start| and |end| dates, no directory of a day outside them.
+           Returns a RemoteBuildIndex."""
+        start = start or datetime.date.min
+        end = end or datetime.date.max
+        frontier = [(self.root, dict(values or {}))]
+        for segment in self.segments:
+            found = []
+            toList = []
+            for (path, known) in frontier:
+                name = segment.expand(known)
+                # a missing directory shows when its contents are listed,
+                # the builds themselves have to be listed to be found
+                if name is None or segment is self.segments[-1]:
+                    toList.append((path, known))
+                else:
+                    found.append((_join(path, name), known))
+            if toList:
+                listings = listdirs(sorted(set([path or '.' for (path, known) in toList])))
+                for (path, known) in toList:
+                    for name in listings.get(path or '.', ()):
+                        matched = segment.match(name, known)
+                        if matched is not None and _in_range(matched, start, end):
+                            found.append((_join(path, name), matched))
+            frontier = found
+        return RemoteBuildIndex([RemoteBuild(path, known) for (path, known) in frontier])
@@ -39,14 +39,23 @@ from optparse import OptionParser
 import platform
 import subprocess
 import re
+import mmap
 import time
 import string
 import os
+import Queue
 import shutil
+import stat
+import struct
+import tarfile
+import threading
 import zipfile
+import zlib
 
 from mozfile import rmtree
 
+from parallelbz2 import BackgroundBZ2Reader, ParallelBZ2Reader, worth_parallel
+
 isDMG = re.compile(".*\.dmg")
 isTARBZ = re.compile(".*\.tar\.bz")
 isTARGZ = re.compile(".*\.tar\.gz")
@@ -208,30 +217,38 @@ class MozInstaller:
   def installTarBz(self):
     # Ensure our destination directory exists
     self.dest = self.normalizePath(self.dest)
-    self.unTar("-jxf")
+    self.unTar("bz2")
 
   def installTarGz(self):
     # Ensure our destination directory exists
     self.dest = self.normalizePath(self.dest)
-    self.unTar("-zxf")
+    self.unTar("gz")
 
-  def unTar(self, tarArgs):
-    args = "tar " + tarArgs + " " + self.src + " -C " + self.dest
-    proc = subprocess.Popen(args, shell=True)
-    proc.wait()
-    #TODO: throw stderr
+  def unTar(self, compression):
+    data = None
+    if compression == "bz2" and worth_parallel(os.path.getsize(self.src), BZ2_PROCESSES):
+      # bzip2 blocks can be decompressed independently, on every core. They
+      # are sliced out of the mapped archive, which isn't read into memory.
+      fp = open(self.src, 'rb')
+      try:
+        data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+      finally:
+        fp.close()
+      archive = ParallelBZ2Reader(data, BZ2_PROCESSES)
+      compression = ""
+    else:
+      archive = open(self.src, 'rb')
+    try:
+      extractTar(archive, self.dest, compression)
+    finally:
+      archive.close()
+      if data is not None:
+        data.close()
 
   def installZip(self):
     self.dest = self.normalizePath(self.dest)
-    #TODO: throw stderr
-    zipped = zipfile.ZipFile(self.src)
-    try:
-        zipped.extractall(self.dest)
-    except:
-        args = ["unzip", "-o", "-q", "-d", self.dest, self.src]
-        proc = subprocess.Popen(args)
-        proc.wait()
-        
+    extractZip(self.src, self.dest)
+
   def installExe(self):
     debug("running installEXE")
     args = self.src + " "
@@ -245,6 +262,338 @@ class MozInstaller:
     proc.wait()
     # TODO: throw stderr
 
+# Extracted files are written by this many threads, while the archive is
+# decompressed on the calling thread.
+WRITER_THREADS = 4
+# The most decompressed data that may be waiting for the writers. Larger files
+# are written by the calling thread.
+WRITER_BUFFER = 64 * 1024 * 1024
+# Processes decompressing the blocks of a .tar.bz2 at once, None for one per
+# core.
+BZ2_PROCESSES = None
+
+# Creates directories and writes files on a pool of threads, so the thread
+# decompressing an archive doesn't wait on the file system.
+class ParallelWriter:
+  def __init__(self, threads=WRITER_THREADS, bufferSize=WRITER_BUFFER):
+    self.bufferSize = bufferSize
+    self.queue = Queue.Queue()
+    self.condition = threading.Condition()
+    self.pending = 0
+    self.errors = []
+    self.dirs = set()
+    self.dirsLock = threading.Lock()
+    self.threads = [threading.Thread(target=self.work) for i in range(threads)]
+    for thread in self.threads:
+      thread.daemon = True
+      thread.start()
+
+  def makedirs(self, path):
+    with self.dirsLock:
+      if path in self.dirs:
+        return
+    try:
+      os.makedirs(path)
+    except OSError:
+      # another writer may have just created it
+      if not os.path.isdir(path):
+        raise
+    with self.dirsLock:
+      self.dirs.add(path)
+
+  def writeFile(self, path, data, mode):
+    self.makedirs(os.path.dirname(path))
+    fp = open(path, 'wb')
+    try:
+      fp.write(data)
+    finally:
+      fp.close()
+    os.chmod(path, mode)
+
+  # Copy the file object |fp| to |path| on the calling thread, a chunk at a
+  # time, for files too big to hold in memory.
+  def copy(self, path, fp, mode, chunkSize=1024 * 1024):
+    if self.errors:
+      raise self.errors[0]
+    self.makedirs(os.path.dirname(path))
+    out = open(path, 'wb')
+    try:
+      shutil.copyfileobj(fp, out, chunkSize)
+    finally:
+      out.close()
+    os.chmod(path, mode)
+
+  def write(self, path, data, mode):
+    if self.errors:
+      raise self.errors[0]
+    if len(data) > self.bufferSize:
+      self.writeFile(path, data, mode)
+      return
+    with self.condition:
+      while self.pending + len(data) > self.bufferSize and not self.errors:
+        self.condition.wait()
+      self.pending += len(data)
+    self.queue.put((path, data, mode))
+
+  def work(self):
+    while True:
+      item = self.queue.get()
+      if item is None:
+        return
+      (path, data, mode) = item
+      try:
+        self.writeFile(path, data, mode)
+      except Exception as e:
+        self.errors.append(e)
+      finally:
+        with self.condition:
+          self.pending -= len(data)
+          self.condition.notify_all()
+
+  # Wait for everything to be written.
+  def close(self):
+    for thread in self.threads:
+      self.queue.put(None)
+    for thread in self.threads:
+      thread.join()
+    if self.errors:
+      raise self.errors[0]
+
+def memberPath(dest, name):
+  path = os.path.normpath(os.path.join(dest, name))
+  if not (path + os.sep).startswith(os.path.normpath(dest) + os.sep):
+    raise ValueError("Archive member %s is outside of the archive" % name)
+  return path
+
+# Apply what can only be done once every file is in place: links may point at
+# files written later in the archive, and directories may be read-only.
+def finishExtraction(links, dirModes):
+  for (path, target, hard) in links:
+    if os.path.lexists(path):
+      os.remove(path)
+    if hard:
+      os.link(target, path)
+    else:
+      os.symlink(target, path)
+  for (path, mode) in reversed(dirModes):
+    os.chmod(path, mode)
+
+# Extract the tar archive read from the file object |archive|, compressed with
+# |compression| ("bz2", "gz" or "" for none), into |dest|, preserving file
+# modes.
+def extractTar(archive, dest, compression):
+  writer = ParallelWriter()
+  links = []
+  dirModes = []
+  if compression == "bz2":
+    # decompressed beside the extraction, as tar -j does
+    archive = BackgroundBZ2Reader(archive)
+    compression = ""
+  try:
+    tar = tarfile.open(fileobj=archive, mode="r|" + compression)
+    for member in tar:
+      path = memberPath(dest, member.name)
+      if member.isdir():
+        writer.makedirs(path)
+        dirModes.append((path, member.mode & 07777))
+      elif member.isfile() and member.size > writer.bufferSize:
+        writer.copy(path, tar.extractfile(member), member.mode & 07777)
+      elif member.isfile():
+        writer.write(path, tar.extractfile(member).read(), member.mode & 07777)
+      elif member.issym():
+        links.append((path, member.linkname, False))
+      elif member.islnk():
+        links.append((path, memberPath(dest, member.linkname), True))
+  finally:
+    try:
+      writer.close()
+    finally:
+      if isinstance(archive, BackgroundBZ2Reader):
+        archive.close()
+  finishExtraction(links, dirModes)
+
+# Extract the zip archive at |src| into |dest|, preserving the Unix file modes
+# it records.
+def extractZip(src, dest):
+  writer = ParallelWriter()
+  links = []
+  dirModes = []
+  zipped = zipfile.ZipFile(src)
+  try:
+    for info in zipped.infolist():
+      path = memberPath(dest, info.filename)
+      mode = info.external_attr >> 16
+      if info.filename.endswith('/'):
+        writer.makedirs(path)
+        if mode:
+          dirModes.append((path, mode & 07777))
+      elif stat.S_ISLNK(mode):
+        links.append((path, zipped.read(info), False))
+      else:
+        writer.write(path, zipped.read(info), (mode & 07777) or 0644)
+  finally:
+    try:
+      writer.close()
+    finally:
+      zipped.close()
+  finishExtraction(links, dirModes)
+
+# Archives we can extract while they are still being downloaded
+def canStreamInstall(src):
+  return bool(isTARBZ.match(src) or isTARGZ.match(src) or isZIP.match(src))
+
+# Extract the archive read from |stream| into |dest| as its bytes arrive.
+# |src| is the archive's file name, which tells us its type.
+def streamInstall(stream, src, dest):
+  if not os.path.exists(dest):
+    os.makedirs(dest)
+  if isTARBZ.match(src):
+    extractTar(stream, dest, "bz2")
+  elif isTARGZ.match(src):
+    extractTar(stream, dest, "gz")
+  elif isZIP.match(src):
+    ZipStreamExtractor(stream).extractall(dest)
+  else:
+    raise ValueError("Can't extract %s while downloading it" % src)
+
+# Reads a zip archive front to back, extracting each member from its local
+# header as soon as it arrives. Unix file modes, and with them which members
+# are symbolic links, are only recorded in the central directory at the end of
+# the archive, so they are applied last.
+class ZipStreamExtractor:
+  LOCAL_HEADER = 'PK\x03\x04'
+  CENTRAL_HEADER = 'PK\x01\x02'
+  END_OF_CENTRAL_DIR = 'PK\x05\x06'
+  DATA_DESCRIPTOR = 'PK\x07\x08'
+  CHUNK_SIZE = 64 * 1024
+
+  def __init__(self, stream):
+    self.stream = stream
+    self.pushback = ''
+
+  def read(self, size):
+    data = self.pushback[:size]
+    self.pushback = self.pushback[size:]
+    while len(data) < size:
+      chunk = self.stream.read(size - len(data))
+      if not chunk:
+        raise zipfile.BadZipfile("Truncated zip archive")
+      data += chunk
+    return data
+
+  def unread(self, data):
+    self.pushback = data + self.pushback
+
+  def extractall(self, dest):
+    modes = {}
+    while True:
+      signature = self.read(4)
+      if signature == self.LOCAL_HEADER:
+        self.extractMember(dest)
+      elif signature == self.CENTRAL_HEADER:
+        (name, mode) = self.readCentralEntry()
+        if mode:
+          modes[name] = mode
+      elif signature == self.END_OF_CENTRAL_DIR:
+        break
+      else:
+        raise zipfile.BadZipfile("Unexpected zip record %r" % signature)
+
+    # symbolic links arrived as files holding their targets
+    links = []
+    dirModes = []
+    for name, mode in sorted(modes.items()):
+      path = memberPath(dest, name)
+      if stat.S_ISLNK(mode) and os.path.isfile(path):
+        fp = open(path, 'rb')
+        try:
+          target = fp.read()
+        finally:
+          fp.close()
+        links.append((path, target, False))
+      elif name.endswith('/'):
+        dirModes.append((path, mode & 07777))
+      elif os.path.isfile(path):
+        os.chmod(path, mode & 07777)
+    finishExtraction(links, dirModes)
+
+  def extractMember(self, dest):
+    (version, flags, method, mtime, mdate, crc, compressedSize, size,
+     nameLength, extraLength) = struct.unpack('<HHHHHIIIHH', self.read(26))
+    name = self.read(nameLength)
+    self.read(extraLength)
+    path = memberPath(dest, name)
+    if name.endswith('/'):
+      if not os.path.isdir(path):
+        os.makedirs(path)
+      return
+
+    if not os.path.isdir(os.path.dirname(path)):
+      os.makedirs(os.path.dirname(path))
+    hasDescriptor = flags & 0x08
+    out = open(path, 'wb')
+    try:
+      if method == zipfile.ZIP_STORED:
+        if hasDescriptor:
+          raise zipfile.BadZipfile("Can't stream stored member %s of unknown size" % name)
+        checksum = self.copy(out, compressedSize)
+      elif method == zipfile.ZIP_DEFLATED:
+        checksum = self.inflate(out, None if hasDescriptor else compressedSize)
+      else:
+        raise zipfile.BadZipfile("Unsupported compression method %d for %s" % (method, name))
+    finally:
+      out.close()
+
+    if hasDescriptor:
+      descriptor = self.read(4)
+      if descriptor != self.DATA_DESCRIPTOR:
+        # the descriptor signature is optional
+        self.unread(descriptor)
+      (crc, compressedSize, size) = struct.unpack('<III', self.read(12))
+    if checksum & 0xffffffff != crc:
+      raise zipfile.BadZipfile("Bad CRC for %s" % name)
+
+  def copy(self, out, size):
+    checksum = 0
+    while size > 0:
+      data = self.read(min(size, self.CHUNK_SIZE))
+      out.write(data)
+      checksum = zlib.crc32(data, checksum)
+      size -= len(data)
+    return checksum
+
+  def inflate(self, out, compressedSize):
+    # without a size, read until the deflate stream itself says it's done
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+    checksum = 0
+    remaining = compressedSize
+    while remaining is None or remaining > 0:
+      if remaining is None:
+        chunk = self.pushback or self.stream.read(self.CHUNK_SIZE)
+        self.pushback = ''
+        if not chunk:
+          raise zipfile.BadZipfile("Truncated zip archive")
+      else:
+        chunk = self.read(min(remaining, self.CHUNK_SIZE))
+        remaining -= len(chunk)
+      data = decompressor.decompress(chunk)
+      out.write(data)
+      checksum = zlib.crc32(data, checksum)
+      if decompressor.unused_data:
+        self.unread(decompressor.unused_data)
+        break
+    data = decompressor.flush()
+    out.write(data)
+    return zlib.crc32(data, checksum)
+
+  def readCentralEntry(self):
+    fields = struct.unpack('<HHHHHHIIIHHHHHII', self.read(42))
+    (nameLength, extraLength, commentLength) = fields[9:12]
+    externalAttributes = fields[14]
+    name = self.read(nameLength)
+    self.read(extraLength + commentLength)
+    return (name, externalAttributes >> 16)
+
 # Enable it to be called from the command line with the options
 if __name__ == "__main__":
   parser = OptionParser()
@@ -0,0 +1,237 @@
+import binascii
+import bz2
+import collections
+import multiprocessing
+import Queue
+import threading
+
+# Every bzip2 block starts with the 48 bits of pi's BCD digits, and every
+# stream ends with those of sqrt(pi). Neither is byte aligned.
+BLOCK_MAGIC = 0x314159265359
+END_MAGIC = 0x177245385090
+
+# Archives smaller than this aren't worth starting processes for.
+MIN_PARALLEL_SIZE = 4 * 1024 * 1024
+
+def worth_parallel(size, processes=None):
+    """Whether |size| bytes of bzip2 data are worth decompressing on
+       |processes| processes (None for one per core)."""
+    return (processes or multiprocessing.cpu_count()) > 1 and size >= MIN_PARALLEL_SIZE
+
+def read_bits(data, start, count):
+    """Return |count| bits of |data| from bit offset |start| as a number."""
+    chunk = data[start // 8:(start + count + 7) // 8]
+    value = int(binascii.hexlify(chunk), 16)
+    value >>= len(chunk) * 8 - (start % 8) - count
+    return value & ((1 << count) - 1)
+
+def find_magic(data, magic):
+    """Return the bit offsets of the 48-bit |magic| in |data|, in order."""
+    found = []
+    for shift in range(8):
+        # the whole bytes the magic covers at this shift are enough for a
+        # plain string search; the bits on either side are checked after
+        if shift == 0:
+            pattern = binascii.unhexlify('%012x' % magic)
+            offset = 0
+        else:
+            pattern = binascii.unhexlify('%014x' % (magic << (8 - shift)))[1:6]
+            offset = 1
+        pos = data.find(pattern)
+        while pos != -1:
+            start = (pos - offset) * 8 + shift
+            if start >= 0 and start + 48 <= len(data) * 8 and read_bits(data, start, 48) == magic:
+                found.append(start)
+            pos = data.find(pattern, pos + 1)
+    return sorted(found)
+
+def find_blocks(data):
+    """Return the (start, end) bit offsets of every compressed block in the
+       bzip2 data |data|."""
+    blocks = set(find_magic(data, BLOCK_MAGIC))
+    boundaries = sorted(blocks.union(find_magic(data, END_MAGIC)))
+    if boundaries and boundaries[-1] in blocks:
+        raise IOError("bzip2 data ends inside a block")
+    # a block runs up to whichever magic comes next
+    return [(start, end) for (start, end) in zip(boundaries, boundaries[1:])
+            if start in blocks]
+
+def _wrap_block(chunk, shift, length):
+    # a block is a whole stream once it has a header in front and an end of
+    # stream marker behind, whose checksum is the block's own for a
+    # single block
+    bits = read_bits(chunk, shift, length)
+    crc = read_bits(chunk, shift + 48, 32)
+    value = (((bits << 48) | END_MAGIC) << 32) | crc
+    padding = -(length + 80) % 8
+    value <<= padding
+    size = (length + 80 + padding) // 8
+    return 'BZh9' + binascii.unhexlify('%0*x' % (size * 2, value))
+
+def _decompress_block(job):
+    (chunk, shift, length) = job
+    return bz2.decompress(_wrap_block(chunk, shift, length))
+
+class ParallelBZ2Reader(object):
+    """A file object of the decompressed contents of the bzip2 data |data|
+       (a string, or an mmap of a file), whose blocks are decompressed on a
+       pool of processes and put back in order. Should a block fail to
+       decompress (e.g. when something in the middle of a block looks like a
+       block header), the rest is decompressed serially, so the output is
+       always what bz2.decompress would give."""
+
+    def __init__(self, data, processes=None):
+        self.data = data
+        self.processes = processes or multiprocessing.cpu_count()
+        self.buffer = ''
+        self.position = 0
+        self.emitted = 0
+        self.pool = None
+        self.chunks = self._serialChunks(0)
+        if worth_parallel(len(data), self.processes):
+            blocks = find_blocks(data)
+            if len(blocks) > 1:
+                self.pool = multiprocessing.Pool(self.processes)
+                self.chunks = self._parallelChunks(blocks)
+
+    def _parallelChunks(self, blocks):
+        # keep a few blocks per process in flight, not the whole archive
+        pending = collections.deque()
+        jobs = iter(blocks)
+        try:
+            while True:
+                for (start, end) in jobs:
+                    chunk = self.data[start // 8:(end + 7) // 8]
+                    pending.append(self.pool.apply_async(_decompress_block,
+                                                         ((chunk, start % 8, end - start),)))
+                    if len(pending) >= self.processes * 2:
+                        break
+                if not pending:
+                    break
+                yield pending.popleft().get()
+        except (IOError, EOFError, ValueError):
+            self.close()
+            for chunk in self._serialChunks(self.emitted):
+                yield chunk
+
+    def _serialChunks(self, skip):
+        decompressor = bz2.BZ2Decompressor()
+        data = self.data
+        offset = 0
+        while offset < len(data):
+            chunk = decompressor.decompress(data[offset:offset + 1024 * 1024])
+            offset += 1024 * 1024
+            if skip:
+                dropped = min(skip, len(chunk))
+                chunk = chunk[dropped:]
+                skip -= dropped
+            if chunk:
+                yield chunk
+            if decompressor.unused_data:
+                # another stream follows this one
+                data = decompressor.unused_data + data[offset:]
+                offset = 0
+                decompressor = bz2.BZ2Decompressor()
+
+    def read(self, size=-1):
+        # hand out slices of the current block rather than copying what is
+        # left of it on every read
+        pieces = []
+        while size != 0:
+            if self.position >= len(self.buffer):
+                try:
+                    self.buffer = next(self.chunks)
+                except StopIteration:
+                    break
+                self.position = 0
+                self.emitted += len(self.buffer)
+            if size < 0:
+                piece = self.buffer[self.position:]
+            else:
+                piece = self.buffer[self.position:self.position + size]
+                size -= len(piece)
+            self.position += len(piece)
+            pieces.append(piece)
+        return ''.join(pieces)
+
+    def close(self):
+        if self.pool:
+            # only a few blocks are ever in flight, let them finish: on 2.7
+            # terminate() can hang while the task handler is still writing
+            # a block to a worker
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+class BackgroundBZ2Reader(object):
+    """A file object of the decompressed contents of the bzip2 file object
+       |fileobj|, decompressed |chunkSize| bytes at a time on a thread of its
+       own, up to |ahead| chunks ahead of the reader. That is how tar -j runs
+       bzip2 beside tar: bz2 doesn't hold the GIL while it decompresses, so
+       on more than one core decompression overlaps with whatever the reader
+       does with the data."""
+
+    def __init__(self, fileobj, chunkSize=64 * 1024, ahead=16):
+        self.fileobj = fileobj
+        self.chunkSize = chunkSize
+        self.queue = Queue.Queue(ahead)
+        self.buffer = ''
+        self.position = 0
+        self.finished = False
+        self.closed = False
+        self.thread = threading.Thread(target=self._decompress)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _decompress(self):
+        try:
+            decompressor = bz2.BZ2Decompressor()
+            while not self.closed:
+                data = self.fileobj.read(self.chunkSize)
+                if not data:
+                    break
+                while data:
+                    chunk = decompressor.decompress(data)
+                    if chunk:
+                        self.queue.put(chunk)
+                    data = decompressor.unused_data
+                    if data:
+                        # another stream follows this one
+                        decompressor = bz2.BZ2Decompressor()
+            self.queue.put(None)
+        except Exception as e:
+            self.queue.put(e)
+
+    def read(self, size=-1):
+        pieces = []
+        while size != 0:
+            if self.position >= len(self.buffer):
+                if self.finished:
+                    break
+                item = self.queue.get()
+                if item is None:
+                    self.finished = True
+                    break
+                if isinstance(item, Exception):
+                    self.finished = True
+                    raise item
+                self.buffer = item
+                self.position = 0
+            if size < 0:
+                piece = self.buffer[self.position:]
+            else:
+                piece = self.buffer[self.position:self.position + size]
+                size -= len(piece)
+            self.position += len(piece)
+            pieces.append(piece)
+        return ''.join(pieces)
+
+    def close(self):
+        # make room for the chunk the thread may be waiting to queue, it
+        # stops before decompressing another
+        self.closed = True
+        while self.thread.is_alive():
+            try:
+                self.queue.get_nowait()
+            except Queue.Empty:
+                self.thread.join(0.01)
@@ -0,0 +1,131 @@
+import os
+import threading
+
+from mozfile import rmtree
+
+from download import DownloadCancelled
+
+class PrefetchedBuild(object):
+    """A nightly that is being fetched in the background, ahead of the
+       bisection step that needs it."""
+
+    def __init__(self, date):
+        self.date = date
+        self.state = 'queued'
+        self.dest = None
+        self.extracted = None
+        self.cancelled = False
+        self.received = 0
+        self.length = None
+        self.done = threading.Event()
+
+    def progress(self, received, length):
+        if self.cancelled:
+            raise DownloadCancelled()
+        self.received = received
+        self.length = length
+
+    def __str__(self):
+        if self.state == 'downloading' and self.length:
+            return "%s: downloading %d%%" % (self.date, self.received * 100 / self.length)
+        return "%s: %s" % (self.date, self.state)
+
+class Prefetcher(object):
+    """Downloads (and optionally extracts) nightlies on background threads,
+       so the next bisection step can start as soon as a verdict is given."""
+
+    def __init__(self, app, extract=False):
+        self.app = app
+        self.extract = extract
+        self._builds = {}
+        self._lock = threading.Lock()
+
+    def prefetch(self, date):
+        with self._lock:
+            build = self._builds.get(date)
+            if build and not build.cancelled:
+                return
+            build = PrefetchedBuild(date)
+            self._builds[date] = build
+        thread = threading.Thread(target=self._fetch, args=(build,))
+        thread.daemon = True
+        thread.start()
+
+    def _fetch(self, build):
+        try:
+            build.dest = self.app.getCached(build.date)
+            if not build.dest:
+                url = self.app.getBuildUrl(build.date)
+                if not url:
+                    build.state = 'missing'
+                    return
+                if build.cancelled:
+                    return
+                build.state = 'downloading'
+                # known before the download starts, so a cancelled one can be
+                # cleaned up
+                build.dest = "prefetch-%s-%s" % (build.date, os.path.basename(url))
+                build.dest = self.app.downloadBuild(url, build.date, build.dest,
+                                                    progress=build.progress)
+            if self.extract and not build.cancelled:
+                build.state = 'extracting'
+                build.extracted = self.app.extract(build.dest,
+                                                   "%s-%s" % (self.app.installDir, build.date))
+            build.state = 'ready'
+        except DownloadCancelled:
+            build.state = 'cancelled'
+        except Exception as e:
+            build.state = 'failed (%s)' % e
+        finally:
+            with self._lock:
+                build.done.set()
+                if build.cancelled:
+                    self._discard(build)
+
+    def cancel(self, date):
+        """Drop a prefetch whose build turned out not to be needed. A download
+           that is still in flight is discarded as soon as it completes."""
+        with self._lock:
+            build = self._builds.pop(date, None)
+            if not build:
+                return
+            build.cancelled = True
+            if build.done.is_set():
+                self._discard(build)
+
+    def cancelAll(self):
+        for date in list(self._builds.keys()):
+            self.cancel(date)
+
+    def claim(self, date):
+        """Wait for the prefetch of |date| to finish and hand it over to the
+           caller, or return None if there is no usable prefetch for it."""
+        with self._lock:
+            build = self._builds.pop(date, None)
+        if not build:
+            return None
+        build.done.wait()
+        if build.state != 'ready' or not os.path.exists(build.dest):
+            self._discard(build)
+            return None
+        return build
+
+    def status(self):
+        with self._lock:
+            builds = sorted(self._builds.values(), key=lambda b: b.date)
+        return ", ".join([str(build) for build in builds])
+
+    def _discard(self, build):
+        if build.extracted and os.path.exists(build.extracted):
+            rmtree(build.extracted)
+        # cached archives are kept for later bisections, and so are the
+        # partial downloads in the cache, to be resumed
+        if build.dest and not self.app.isCached(build.dest):
+            for path in (build.dest, build.dest + '.part', build.dest + '.part.json'):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def cleanup(self):
+        self.cancelAll()
+
+    __del__ = cleanup
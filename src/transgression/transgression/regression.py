@@ -36,18 +36,55 @@
 # ***** END LICENSE BLOCK *****
 
 import datetime
-import sys
+import multiprocessing
+import os
+import signal
 import subprocess
+import time
+from multiprocessing.pool import ThreadPool
 from optparse import OptionParser
 
 
+from bisection import BisectionSession, BuildRange
+from buildindex import BuildIndex
+from buildstore import BuildStore, DEFAULT_STORE_SIZE
+from cache import ArchiveCache, DEFAULT_CACHE_DIR, DEFAULT_CACHE_SIZE
+from config import BinaryRepository
+from httpsession import HttpSession, DEFAULT_TIMEOUT
+from listing import ListingCache
 from runnightly import NightlyRunner
 from utils import strsplit, get_date, increment_day
 
+# A --test-command exits with this to skip a build it can't judge, the same
+# convention as git bisect run; 0 means good and anything else bad.
+SKIP_EXIT_CODE = 125
+
+# Roughly what a nightly under test takes in memory, so parallel bisection
+# doesn't start more of them than fit.
+MEMORY_PER_JOB = 1024 * 1024 * 1024
+
+def default_jobs():
+    """The number of nightlies this machine can test at once: one per core,
+       as far as memory allows."""
+    jobs = multiprocessing.cpu_count()
+    try:
+        memory = os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+        jobs = min(jobs, memory / MEMORY_PER_JOB)
+    except (AttributeError, ValueError, OSError):
+        pass
+    return max(1, jobs)
+
 class Bisector(object):
-    def __init__(self, runner, appname="firefox"):
+    def __init__(self, runner, appname="firefox", testCommand=None, testTimeout=None,
+                 jobs=1, session=None, changesets=False):
         self.runner = runner
         self.appname = appname
+        self.testCommand = testCommand
+        self.testTimeout = testTimeout
+        self.jobs = jobs
+        self.session = session
+        self.changesets = changesets
+        self.appInfos = {}
         self.goodAppInfo = ''
         self.badAppInfo = ''
         self.currDate = ''
@@ -58,28 +95,35 @@ class Bisector(object):
         from mozcommitbuilder import builder
         commitBuilder = builder.Builder()
 
-        #One of these won't be set, so we need to download one more nightly and set it
+        #One of these won't be set, so we need the info of one more nightly
         if self.goodAppInfo:
             lastGoodChangeset = self.goodAppInfo[1]
         else:
-            #Download and get the info
-            missingNightly = NightlyRunner()
-            missingNightly.install(goodDate)
-            lastGoodChangeset = missingNightly.getAppInfo()[1]
+            lastGoodChangeset = self.getAppInfo(goodDate)[1]
 
         if self.badAppInfo:
             firstBadChangeset = self.badAppInfo[1]
         else:
-            #Download and get the info
-            missingNightly = NightlyRunner()
-            missingNightly.install(badDate)
-            firstBadChangeset = missingNightly.getAppInfo()[1]
+            firstBadChangeset = self.getAppInfo(badDate)[1]
 
         print "\n Narrowed changeset range from " + lastGoodChangeset + " to " + firstBadChangeset +"\n"
 
         print "Time to do some bisecting and building!"
         commitBuilder.bisect(lastGoodChangeset, firstBadChangeset)
-        quit()
+
+    def getAppInfo(self, date):
+        """The (repo, changeset) of the nightly from |date|, read from its
+           archive, or from an install of it when the archive can't be read
+           (e.g. a disk image)."""
+        info = self.runner.probeAppInfo(date)
+        if info:
+            return info
+        missingNightly = NightlyRunner(appname=self.appname)
+        try:
+            missingNightly.install(date)
+            return missingNightly.getAppInfo()
+        finally:
+            missingNightly.cleanup()
 
     def build(self, goodDate, badDate):
         if self.appname == "firefox":
@@ -90,61 +134,216 @@ class Bisector(object):
 
     def printRange(self, goodDate, badDate):
         print "\n\nLast good nightly: " + str(goodDate) + "\nFirst bad nightly: " + str(badDate) + "\n"
-        print "Pushlog:\n" + self.getPushlogUrl(goodDate, badDate) + "\n"
+        pushlog = self.getPushlogUrl(goodDate, badDate)
+        if pushlog:
+            print "Pushlog:\n" + pushlog + "\n"
+        else:
+            print "Changesets:\n" + self.getChangesetRange(goodDate, badDate) + "\n"
+        if self.testCommand:
+            # nobody is there to answer
+            return
         verdict = raw_input("do you want to bisect further by fetching the repository and building? (y or n) ")
         if verdict == "y":
             self.build(goodDate, badDate)
-        sys.exit()
 
-    def bisect(self, goodDate, badDate, skips=0):
-        midDate = goodDate + (badDate - goodDate) / 2
-        
-        midDate += datetime.timedelta(days=skips)
+    def bisect(self, goodDate, badDate):
+        """Find the first bad nightly after |goodDate|. Returns the last good
+           and first bad dates, or None if the user gave up."""
+        print "Looking for nightlies between %s and %s" % (goodDate, badDate)
+        builds = BuildRange([goodDate] + self.runner.getBuildDates(goodDate, badDate) + [badDate])
+        return self.bisectRange(builds)
+
+    def resume(self):
+        """Carry on with the bisection saved in self.session."""
+        builds = self.session.builds
+        self.goodAppInfo = self.session.goodAppInfo
+        self.badAppInfo = self.session.badAppInfo
+        print "Resuming bisection between %s and %s" % (builds.goodBuild(), builds.badBuild())
+        return self.bisectRange(builds)
+
+    def checkpoint(self, builds):
+        if self.session:
+            self.session.save(builds, self.goodAppInfo, self.badAppInfo)
 
-        if midDate == badDate or midDate == goodDate:
-            self.printRange(goodDate, badDate)
+    def fetchChangesets(self, builds):
+        """Look up the changeset of every nightly of |builds| in the metadata
+           files next to the archives, so the range can be told in changesets
+           before any nightly is downloaded."""
+        print "Fetching the changesets of %d nightlies" % len(builds.builds)
+        self.appInfos = self.runner.probeAppInfos(builds.builds)
+        self.narrowed(builds)
 
-        # run the nightly from that date
-        dest = self.runner.start(midDate)
-        while not dest:
-            midDate += datetime.timedelta(days=1)
-            if midDate == badDate:
-                self.printRange(goodDate, badDate)
-            dest = self.runner.start(midDate)
+    def narrowed(self, builds):
+        # the ends of the range have known changesets even if they weren't
+        # tested themselves
+        if not self.appInfos:
+            return
+        self.goodAppInfo = self.appInfos.get(builds.goodBuild()) or self.goodAppInfo
+        self.badAppInfo = self.appInfos.get(builds.badBuild()) or self.badAppInfo
+        print "Regression range: " + (self.getPushlogUrl(builds.goodBuild(), builds.badBuild()) or
+                                      self.getChangesetRange(builds.goodBuild(), builds.badBuild()))
+
+    def bisectRange(self, builds):
+        if self.changesets:
+            self.fetchChangesets(builds)
+        self.checkpoint(builds)
+        if self.jobs > 1:
+            return self.bisectParallel(builds)
+
+        index = builds.next()
+        while index is not None:
+            midDate = builds.builds[index]
+            # run the nightly from that date
+            if not self.runner.start(midDate):
+                # the month listing has the day, but not a nightly for us
+                builds.skip(index)
+                self.checkpoint(builds)
+                index = builds.next()
+                continue
+
+            self.prevDate = self.currDate
+            self.currDate = midDate
+
+            # while the build is being tested, fetch whichever nightly the
+            # verdict will send us to next
+            nextIfGood = builds.nextIf(index, True)
+            nextIfBad = builds.nextIf(index, False)
+            for nextIndex in (nextIfGood, nextIfBad):
+                if nextIndex is not None:
+                    self.runner.prefetch(builds.builds[nextIndex])
+
+            verdict = self.getVerdict(midDate)
+            self.runner.stop()
+            for (nextIndex, keep) in ((nextIfGood, ('good', 'g')), (nextIfBad, ('bad', 'b'))):
+                if nextIndex is not None and verdict not in keep:
+                    self.runner.cancelPrefetch(builds.builds[nextIndex])
 
-        self.prevDate = self.currDate
-        self.currDate = midDate
+            if verdict == 'good' or verdict == 'g':
+                self.goodAppInfo = self.runner.getAppInfo()
+                builds.setGood(index)
+            elif verdict == 'bad' or verdict == 'b':
+                self.badAppInfo = self.runner.getAppInfo()
+                builds.setBad(index)
+            elif verdict == 'skip' or verdict == 's':
+                # try the nearest build on either side that isn't skipped
+                builds.skip(index)
+            elif verdict == 'exit':
+                goodDateString = str(builds.goodBuild())
+                badDateString = str(builds.badBuild())
+                print 'Newest known good nightly: %s' % goodDateString
+                print 'Oldest known bad nightly: %s' % badDateString
+                print 'To resume, run:'
+                if self.session:
+                    print 'mozregression --resume=%s' % self.session.path
+                else:
+                    print 'mozregression --good=%s --bad=%s' % (goodDateString, badDateString)
+                return None
+            # retry -- next() picks the same build again
+            self.narrowed(builds)
+            self.checkpoint(builds)
+            index = builds.next()
 
+        self.printRange(builds.goodBuild(), builds.badBuild())
+        return builds.goodBuild(), builds.badBuild()
+
+    def bisectParallel(self, builds):
+        """Test self.jobs nightlies at once, cutting the range into jobs + 1
+           parts each round, each nightly in its own install directory and
+           profile."""
+        runners = [self.runner] + [self.runner.spawn("moznightlyapp-%d" % job)
+                                   for job in range(1, self.jobs)]
+        pool = ThreadPool(self.jobs)
+        try:
+            indexes = builds.split(self.jobs)
+            while indexes:
+                dates = [builds.builds[index] for index in indexes]
+                print "Testing nightlies from %s" % ", ".join([str(date) for date in dates])
+                results = pool.map(self._testBuild, zip(runners, dates))
+                builds.record([(index, verdict) for (index, (verdict, appInfo))
+                               in zip(indexes, results)])
+                for (index, (verdict, appInfo)) in zip(indexes, results):
+                    if index == builds.good:
+                        self.goodAppInfo = appInfo
+                    elif index == builds.bad:
+                        self.badAppInfo = appInfo
+                self.narrowed(builds)
+                self.checkpoint(builds)
+                indexes = builds.split(self.jobs)
+        finally:
+            pool.close()
+            for runner in runners[1:]:
+                runner.cleanup()
+
+        self.printRange(builds.goodBuild(), builds.badBuild())
+        return builds.goodBuild(), builds.badBuild()
+
+    def _testBuild(self, job):
+        (runner, date) = job
+        if not runner.start(date):
+            return 'skip', None
+        try:
+            verdict = self.runTestCommand(date, runner)
+            return verdict, runner.getAppInfo()
+        finally:
+            runner.stop()
+
+    def getVerdict(self, date):
+        if self.testCommand:
+            return self.runTestCommand(date)
         # wait for them to call it 'good' or 'bad'
         verdict = ""
         options = ['good','g','bad','b','skip','s','retry','r', 'exit']
         while verdict not in options:
-            verdict = raw_input("Was this nightly good, bad, or broken? (type 'good', 'bad', 'skip', 'retry', or 'exit' and press Enter): ")
-
-        self.runner.stop()
-        if verdict == 'good' or verdict == 'g':
-            self.goodAppInfo = self.runner.getAppInfo()
-            self.bisect(midDate, badDate)
-        elif verdict == 'bad' or verdict == 'b':
-            self.badAppInfo = self.runner.getAppInfo()
-            self.bisect(goodDate, midDate)
-        elif verdict == 'skip' or verdict == 's':
-            #skip -- go 1 day further down
-            self.bisect(goodDate, badDate, skips=skips+1)
-        elif verdict == 'exit':
-            self.runner.stop()
-            goodDateString = '%04d-%02d-%02d' % (goodDate.year, goodDate.month, goodDate.day)
-            badDateString = '%04d-%02d-%02d' % (badDate.year, badDate.month, badDate.day)
-            print 'Newest known good nightly: %s' % goodDateString
-            print 'Oldest known bad nightly: %s' % badDateString
-            print 'To resume, run:'
-            print 'mozregression --good=%s --bad=%s' % (goodDateString, badDateString)
-            return
+            verdict = raw_input(self.getVerdictPrompt())
+        return verdict
+
+    def runTestCommand(self, date, runner=None):
+        """Judge the nightly from |date| that |runner| is running by the exit
+           code of the test command. A command that runs past the timeout is
+           killed, and the build skipped."""
+        env = dict(os.environ)
+        env['TRANSGRESSION_DATE'] = str(date)
+        env['TRANSGRESSION_BINARY'] = (runner or self.runner).getBinary()
+        print "Testing nightly from %s" % date
+        # in a session of its own, so a timeout kills whatever it started too
+        process = subprocess.Popen(self.testCommand, shell=True, env=env,
+                                   preexec_fn=getattr(os, 'setsid', None))
+        deadline = None
+        if self.testTimeout:
+            deadline = time.time() + self.testTimeout
+        while process.poll() is None:
+            if deadline and time.time() > deadline:
+                print "Test of nightly from %s timed out, skipping it" % date
+                if hasattr(os, 'killpg'):
+                    os.killpg(process.pid, signal.SIGKILL)
+                else:
+                    process.kill()
+                process.wait()
+                return 'skip'
+            time.sleep(0.1)
+
+        if process.returncode == 0:
+            verdict = 'good'
+        elif process.returncode == SKIP_EXIT_CODE or process.returncode < 0:
+            # killed by a signal tells us nothing about the build
+            verdict = 'skip'
         else:
-            #retry -- since we're just calling ourselves with the same parameters, it does the same thing again
-            self.bisect(goodDate, badDate)
+            verdict = 'bad'
+        print "Nightly from %s is %s" % (date, verdict)
+        return verdict
+
+    def getVerdictPrompt(self):
+        prompt = "Was this nightly good, bad, or broken? (type 'good', 'bad', 'skip', 'retry', or 'exit' and press Enter): "
+        status = self.runner.prefetchStatus()
+        if status:
+            # an empty answer just re-prompts, which refreshes this status
+            prompt = "[prefetching " + status + "]\n" + prompt
+        return prompt
 
     def getPushlogUrl(self, goodDate, badDate):
+        """The pushlog of the changes between the nightlies from |goodDate|
+           and |badDate|, or None if the repository they were built from
+           isn't known (e.g. builds of a binaryRepository)."""
         if not self.goodAppInfo or not self.badAppInfo:
             if self.goodAppInfo:
                 (repo, chset) = self.goodAppInfo
@@ -152,12 +351,22 @@ class Bisector(object):
                 (repo, chset) = self.badAppInfo
             else:
                 repo = 'http://hg.mozilla.org/mozilla-central'
+            if not repo:
+                return None
             return repo + "/pushloghtml?startdate=" + str(goodDate) + "&enddate=" + str(badDate)
 
         (repo, good_chset) = self.goodAppInfo
         (repo, bad_chset) = self.badAppInfo
+        if not repo or not good_chset or not bad_chset:
+            return None
         return repo + "/pushloghtml?fromchange=" + good_chset + "&tochange=" + bad_chset
 
+    def getChangesetRange(self, goodDate, badDate):
+        # the ends of the range as changesets, where they are known
+        good = (self.goodAppInfo and self.goodAppInfo[1]) or str(goodDate)
+        bad = (self.badAppInfo and self.badAppInfo[1]) or str(badDate)
+        return good + " to " + bad
+
 def cli():
     parser = OptionParser()
     parser.add_option("-b", "--bad", dest="bad_date",help="first known bad nightly build, default is today",
@@ -172,19 +381,126 @@ def cli():
                       metavar="[firefox|fennec|thunderbird]", default="firefox")
     parser.add_option("-r", "--repo", dest="repo_name", help="repository name on ftp.mozilla.org",
                       metavar="[tracemonkey|mozilla-1.9.2]", default=None)
+    parser.add_option("--location", dest="location",
+                      help="bisect the builds under this binaryRepository location, as in the "
+                           "configuration, rather than ftp.mozilla.org's nightlies",
+                      metavar="HOST/PATH/%year%-%month%-%day%/%appname%.tar.bz2", default=None)
+    parser.add_option("--protocol", dest="protocol", help="protocol of --location",
+                      type="choice", metavar="[http|https|sftp|file]",
+                      choices=["http", "https", "sftp", "file"], default="http")
+    parser.add_option("-f", "--prefetch", dest="prefetch", action="store_true",
+                      help="download the possible next nightlies while the current one is tested",
+                      default=False)
+    parser.add_option("--prefetch-extract", dest="prefetch_extract", action="store_true",
+                      help="also extract prefetched nightlies ahead of time (implies --prefetch)",
+                      default=False)
+    parser.add_option("--cache-dir", dest="cache_dir", help="directory to keep downloaded nightlies in",
+                      metavar="PATH", default=DEFAULT_CACHE_DIR)
+    parser.add_option("--cache-size", dest="cache_size", type="int",
+                      help="maximum size of the nightly cache in megabytes",
+                      metavar="MB", default=DEFAULT_CACHE_SIZE / (1024 * 1024))
+    parser.add_option("--no-cache", dest="no_cache", action="store_true",
+                      help="don't keep downloaded or extracted nightlies, server listings or the build index",
+                      default=False)
+    parser.add_option("--store-size", dest="store_size", type="int",
+                      help="maximum size of the store of extracted nightlies in megabytes, "
+                           "0 to extract every nightly afresh",
+                      metavar="MB", default=DEFAULT_STORE_SIZE / (1024 * 1024))
+    parser.add_option("--segments", dest="segments", type="int",
+                      help="number of connections to download each nightly over",
+                      metavar="N", default=1)
+    parser.add_option("--timeout", dest="timeout", type="float",
+                      help="seconds to wait for the server before giving up",
+                      metavar="SECONDS", default=DEFAULT_TIMEOUT)
+    parser.add_option("-c", "--test-command", dest="test_command",
+                      help="judge each nightly by running this shell command instead of asking: "
+                           "exit code 0 is good, %d skips the nightly, anything else is bad. "
+                           "The nightly runs headless; its date and binary are in "
+                           "$TRANSGRESSION_DATE and $TRANSGRESSION_BINARY" % SKIP_EXIT_CODE,
+                      metavar="COMMAND", default=None)
+    parser.add_option("--test-timeout", dest="test_timeout", type="float",
+                      help="seconds the test command gets per nightly before it is killed "
+                           "and the nightly skipped",
+                      metavar="SECONDS", default=600)
+    parser.add_option("-j", "--jobs", dest="jobs",
+                      help="number of nightlies to test at once with --test-command, "
+                           "'auto' for as many as the cores and memory allow",
+                      metavar="N|auto", default="1")
+    parser.add_option("--changesets", dest="changesets", action="store_true",
+                      help="fetch the changeset of every nightly in the range from the small "
+                           "metadata files on the server first, to tell the regression range "
+                           "in changesets as it narrows",
+                      default=False)
+    parser.add_option("--session", dest="session",
+                      help="name to save the bisection's progress under, default is "
+                           "<app>-<good>-<bad>",
+                      metavar="NAME", default=None)
+    parser.add_option("--resume", dest="resume",
+                      help="carry on with a bisection that was interrupted",
+                      metavar="NAME", default=None)
     (options, args) = parser.parse_args()
 
+    session = None
+    if options.resume:
+        try:
+            session = BisectionSession.load(BisectionSession.pathFor(options.resume))
+        except (IOError, ValueError, KeyError) as e:
+            parser.error("can't resume %s: %s" % (options.resume, e))
+        # the saved builds are only meaningful for the same app and repo
+        options.app = session.app
+        options.repo_name = session.repo
+
+    if options.jobs == "auto":
+        jobs = default_jobs()
+    elif options.jobs.isdigit() and int(options.jobs) > 0:
+        jobs = int(options.jobs)
+    else:
+        parser.error("--jobs takes a positive number or 'auto'")
+    if jobs > 1 and not options.test_command:
+        parser.error("testing several nightlies at once needs --test-command")
+    if jobs > 1 and options.app == "fennec":
+        parser.error("fennec nightlies can only be tested one at a time")
+
     addons = strsplit(options.addons, ",")
     cmdargs = strsplit(options.cmdargs, ",")
 
-    if not options.good_date:
+    if not options.good_date and not session:
         options.good_date = "2009-01-01"
         print "No 'good' date specified, using " + options.good_date
+    if not session:
+        name = options.session or "%s-%s-%s" % (options.app, options.good_date, options.bad_date)
+        session = BisectionSession(BisectionSession.pathFor(name), options.app, options.repo_name)
+
+    cache = listings = index = store = None
+    if not options.no_cache:
+        cache = ArchiveCache(options.cache_dir, options.cache_size * 1024 * 1024)
+        listings = ListingCache()
+        index = BuildIndex()
+        if options.store_size:
+            store = BuildStore(maxBytes=options.store_size * 1024 * 1024)
+
+    template = backend = httpSession = None
+    if options.location:
+        repository = BinaryRepository({'protocol': options.protocol, 'location': options.location})
+        httpSession = HttpSession(timeout=options.timeout)
+        template = repository.getLocationTemplate()
+        backend = repository.getBackend(httpSession)
 
     runner = NightlyRunner(appname=options.app, addons=addons, repo_name=options.repo_name,
-                           profile=options.profile, cmdargs=cmdargs)
-    bisector = Bisector(runner, appname=options.app)
-    bisector.bisect(get_date(options.good_date), get_date(options.bad_date))
+                           profile=options.profile, cmdargs=cmdargs,
+                           prefetch=options.prefetch or options.prefetch_extract,
+                           prefetch_extract=options.prefetch_extract, cache=cache,
+                           segments=options.segments, listings=listings, index=index,
+                           timeout=options.timeout, headless=bool(options.test_command),
+                           store=store, session=httpSession, template=template,
+                           backend=backend)
+    bisector = Bisector(runner, appname=options.app, testCommand=options.test_command,
+                        testTimeout=options.test_timeout, jobs=jobs, session=session,
+                        changesets=options.changesets)
+    if session.builds:
+        bisector.resume()
+    else:
+        bisector.bisect(get_date(options.good_date), get_date(options.bad_date))
 
 
 if __name__ == "__main__":
@@ -5,118 +5,284 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import datetime
+import httplib
 import os
-import httplib2
 import platform
 import re
+import socket
 import subprocess
 import sys
 
-from mozfile import rmtree
-from mozprofile import FirefoxProfile
-from mozprofile import ThunderbirdProfile
-from mozrunner import Runner
+from multiprocessing.pool import ThreadPool
 from optparse import OptionParser
 from ConfigParser import ConfigParser
-from BeautifulSoup import BeautifulSoup
 
-from mozInstall import MozInstaller
-from utils import strsplit, download_url, get_date, get_platform
+from appinfo import fetch_app_info, fetch_build_metadata, read_app_info
+from backends import HttpBackend
+from buildindex import BuildIndex, Crawler
+from buildstore import BuildStore, DEFAULT_STORE_SIZE, rmtree
+from cache import ArchiveCache, DEFAULT_CACHE_DIR, DEFAULT_CACHE_SIZE
+from download import DownloadError, print_progress
+from httpsession import HttpSession, DEFAULT_TIMEOUT
+from listing import ListingCache, dayDirRegex, monthSettledSince, parseLinks
+from mozInstall import MozInstaller, canStreamInstall, streamInstall
+from prefetch import Prefetcher
+from utils import strsplit, get_date, get_platform
 
 class Nightly(object):
-    def __init__(self, repo_name=None):
+    # whether installs are plain directories the build store can keep
+    storable = True
+
+    def __init__(self, repo_name=None, cache=None, listings=None, index=None,
+                 session=None, installDir="moznightlyapp", backend=None):
         platform=get_platform()
         if platform['name'] == "Windows":
             if platform['bits'] == '64':
                 print "No nightly builds available for 64 bit Windows"
                 sys.exit()
-            self.buildRegex = ".*win32.zip"
+            self.buildRegex = re.compile(".*win32.zip")
             self.processName = self.name + ".exe"
-            self.binary = "moznightlyapp/" + self.name + "/" + self.name + ".exe"
+            self.binary = installDir + "/" + self.name + "/" + self.name + ".exe"
         elif platform['name'] == "Linux":
             self.processName = self.name + "-bin"
-            self.binary = "moznightlyapp/" + self.name + "/" + self.name
+            self.binary = installDir + "/" + self.name + "/" + self.name
             if platform['bits'] == '64':
-                self.buildRegex = ".*linux-x86_64.tar.bz2"
+                self.buildRegex = re.compile(".*linux-x86_64.tar.bz2")
             else:
-                self.buildRegex = ".*linux-i686.tar.bz2"
+                self.buildRegex = re.compile(".*linux-i686.tar.bz2")
         elif platform['name'] == "Mac":
-            self.buildRegex = ".*mac.*\.dmg"
+            self.buildRegex = re.compile(".*mac.*\.dmg")
             self.processName = self.name + "-bin"
-            self.binary = "moznightlyapp/Mozilla.app/Contents/MacOS/" + self.name + "-bin"
+            self.binary = installDir + "/Mozilla.app/Contents/MacOS/" + self.name + "-bin"
+        self.installDir = installDir
         self.repo_name = repo_name
+        self.cache = cache
+        self.listings = listings
+        self.index = index
+        self.session = session or HttpSession()
+        # where the archives are downloaded from
+        self.backend = backend or HttpBackend(session=self.session)
+        self.segments = 1
         self._monthlinks = {}
+        self._appinfo = {}
         self.lastdest = None
+        self._pin = None
 
     def cleanup(self):
-        rmtree('moznightlyapp')
-        if self.lastdest:
-            os.remove(self.lastdest)
+        rmtree(self.installDir)
+        self._releaseDownload()
 
     __del__ = cleanup
 
-    def download(self, date=datetime.date.today(), dest=None):
-        url = self.getBuildUrl(date)
+    def download(self, date=datetime.date.today(), dest=None, url=None):
+        # with a |url|, the caller already knows the nightly isn't cached
+        if not url:
+            cached = self.getCached(date)
+            if cached:
+                print "Using cached nightly from %s" % date
+                self.setDownload(cached)
+                return True
+            url = self.getBuildUrl(date)
         if url:
-            if not dest:
-                dest = os.path.basename(url)
             print "Downloading nightly from %s" % date
-            if self.lastdest:
-                os.remove(self.lastdest)
-            download_url(url, dest)
-            self.dest = self.lastdest = dest
+            self._releaseDownload()
+            self.setDownload(self.downloadBuild(url, date, dest, progress=print_progress))
             return True
         else:
             return False
 
-    def install(self):
-        rmtree("moznightlyapp")
+    def getPlatformKey(self):
+        platform = get_platform()
+        return platform['name'] + platform['bits']
+
+    def getCacheKey(self, date):
+        return ArchiveCache.buildKey(self.appName, self.repo_name or self.getRepoName(date),
+                                     self.getPlatformKey(), date)
+
+    def getCached(self, date):
+        if not self.cache:
+            return None
+        return self.cache.get(self.getCacheKey(date))
+
+    def isCached(self, path):
+        return self.cache is not None and self.cache.contains(path)
+
+    def downloadBuild(self, url, date, dest=None, progress=None):
+        """Download the nightly from |date| found at |url|, into the archive
+           cache if there is one. Returns the path of the archive."""
+        filename = os.path.basename(url)
+        if not self.cache:
+            return self.backend.fetch(url, dest or filename, progress, self.segments)
+
+        key = self.getCacheKey(date)
+        with self.cache.downloadLock(key, filename):
+            # another process may have downloaded it while we waited
+            cached = self.cache.get(key)
+            if cached:
+                return cached
+            tmp = self.cache.tempPath(key, filename)
+            self.backend.fetch(url, tmp, progress, self.segments)
+            return self.cache.put(key, tmp, filename)
+
+    def downloadAndInstall(self, date):
+        """Download and install the nightly from |date|, extracting the archive
+           while it downloads when possible. Returns False if there is no
+           nightly from |date|."""
+        url = None
+        if not self.getCached(date):
+            url = self.getBuildUrl(date)
+            if not url:
+                return False
+            # segments arrive out of order, so they can't be extracted as
+            # they come in
+            if self.segments <= 1 and self.backend.streaming and canStreamInstall(url):
+                print "Downloading and installing nightly from %s" % date
+                return self.installStreaming(url, date)
+        if not self.download(date, url=url):
+            return False
+        print "Installing nightly"
+        return self.install()
+
+    def installStreaming(self, url, date):
+        filename = os.path.basename(url)
+        if not self.cache:
+            return self._installStreaming(url, filename, None)
+
+        key = self.getCacheKey(date)
+        with self.cache.downloadLock(key, filename):
+            # another process may have downloaded it while we waited
+            cached = self.cache.get(key)
+            if cached:
+                self.setDownload(cached)
+                return self.install()
+            dest = self.cache.tempPath(key, filename)
+            self._installStreaming(url, filename, dest)
+            self.setDownload(self.cache.put(key, dest, filename))
+        return True
+
+    def _installStreaming(self, url, filename, dest):
+        self._releaseDownload()
+        self.dest = None
+        rmtree(self.installDir)
+        with self.backend.stream(url, dest, print_progress) as stream:
+            streamInstall(stream, filename, self.installDir)
+        return True
+
+    def setDownload(self, dest):
+        """Use an archive that was already downloaded (e.g. prefetched or
+           cached) as the current nightly."""
+        self._releaseDownload()
+        self.dest = dest
+        if self.isCached(dest):
+            # archives in the cache outlive us, just keep this one from
+            # being evicted while we use it
+            self._pin = self.cache.pin(dest)
+        else:
+            self.lastdest = dest
+
+    def _releaseDownload(self):
+        if self._pin:
+            self._pin.release()
+            self._pin = None
+        if self.lastdest:
+            os.remove(self.lastdest)
+            self.lastdest = None
+
+    def extract(self, src, dest):
+        rmtree(dest)
         subprocess._cleanup = lambda : None # mikeal's fix for subprocess threading bug
-        MozInstaller(src=self.dest, dest="moznightlyapp", dest_app="Mozilla.app")
+        MozInstaller(src=src, dest=dest, dest_app="Mozilla.app")
+        return dest
+
+    def install(self, extracted=None):
+        rmtree(self.installDir)
+        if extracted:
+            os.rename(extracted, self.installDir)
+        else:
+            self.extract(self.dest, self.installDir)
         return True
 
-    @staticmethod
-    def urlLinks(url):
-        res = [] # do not return a generator but an array, so we can store it for later use
+    def urlLinks(self, url, settledSince=None):
+        """Return the links of the listing at |url|, or None if it couldn't
+           be fetched, which isn't the same as a listing without links."""
+        if self.listings:
+            content = self.listings.fetch(url, settledSince, self.session)
+            if content is None:
+                return None
+        else:
+            resp, content = self.session.get(url)
+            if resp.status != 200:
+                return None
+
+        return parseLinks(content)
 
-        h = httplib2.Http();
-        resp, content = h.request(url, "GET")
-        if resp.status != 200:
-            return res
+    def getMonthUrl(self, date):
+        return "http://ftp.mozilla.org/pub/mozilla.org/" + self.appName + "/nightly/" + \
+               "%04d/%02d/" % (date.year, date.month)
 
-        soup = BeautifulSoup(content)
-        for link in soup.findAll('a'):
-            res.append(link)
-        return res
+    def getMonthLinks(self, date):
+        cachekey = "%04d-%02d" % (date.year, date.month)
+        if cachekey not in self._monthlinks:
+            links = self.urlLinks(self.getMonthUrl(date), monthSettledSince(date))
+            if links is None:
+                # asked again next time
+                return None
+            self._monthlinks[cachekey] = links
+        return self._monthlinks[cachekey]
+
+    def getDirLinks(self, url, date):
+        return self.urlLinks(url, monthSettledSince(date))
 
     def getBuildUrl(self, date):
-        url = "http://ftp.mozilla.org/pub/mozilla.org/" + self.appName + "/nightly/"
-        year = str(date.year)
-        month = "%02d" % date.month
-        day = "%02d" % date.day
-        repo_name = self.repo_name or self.getRepoName(date)
-        url += year + "/" + month + "/"
+        if self.index:
+            return self.lookupBuildUrl(date)
 
-        linkRegex = '^' + year + '-' + month + '-' + day + '-' + '[\d-]+' + repo_name + '/$'
-        cachekey = year + '-' + month
-        if cachekey in self._monthlinks:
-            monthlinks = self._monthlinks[cachekey]
-        else:
-            monthlinks = self.urlLinks(url)
-            self._monthlinks[cachekey] = monthlinks
+        url = self.getMonthUrl(date)
+        day = "%04d-%02d-%02d" % (date.year, date.month, date.day)
+        repo_name = self.repo_name or self.getRepoName(date)
 
         # first parse monthly list to get correct directory
-        for dirlink in monthlinks:
-            dirhref = dirlink.get("href")
-            if re.match(linkRegex, dirhref):
+        for dirhref in self.getMonthLinks(date) or ():
+            match = dayDirRegex.match(dirhref)
+            if match and match.group(1) == day and match.group(3) == repo_name:
                 # now parse the page for the correct build url
-                for link in self.urlLinks(url + dirhref):
-                    href = link.get("href")
-                    if re.match(self.buildRegex, href):
+                for href in self.getDirLinks(url + dirhref, date) or ():
+                    if self.buildRegex.match(href):
                         return url + dirhref + href
 
         return False
 
+    def lookupBuildUrl(self, date):
+        platform = self.getPlatformKey()
+        if not self.index.isCrawled(self.appName, platform, date):
+            Crawler(self, self.index).crawl(date, date)
+        repo_name = self.repo_name or self.getRepoName(date)
+        return self.index.lookup(self.appName, repo_name, platform, date) or False
+
+    def getBuildDates(self, start, end):
+        """Return the days strictly between |start| and |end| that have a
+           nightly, oldest first. Only the month listings are fetched; days
+           the build index has crawled are checked against it as well."""
+        dates = set()
+        month = datetime.date(start.year, start.month, 1)
+        while month <= end:
+            for href in self.getMonthLinks(month) or ():
+                match = dayDirRegex.match(href)
+                if not match:
+                    continue
+                date = get_date(match.group(1))
+                if start < date < end and match.group(3) == (self.repo_name or self.getRepoName(date)):
+                    dates.add(date)
+            month = (month + datetime.timedelta(days=31)).replace(day=1)
+
+        if self.index:
+            platform = self.getPlatformKey()
+            crawled = self.index.crawledDays(self.appName, platform, start, end)
+            dates = [date for date in dates if date not in crawled or
+                     self.index.lookup(self.appName, self.repo_name or self.getRepoName(date),
+                                       platform, date)]
+        return sorted(dates)
+
     def getAppInfo(self):
         parser = ConfigParser()
         ini_file = os.path.join(os.path.dirname(self.binary), "application.ini")
@@ -128,15 +294,74 @@ class Nightly(object):
         except:
             return ("", "")
 
-    def start(self, profile, addons, cmdargs):
-        if profile:
-            profile = self.profileClass(profile=profile, addons=addons)
-        elif len(addons):
-            profile = self.profileClass(addons=addons)
+    def probeAppInfo(self, date, archives=True):
+        """Return the (repo, changeset) of the nightly from |date| without
+           installing it: from the metadata files next to its archive, or the
+           application.ini in the archive itself unless |archives| is False.
+           Returns None if there is no such nightly or neither has it. What is
+           found is kept in the build index."""
+        url = self.getBuildUrl(date)
+        if not url:
+            return None
+        info = self._appinfo.get(url)
+        if info is None and self.index:
+            info = self.index.appInfo(url)
+        if info is None:
+            cached = self.getCached(date)
+            try:
+                if cached:
+                    info = read_app_info(cached)
+                if info is None:
+                    info = fetch_build_metadata(url, self.session)
+                if info is None and archives and not cached:
+                    info = fetch_app_info(url, self.session)
+            except (DownloadError, socket.error, httplib.HTTPException):
+                # e.g. a zip on a server without range requests, or a server
+                # that times out: one nightly without it doesn't stop the rest
+                return None
+            if info is None:
+                return None
+            if self.index:
+                self.index.addAppInfo(url, *info)
+        self._appinfo[url] = info
+        return info
+
+    def probeAppInfos(self, dates, threads=8):
+        """Return a dict of the (repo, changeset) of the nightlies from
+           |dates| that publish metadata files, fetched on a pool of
+           |threads|. No archive is downloaded."""
+        if not dates:
+            return {}
+        if self.index:
+            # one crawl of the range rather than one per day
+            Crawler(self, self.index, threads).crawl(min(dates), max(dates))
+        pool = ThreadPool(threads)
+        try:
+            infos = pool.map(lambda date: self.probeAppInfo(date, archives=False), dates)
+        finally:
+            pool.close()
+        return dict([(date, info) for (date, info) in zip(dates, infos) if info])
+
+    def getProfileClass(self):
+        # mozprofile and mozrunner take long to import, and aren't needed
+        # until a nightly runs
+        import mozprofile
+        return getattr(mozprofile, self.profileName)
+
+    def start(self, profile, addons, cmdargs, env=None, cloneProfile=False):
+        from mozrunner import Runner
+        profileClass = self.getProfileClass()
+        if profile and cloneProfile:
+            # nightlies running side by side can't share a profile
+            profile = profileClass.clone(profile, addons=addons)
+        elif profile:
+            profile = profileClass(profile=profile, addons=addons)
+        elif addons:
+            profile = profileClass(addons=addons)
         else:
-            profile = self.profileClass()
+            profile = profileClass()
 
-        self.runner = Runner(binary=self.binary, cmdargs=cmdargs, profile=profile)
+        self.runner = Runner(binary=self.binary, cmdargs=cmdargs, profile=profile, env=env)
         self.runner.names = [self.processName]
         self.runner.start()
         return True
@@ -150,7 +375,7 @@ class Nightly(object):
 class ThunderbirdNightly(Nightly):
     appName = 'thunderbird'
     name = 'thunderbird'
-    profileClass = ThunderbirdProfile
+    profileName = 'ThunderbirdProfile'
 
     def getRepoName(self, date):
         # sneaking this in here
@@ -172,7 +397,7 @@ class ThunderbirdNightly(Nightly):
 class FirefoxNightly(Nightly):
     appName = 'firefox'
     name = 'firefox'
-    profileClass = FirefoxProfile
+    profileName = 'FirefoxProfile'
 
     def getRepoName(self, date):
         if date < datetime.date(2008, 6, 17):
@@ -183,11 +408,13 @@ class FirefoxNightly(Nightly):
 class FennecNightly(Nightly):
     appName = 'mobile'
     name = 'fennec'
-    profileClass = FirefoxProfile
+    profileName = 'FirefoxProfile'
+    storable = False
 
-    def __init__(self, repo_name=None):
-        Nightly.__init__(self, repo_name)
-        self.buildRegex = 'fennec-.*\.apk'
+    def __init__(self, repo_name=None, cache=None, listings=None, index=None,
+                 session=None, installDir="moznightlyapp"):
+        Nightly.__init__(self, repo_name, cache, listings, index, session, installDir)
+        self.buildRegex = re.compile('fennec-.*\.apk')
         self.processName = 'org.mozilla.fennec'
         self.binary = 'org.mozilla.fennec/.App'
         if "y" != raw_input("WARNING: bisecting nightly fennec builds will clobber your existing nightly profile. Continue? (y or n)"):
@@ -196,12 +423,16 @@ class FennecNightly(Nightly):
     def getRepoName(self, date):
         return "mozilla-central-android"
 
-    def install(self):
+    def extract(self, src, dest):
+        # apks are installed through adb, there is nothing to extract
+        return None
+
+    def install(self, extracted=None):
         subprocess.check_call(["adb", "uninstall", "org.mozilla.fennec"])
         subprocess.check_call(["adb", "install", self.dest])
         return True
 
-    def start(self, profile, addons, cmdargs):
+    def start(self, profile, addons, cmdargs, env=None, cloneProfile=False):
         subprocess.check_call(["adb", "shell", "am start -n %s" % self.binary])
         return True
 
@@ -211,30 +442,139 @@ class FennecNightly(Nightly):
         # adb shell run-as org.mozilla.fennec kill $PID
         return True
 
+class TemplateNightly(Nightly):
+    """The builds of a configured binaryRepository, found under its location
+       template (see location.LocationTemplate) through the backend of its
+       protocol rather than in ftp.mozilla.org's listings. Downloads go
+       through the same archive cache and prefetching."""
+    profileName = 'FirefoxProfile'
+
+    def __init__(self, name, template, backend, cache=None, index=None, session=None,
+                 installDir="moznightlyapp"):
+        self.name = self.appName = name
+        Nightly.__init__(self, cache=cache, index=index, session=session,
+                         installDir=installDir, backend=backend)
+        self.template = template
+        self.builds = None
+        self.walked = None
+
+    def getRepoName(self, date):
+        return self.template.host or "local"
+
+    def walk(self, start, end):
+        # one walk covers every lookup inside its range
+        if not self.walked or not (self.walked[0] <= start and end <= self.walked[1]):
+            self.builds = self.template.walk(self.backend.listdirs, start, end,
+                                             {'appname': self.name})
+            self.walked = (start, end)
+        return self.builds
+
+    def getBuildDates(self, start, end):
+        return [date for date in self.walk(start, end).dates() if start < date < end]
+
+    def getBuildUrl(self, date):
+        build = self.walk(date, date).lookup(date)
+        if build:
+            return build.path
+        return False
+
+    def probeAppInfo(self, date, archives=True):
+        # the path has the changeset, if the template does, but not which
+        # repository it is from
+        build = self.walk(date, date).lookup(date)
+        if build and build.commitid:
+            return (None, build.commitid)
+        return None
+
+    def probeAppInfos(self, dates, threads=8):
+        if not dates:
+            return {}
+        self.walk(min(dates), max(dates))
+        infos = [(date, self.probeAppInfo(date)) for date in dates]
+        return dict([(date, info) for (date, info) in infos if info])
+
 class NightlyRunner(object):
     apps = {'thunderbird': ThunderbirdNightly,
             'fennec': FennecNightly,
             'firefox': FirefoxNightly}
 
     def __init__(self, addons=None, appname="firefox", repo_name=None,
-                 profile=None, cmdargs=()):
-        self.app = self.apps[appname](repo_name=repo_name)
+                 profile=None, cmdargs=(), prefetch=False, prefetch_extract=False,
+                 cache=None, segments=1, listings=None, index=None,
+                 timeout=DEFAULT_TIMEOUT, headless=False, session=None,
+                 installDir="moznightlyapp", store=None, template=None, backend=None):
+        # every request of the session goes through one pool of keep-alive
+        # connections
+        self.session = session or HttpSession(timeout=timeout)
+        if template:
+            self.app = TemplateNightly(appname, template, backend, cache=cache, index=index,
+                                       session=self.session, installDir=installDir)
+        else:
+            self.app = self.apps[appname](repo_name=repo_name, cache=cache, listings=listings,
+                                          index=index, session=self.session,
+                                          installDir=installDir)
+        self.app.segments = segments
+        self.appname = appname
         self.addons = addons
         self.profile = profile
         self.cmdargs = list(cmdargs)
+        self.headless = headless
+        self.cloneProfile = False
+        self.store = None
+        if self.app.storable:
+            self.store = store
+        self.prefetcher = None
+        if prefetch:
+            self.prefetcher = Prefetcher(self.app, extract=prefetch_extract)
+
+    def prefetch(self, date):
+        if self.prefetcher:
+            self.prefetcher.prefetch(date)
+
+    def cancelPrefetch(self, date):
+        if self.prefetcher:
+            self.prefetcher.cancel(date)
+
+    def prefetchStatus(self):
+        if self.prefetcher:
+            return self.prefetcher.status()
+        return ""
 
     def install(self, date=datetime.date.today()):
-        if not self.app.download(date=date):
-            print "Could not find nightly from %s" % date
-            return False # download failed
-        print "Installing nightly"
-        return self.app.install()
+        if self.store:
+            rmtree(self.app.installDir)
+            if self.store.checkout(self.app.getCacheKey(date), self.app.installDir):
+                print "Using stored nightly from %s" % date
+                # a prefetch of it isn't needed anymore
+                self.cancelPrefetch(date)
+                return True
+
+        prefetched = None
+        if self.prefetcher:
+            prefetched = self.prefetcher.claim(date)
+        if prefetched:
+            print "Using prefetched nightly from %s" % date
+            self.app.setDownload(prefetched.dest)
+            print "Installing nightly"
+            installed = self.app.install(extracted=prefetched.extracted)
+        else:
+            installed = self.app.downloadAndInstall(date)
+            if not installed:
+                print "Could not find nightly from %s" % date
+                return False # download failed
+        if installed and self.store:
+            self.store.add(self.app.getCacheKey(date), self.app.installDir)
+        return installed
 
     def start(self, date=datetime.date.today()):
         if not self.install(date):
             return False
         print "Starting nightly"
-        if not self.app.start(self.profile, self.addons, self.cmdargs):
+        env = None
+        if self.headless:
+            env = dict(os.environ)
+            env['MOZ_HEADLESS'] = '1'
+        if not self.app.start(self.profile, self.addons, self.cmdargs, env, self.cloneProfile):
             return False
         return True
 
@@ -245,11 +585,42 @@ class NightlyRunner(object):
         self.app.wait()
 
     def cleanup(self):
+        if self.prefetcher:
+            self.prefetcher.cleanup()
         self.app.cleanup()
 
     def getAppInfo(self):
         return self.app.getAppInfo()
 
+    def probeAppInfo(self, date):
+        return self.app.probeAppInfo(date)
+
+    def probeAppInfos(self, dates):
+        return self.app.probeAppInfos(dates)
+
+    def getBinary(self):
+        return os.path.abspath(self.app.binary)
+
+    def getBuildDates(self, start, end):
+        return self.app.getBuildDates(start, end)
+
+    def spawn(self, installDir):
+        """Return a runner that can test another nightly at the same time as
+           this one. It shares the caches, index and connections, but installs
+           into |installDir|, next to this runner's install directory, and
+           runs a copy of the profile."""
+        installDir = os.path.join(os.path.dirname(self.app.installDir), installDir)
+        runner = NightlyRunner(addons=self.addons, appname=self.appname,
+                               repo_name=self.app.repo_name, profile=self.profile,
+                               cmdargs=self.cmdargs, cache=self.app.cache,
+                               segments=self.app.segments, listings=self.app.listings,
+                               index=self.app.index, headless=self.headless,
+                               session=self.session, installDir=installDir, store=self.store,
+                               template=getattr(self.app, 'template', None),
+                               backend=self.app.backend)
+        runner.cloneProfile = True
+        return runner
+
 def cli(args=sys.argv[1:]):
     """moznightly command line entry point"""
 
@@ -268,13 +639,41 @@ def cli(args=sys.argv[1:]):
                       default="firefox")
     parser.add_option("-r", "--repo", dest="repo_name", help="repository name on ftp.mozilla.org",
                       metavar="[tracemonkey|mozilla-1.9.2]", default=None)
+    parser.add_option("--cache-dir", dest="cache_dir", help="directory to keep downloaded nightlies in",
+                      metavar="PATH", default=DEFAULT_CACHE_DIR)
+    parser.add_option("--cache-size", dest="cache_size", type="int",
+                      help="maximum size of the nightly cache in megabytes",
+                      metavar="MB", default=DEFAULT_CACHE_SIZE / (1024 * 1024))
+    parser.add_option("--no-cache", dest="no_cache", action="store_true",
+                      help="don't keep downloaded or extracted nightlies, server listings or the build index",
+                      default=False)
+    parser.add_option("--segments", dest="segments", type="int",
+                      help="number of connections to download each nightly over",
+                      metavar="N", default=1)
+    parser.add_option("--timeout", dest="timeout", type="float",
+                      help="seconds to wait for the server before giving up",
+                      metavar="SECONDS", default=DEFAULT_TIMEOUT)
+    parser.add_option("--store-size", dest="store_size", type="int",
+                      help="maximum size of the store of extracted nightlies in megabytes, "
+                           "0 to extract every nightly afresh",
+                      metavar="MB", default=DEFAULT_STORE_SIZE / (1024 * 1024))
     options, args = parser.parse_args(args)
     # XXX https://github.com/mozilla/mozregression/issues/50
     addons = strsplit(options.addons or "", ",")
 
+    cache = listings = index = store = None
+    if not options.no_cache:
+        cache = ArchiveCache(options.cache_dir, options.cache_size * 1024 * 1024)
+        listings = ListingCache()
+        index = BuildIndex()
+        if options.store_size:
+            store = BuildStore(maxBytes=options.store_size * 1024 * 1024)
+
     # run nightly
     runner = NightlyRunner(appname=options.app, addons=addons,
-                           profile=options.profile, repo_name=options.repo_name)
+                           profile=options.profile, repo_name=options.repo_name,
+                           cache=cache, segments=options.segments, listings=listings,
+                           index=index, timeout=options.timeout, store=store)
     runner.start(get_date(options.date))
     try:
         runner.wait()
@@ -0,0 +1,172 @@
+import os
+import socket
+import threading
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+
+import paramiko
+
+from download import CHUNK_SIZE, copy_stream
+
+# SFTP sessions opened over each host's connection at most, i.e. how many
+# listings or downloads can be in flight to one host at once.
+DEFAULT_CHANNELS = 4
+DEFAULT_TIMEOUT = 60
+
+class _Host(object):
+    """One SSH connection to |host| and the SFTP sessions open over it."""
+
+    def __init__(self, pool, host):
+        self.pool = pool
+        self.host = host
+        self.client = None
+        self.lock = threading.Lock()
+        self.idle = []
+        self.slots = threading.BoundedSemaphore(pool.channels)
+
+    def transport(self):
+        with self.lock:
+            if self.client and self.client.get_transport() and \
+               self.client.get_transport().is_active():
+                return self.client.get_transport()
+            # first use, or the connection dropped: the sessions went with it
+            self.idle = []
+            client = paramiko.SSHClient()
+            try:
+                client.load_system_host_keys()
+            except IOError:
+                pass
+            client.set_missing_host_key_policy(self.pool.hostKeyPolicy)
+            client.connect(self.host, port=self.pool.port, username=self.pool.username,
+                           password=self.pool.password, timeout=self.pool.timeout)
+            self.client = client
+            return client.get_transport()
+
+    @contextmanager
+    def session(self):
+        self.slots.acquire()
+        try:
+            transport = self.transport()
+            with self.lock:
+                sftp = self.idle and self.idle.pop()
+            if not sftp:
+                sftp = paramiko.SFTPClient.from_transport(transport)
+                sftp.get_channel().settimeout(self.pool.timeout)
+            try:
+                yield sftp
+            except (EOFError, socket.error, paramiko.SSHException):
+                # the connection is gone, the next session reconnects
+                sftp.close()
+                raise
+            except Exception:
+                # a failed request (e.g. no such file) leaves the session fine
+                with self.lock:
+                    self.idle.append(sftp)
+                raise
+            with self.lock:
+                self.idle.append(sftp)
+        finally:
+            self.slots.release()
+
+    def close(self):
+        with self.lock:
+            for sftp in self.idle:
+                sftp.close()
+            self.idle = []
+            if self.client:
+                self.client.close()
+                self.client = None
+
+class SFTPPool(object):
+    """SFTP access to any number of hosts, over one SSH connection per host
+       kept open for as long as the pool is. Each connection carries up to
+       |channels| SFTP sessions, so listings and downloads run side by side
+       without another handshake each. Without a |password|, the SSH agent
+       and the usual keys are tried."""
+
+    def __init__(self, username=None, password=None, port=22, channels=DEFAULT_CHANNELS,
+                 timeout=DEFAULT_TIMEOUT, hostKeyPolicy=None):
+        self.username = username
+        self.password = password
+        self.port = port
+        self.channels = channels
+        self.timeout = timeout
+        self.hostKeyPolicy = hostKeyPolicy or paramiko.AutoAddPolicy()
+        self.lock = threading.Lock()
+        self.hosts = {}
+
+    def _host(self, host):
+        with self.lock:
+            if host not in self.hosts:
+                self.hosts[host] = _Host(self, host)
+            return self.hosts[host]
+
+    def connect(self, host):
+        """Open the connection to |host| now rather than on first use, e.g. to
+           check the credentials. Raises paramiko.AuthenticationException if
+           they are refused."""
+        self._host(host).transport()
+
+    def listdir(self, host, path):
+        with self._host(host).session() as sftp:
+            return sftp.listdir(path)
+
+    def listdirs(self, host, paths):
+        """Return a dict of the listings of |paths| on |host|, fetched over
+           the host's sessions at once. Paths that can't be listed are left
+           out."""
+        def listOne(path):
+            try:
+                return self.listdir(host, path)
+            except IOError:
+                return None
+
+        if not paths:
+            return {}
+        pool = ThreadPool(min(self.channels, len(paths)))
+        try:
+            listings = pool.map(listOne, paths)
+        finally:
+            pool.close()
+        return dict([(path, listing) for (path, listing) in zip(paths, listings)
+                     if listing is not None])
+
+    def stat(self, host, path):
+        with self._host(host).session() as sftp:
+            return sftp.stat(path)
+
+    @contextmanager
+    def open(self, host, path):
+        """Open |path| on |host| for reading. Its reads are requested ahead,
+           many at a time, rather than one round trip per read."""
+        with self._host(host).session() as sftp:
+            fp = sftp.open(path, 'rb')
+            try:
+                fp.prefetch()
+                yield fp
+            finally:
+                fp.close()
+
+    def fetch(self, host, path, dest, progress=None, chunkSize=CHUNK_SIZE):
+        """Download |path| from |host| to |dest|. |progress| is called as
+           for download.copy_stream."""
+        tmp = '%s.%d.part' % (dest, os.getpid())
+        try:
+            with self.open(host, path) as fp:
+                out = open(tmp, 'wb')
+                try:
+                    copy_stream(fp, out, fp.stat().st_size, progress, chunkSize)
+                finally:
+                    out.close()
+            os.rename(tmp, dest)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        return dest
+
+    def close(self):
+        with self.lock:
+            hosts = self.hosts.values()
+            self.hosts = {}
+        for host in hosts:
+            host.close()
@@ -2,12 +2,24 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import os
 import re
-import httplib2
 import datetime
 import platform
 
+from download import download
+
+_platform = None
+
 def get_platform():
+    """Return the name, version, bits and cpu of this machine. They're
+       found once: platform.linux_distribution() reads files every call."""
+    global _platform
+    if _platform is None:
+        _platform = _detect_platform()
+    return dict(_platform)
+
+def _detect_platform():
     uname = platform.uname()
     name = uname[0]
     version = uname[2]
@@ -44,16 +56,11 @@ def strsplit(string, sep):
       return []
     return strlist
 
-def download_url(url, dest=None):
-    h = httplib2.Http()
-    resp, content = h.request(url, "GET")
+def download_url(url, dest=None, progress=None, segments=1, session=None):
     if dest == None:
         dest = os.path.basename(url)
 
-    local = open(dest, 'wb')
-    local.write(content)
-    local.close()
-    return dest
+    return download(url, dest, progress, segments=segments, session=session)
 
 def get_date(dateString):
     p = re.compile('(\d{4})\-(\d{1,2})\-(\d{1,2})')